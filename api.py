@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+# Fuera de Streamlit, st.cache_data guarda en memoria del proceso y avisa de ello al decorar cada función de datos.py:
+# el filtro tiene que estar puesto antes de importarlo
+logging.getLogger("streamlit.runtime.caching.cache_data_api").addFilter(lambda registro: "No runtime found" not in registro.getMessage())
+
+from cache_analitica import CacheLRU, clave_filtros, memoizar
+from datos import DB_PATH, cargar_ledger, cargar_opciones_filtro, obtener_pool, version_bd
+from helper import (
+    COLUMNAS_DERIVADAS,
+    calcular_kpis,
+    calcular_rentabilidad_por_activo,
+    calcular_rentabilidad_anual,
+    calcular_tir_anual,
+    calcular_tir_acumulado_en_tiempo
+)
+
+try:
+    import pyarrow as pa
+except ImportError:  # el formato Arrow es opcional
+    pa = None
+
+FORMATOS = ["json", "ndjson", "csv", "arrow"]
+TIPOS_CONTENIDO = {
+    "json": "application/json", "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8", "arrow": "application/vnd.apache.arrow.stream"
+}
+FRECUENCIAS_TIR = ["W", "D", "MS"]
+TAMANO_BLOQUE = 5000
+
+_cache = CacheLRU(max_bytes=256 * 1024 * 1024)
+
+
+# === CONSULTAS (mismo motor y misma capa de datos que el dashboard) ===
+def resolver_filtros(desde=None, hasta=None, activos=None, tipos=None, db_path=DB_PATH):
+    # Sin filtro se usa lo mismo que el dashboard por defecto: todo el rango, todos los activos y tipos.
+    # Las fechas se truncan al día (00:00), como las del selector de fechas del dashboard: "hasta" incluye solo las
+    # operaciones de medianoche de ese día, y el rango por defecto termina a las 00:00 del día de la última operación
+    version = version_bd(db_path)
+    opciones = cargar_opciones_filtro(version, db_path=db_path)
+    return {
+        "version": version,
+        "fecha_inicio": pd.Timestamp(desde or opciones["fecha_min"]).normalize(),
+        "fecha_fin": pd.Timestamp(hasta or opciones["fecha_max"]).normalize(),
+        "activos": tuple(sorted(activos)) if activos else tuple(opciones["activos"]),
+        "tipos": tuple(sorted(tipos)) if tipos else tuple(opciones["tipos"])
+    }
+
+
+def _anual(df):
+    return calcular_rentabilidad_anual(df).merge(calcular_tir_anual(df), on="año", how="left")
+
+
+def _transacciones(df):
+    return df.drop(columns=COLUMNAS_DERIVADAS)
+
+
+# nombre -> función de helper.py sobre el ledger filtrado
+CONSULTAS = {
+    "kpis": calcular_kpis,
+    "activos": calcular_rentabilidad_por_activo,
+    "anual": _anual,
+    "tir": calcular_tir_acumulado_en_tiempo,
+    "transacciones": _transacciones
+}
+
+
+def consultar(nombre, filtros, frecuencia="W", db_path=DB_PATH):
+    if nombre not in CONSULTAS:
+        raise KeyError(f"Consulta desconocida: {nombre} (disponibles: {', '.join(CONSULTAS)})")
+    if frecuencia not in FRECUENCIAS_TIR:
+        raise ValueError(f"Frecuencia no válida: {frecuencia} (usa {', '.join(FRECUENCIAS_TIR)})")
+
+    df = cargar_ledger(filtros["version"], filtros["fecha_inicio"], filtros["fecha_fin"], filtros["activos"], filtros["tipos"], db_path=db_path)
+    if df.empty:
+        raise LookupError("No hay datos para los filtros indicados")
+    estado = clave_filtros(db_path + "|" + filtros["version"], filtros["fecha_inicio"], filtros["fecha_fin"], filtros["activos"], filtros["tipos"])
+    if nombre == "tir":
+        return memoizar(_cache, estado, calcular_tir_acumulado_en_tiempo, df, frecuencia=frecuencia)
+    if nombre == "transacciones":
+        return _transacciones(df)
+    return memoizar(_cache, estado, CONSULTAS[nombre], df)
+
+
+# === SERIALIZACIÓN POR BLOQUES ===
+def _a_tabla(resultado):
+    # Los KPIs (dict) se sirven como una tabla de una fila
+    if isinstance(resultado, dict):
+        return pd.DataFrame([{k: (None if v is None else float(v)) for k, v in resultado.items()}])
+    return resultado
+
+
+def escribir_resultado(resultado, formato, salida):
+    # salida: fichero binario (respuesta HTTP, stdout...). Se escribe por bloques de como mucho TAMANO_BLOQUE filas:
+    # ni el servidor ni el cliente necesitan tener el documento completo en memoria
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no válido: {formato} (usa {', '.join(FORMATOS)})")
+    if formato == "arrow" and pa is None:
+        raise ValueError("El formato arrow necesita pyarrow")
+
+    if formato == "json" and isinstance(resultado, dict):
+        kpis = _a_tabla(resultado).iloc[0].replace({np.nan: None}).to_dict()
+        salida.write(json.dumps(kpis, ensure_ascii=False).encode())
+        return
+
+    tabla = _a_tabla(resultado)
+    if formato == "arrow":
+        datos = pa.Table.from_pandas(tabla, preserve_index=False)
+        with pa.ipc.new_stream(salida, datos.schema) as escritor:
+            for lote in datos.to_batches(max_chunksize=TAMANO_BLOQUE):
+                escritor.write_batch(lote)
+        return
+
+    if formato == "json":
+        salida.write(b"[")
+    for i, inicio in enumerate(range(0, max(len(tabla), 1), TAMANO_BLOQUE)):
+        bloque = tabla.iloc[inicio:inicio + TAMANO_BLOQUE]
+        if formato == "csv":
+            salida.write(bloque.to_csv(index=False, header=(i == 0), date_format="%Y-%m-%d %H:%M:%S").encode())
+        elif bloque.empty:
+            continue
+        elif formato == "ndjson":
+            salida.write(bloque.to_json(orient="records", lines=True, date_format="iso", force_ascii=False).rstrip("\n").encode() + b"\n")
+        else:
+            salida.write((b"," if i else b"") + bloque.to_json(orient="records", date_format="iso", force_ascii=False)[1:-1].encode())
+    if formato == "json":
+        salida.write(b"]")
+
+
+# === SERVIDOR HTTP ===
+def formato_pedido(parametros, cabecera_accept):
+    if "formato" in parametros:
+        return parametros["formato"][-1]
+    for formato, tipo in TIPOS_CONTENIDO.items():
+        if tipo.split(";")[0] in (cabecera_accept or ""):
+            return formato
+    return "json"
+
+
+class ManejadorApi(BaseHTTPRequestHandler):
+    # GET /<consulta>?desde=&hasta=&activo=&tipo=&frecuencia=&formato=  ·  GET /salud
+    # Sin Content-Length: la respuesta se envía a medida que se genera y termina al cerrar la conexión (HTTP/1.0)
+    db_path = DB_PATH
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        nombre = url.path.strip("/")
+        parametros = parse_qs(url.query)
+        try:
+            if nombre == "salud":
+                cuerpo = {"version": version_bd(self.db_path), "consultas": list(CONSULTAS), "cache": _cache.estadisticas()}
+                return self._responder_json(200, cuerpo)
+            if nombre not in CONSULTAS:
+                return self._responder_json(404, {"error": f"Consulta desconocida: {nombre}", "consultas": list(CONSULTAS)})
+            formato = formato_pedido(parametros, self.headers.get("Accept"))
+            if formato not in FORMATOS or (formato == "arrow" and pa is None):
+                return self._responder_json(406, {"error": f"Formato no disponible: {formato}"})
+            filtros = resolver_filtros(
+                parametros.get("desde", [None])[-1], parametros.get("hasta", [None])[-1],
+                parametros.get("activo"), parametros.get("tipo"), self.db_path
+            )
+            resultado = consultar(nombre, filtros, parametros.get("frecuencia", ["W"])[-1], self.db_path)
+        except LookupError as e:
+            return self._responder_json(404, {"error": str(e)})
+        except ValueError as e:
+            return self._responder_json(400, {"error": str(e)})
+        except Exception as e:
+            self.log_error("Error en %s: %r", self.path, e)
+            return self._responder_json(500, {"error": "Error interno"})
+
+        self.send_response(200)
+        self.send_header("Content-Type", TIPOS_CONTENIDO[formato])
+        self.send_header("X-Version-Datos", filtros["version"])
+        self.end_headers()
+        try:
+            escribir_resultado(resultado, formato, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente cerró la conexión a mitad de la respuesta
+
+    def _responder_json(self, estado, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False, default=str).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", TIPOS_CONTENIDO["json"])
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+
+def servir(host="127.0.0.1", puerto=8765, db_path=DB_PATH, conexiones=None):
+    # Un hilo por petición; todos comparten el pool de conexiones de solo lectura y las cachés de datos y resultados
+    obtener_pool(db_path, conexiones)
+    ManejadorApi.db_path = db_path
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorApi)
+    servidor.daemon_threads = True
+    print(f"API de analítica en http://{host}:{servidor.server_port} ({', '.join(CONSULTAS)}, salud)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        obtener_pool(db_path).cerrar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analítica de la cartera sin navegador: consultas por línea de comandos o servidor HTTP")
+    parser.add_argument("--db", default=DB_PATH)
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_servir = subparsers.add_parser("servir", help="Servidor HTTP local (JSON, NDJSON, CSV o Arrow)")
+    parser_servir.add_argument("--host", default="127.0.0.1")
+    parser_servir.add_argument("--puerto", type=int, default=8765)
+    parser_servir.add_argument("--conexiones", type=int, help="Conexiones de solo lectura del pool (por defecto CARTERA_CONEXIONES o 4)")
+
+    for nombre in CONSULTAS:
+        parser_consulta = subparsers.add_parser(nombre, help=f"Escribe la consulta {nombre} en la salida estándar o en --salida")
+        parser_consulta.add_argument("--desde")
+        parser_consulta.add_argument("--hasta")
+        parser_consulta.add_argument("--activo", action="append", help="Se puede repetir; por defecto todos")
+        parser_consulta.add_argument("--tipo", action="append", help="Tipo de operación; se puede repetir; por defecto todos")
+        parser_consulta.add_argument("--frecuencia", default="W", choices=FRECUENCIAS_TIR, help="Solo para tir")
+        parser_consulta.add_argument("--formato", default="json", choices=FORMATOS)
+        parser_consulta.add_argument("--salida", help="Fichero de salida (por defecto, la salida estándar)")
+
+    args = parser.parse_args()
+    if args.comando == "servir":
+        servir(args.host, args.puerto, args.db, args.conexiones)
+        sys.exit(0)
+
+    try:
+        filtros = resolver_filtros(args.desde, args.hasta, args.activo, args.tipo, args.db)
+        resultado = consultar(args.comando, filtros, args.frecuencia, args.db)
+    except (LookupError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.salida:
+        with open(args.salida, "wb") as f:
+            escribir_resultado(resultado, args.formato, f)
+    else:
+        escribir_resultado(resultado, args.formato, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
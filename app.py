@@ -11,5 +11,5 @@ Bienvenido al sistema de análisis y gestión de tu cartera de inversiones.
 Utiliza el menú lateral izquierdo para navegar entre las distintas funcionalidades:
 - Visualizar KPIs, rentabilidad y transacciones
 - Registrar nuevos movimientos
-- (Opcional) Analizar escenarios futuros
+- Proyectar escenarios futuros de la cartera (simulación Monte Carlo)
 """)
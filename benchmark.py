@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from escenarios import simular_escenarios
+from generador import generar_ledger_sintetico
+from helper import (
+    xirr, xirr_arrays, filtrar_flujos_validos, obtener_cashflows, calcular_porcentaje, calcular_rentabilidad_por_activo,
+    calcular_rentabilidad_anual, calcular_tir_anual, calcular_tir_acumulado_en_tiempo, calcular_kpis, tipar_ledger
+)
+
+RUTA_REFERENCIA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_referencia.json")
+
+
+# === IMPLEMENTACIÓN ANTERIOR (referencia) ===
+def xirr_legado(cashflows, guess=0.1, max_iterations=100, tol=1e-6):
+    cashflows = sorted(cashflows, key=lambda x: x[0])
+    if len(cashflows) < 2:
+        return None
+
+    days = [(cf[0] - cashflows[0][0]).days for cf in cashflows]
+    values = [cf[1] for cf in cashflows]
+
+    def f(rate):
+        try:
+            return sum([v / ((1 + rate) ** (d / 365.0)) for v, d in zip(values, days)])
+        except Exception:
+            return float('nan')
+
+    def f_derivative(rate):
+        try:
+            return sum([- (d / 365.0) * v / ((1 + rate) ** ((d / 365.0) + 1)) for v, d in zip(values, days)])
+        except Exception:
+            return float('nan')
+
+    rate = guess
+    for _ in range(max_iterations):
+        if rate <= -0.999:
+            return None
+
+        f_val, f_deriv = f(rate), f_derivative(rate)
+        if f_val != f_val or f_deriv != f_deriv or abs(f_deriv) < 1e-10:
+            return None
+
+        new_rate = rate - f_val / f_deriv
+        if abs(new_rate - rate) < tol:
+            return new_rate
+        rate = new_rate
+
+    return None
+
+
+def obtener_cashflows_legado(df):
+    return df.apply(
+        lambda r: (
+            r["fecha_hora"].to_pydatetime(),
+            -r["importe_euros"]
+        ), axis=1
+    ).values.tolist()
+
+
+def porcentaje_legado(df, numerador, denominador, solo_positivo=False, defecto=None):
+    if solo_positivo:
+        return df.apply(lambda r: r[numerador] / r[denominador] * 100 if r[denominador] > 0 else defecto, axis=1)
+    return df.apply(lambda r: (r[numerador] / r[denominador] * 100) if r[denominador] != 0 else defecto, axis=1)
+
+
+# === DATOS SINTÉTICOS ===
+def generar_cashflows(n, semilla=0):
+    # Aportes negativos repartidos en ~10 años y un valor final positivo con un 30 % de plusvalía
+    rng = np.random.default_rng(semilla)
+    inicio = datetime(2015, 1, 1)
+    minutos = np.sort(rng.integers(0, 10 * 365 * 24 * 60, size=n - 1))
+    importes = -rng.uniform(10, 1000, size=n - 1)
+    cashflows = [(inicio + timedelta(minutes=int(m)), float(v)) for m, v in zip(minutos, importes)]
+    cashflows.append((inicio + timedelta(days=10 * 365), float(-importes.sum() * 1.3)))
+    return cashflows
+
+
+def cronometrar(func, *args, repeticiones=1, estadistico=min):
+    tiempos, resultado = [], None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = func(*args)
+        tiempos.append(time.perf_counter() - t0)
+    return estadistico(tiempos), resultado
+
+
+# === BENCHMARKS ===
+def benchmark_xirr(tamanos, incluir_legado=True):
+    # "numpy" incluye la conversión desde la lista de tuplas; "arrays" mide solo el solver
+    print(f"{'flujos':>10} | {'legado (s)':>11} | {'numpy (s)':>10} | {'arrays (s)':>10} | {'mejora':>7} | TIR")
+    for n in tamanos:
+        cashflows = generar_cashflows(n)
+        fechas = pd.to_datetime([cf[0] for cf in cashflows]).values
+        importes = np.array([cf[1] for cf in cashflows])
+        repeticiones = 3 if n <= 10_000 else 1
+        t_nuevo, tir_nuevo = cronometrar(xirr, cashflows, repeticiones=repeticiones)
+        t_arrays, _ = cronometrar(xirr_arrays, fechas, importes, repeticiones=repeticiones)
+        if incluir_legado:
+            t_legado, tir_legado = cronometrar(xirr_legado, cashflows, repeticiones=repeticiones)
+            if tir_legado is not None and abs(tir_legado - tir_nuevo) > 1e-6:
+                print(f"  ⚠️ discrepancia: legado={tir_legado} numpy={tir_nuevo}")
+            print(f"{n:>10} | {t_legado:>11.4f} | {t_nuevo:>10.4f} | {t_arrays:>10.4f} | {t_legado / t_nuevo:>6.1f}x | {tir_nuevo:.6f}")
+        else:
+            print(f"{n:>10} | {'-':>11} | {t_nuevo:>10.4f} | {t_arrays:>10.4f} | {'-':>7} | {tir_nuevo:.6f}")
+
+
+def benchmark_columnar(n):
+    # Tiempos de las versiones por filas (apply) frente a las columnares; que den lo mismo lo comprueba tests/test_columnar.py
+    ledger = generar_ledger_sintetico(n)
+    flujos = filtrar_flujos_validos(ledger)
+
+    t_legado, legado = cronometrar(obtener_cashflows_legado, flujos)
+    t_nuevo, _ = cronometrar(obtener_cashflows, flujos)
+    print(f"obtener_cashflows ({len(flujos)} flujos): legado {t_legado:.3f}s | columnar {t_nuevo:.4f}s | {t_legado / t_nuevo:.0f}x")
+
+    tabla = pd.DataFrame({"beneficio": ledger["importe_euros"], "aportado": ledger["importe_euros"].shift(1).fillna(0).where(ledger.index % 10 != 0, 0)})
+    for solo_positivo, defecto in [(False, None), (True, 0)]:
+        t_legado, _ = cronometrar(porcentaje_legado, tabla, "beneficio", "aportado", solo_positivo, defecto)
+        t_nuevo, _ = cronometrar(calcular_porcentaje, tabla["beneficio"], tabla["aportado"], solo_positivo, np.nan if defecto is None else defecto)
+        print(f"porcentaje (solo_positivo={solo_positivo}, {n} filas): legado {t_legado:.3f}s | columnar {t_nuevo:.4f}s | {t_legado / t_nuevo:.0f}x")
+
+
+def benchmark_paralelo(n, n_activos, lista_workers, backends):
+    # Escalado de calcular_rentabilidad_por_activo por backend y nº de workers; cada resultado se compara con el serie.
+    # El pool se calienta antes de medir: su arranque se paga una vez por proceso, no en cada rerun
+    ledger = generar_ledger_sintetico(n, n_activos=n_activos)
+    t_serie, referencia = cronometrar(calcular_rentabilidad_por_activo, ledger, "serie", repeticiones=3)
+    print(f"{n} filas, {n_activos} activos, {os.cpu_count()} CPUs")
+    print(f"{'backend':>9} | {'workers':>7} | {'tiempo (s)':>10} | {'vs serie':>8}")
+    print(f"{'serie':>9} | {1:>7} | {t_serie:>10.4f} | {1:>7.2f}x")
+    for backend in backends:
+        for workers in lista_workers:
+            calcular_rentabilidad_por_activo(ledger, backend, workers)
+            tiempo, resultado = cronometrar(calcular_rentabilidad_por_activo, ledger, backend, workers, repeticiones=3)
+            pd.testing.assert_frame_equal(resultado, referencia)
+            print(f"{backend:>9} | {workers:>7} | {tiempo:>10.4f} | {t_serie / tiempo:>7.2f}x")
+
+
+def benchmark_tipado(n):
+    # Memoria y tiempos del ledger como objetos Python frente al ledger tipado (categorías y banderas precalculadas).
+    # Que los resultados coincidan lo comprueba tests/test_columnar.py
+    ledger = generar_ledger_sintetico(n)
+    t_tipar, tipado = cronometrar(tipar_ledger, ledger)
+    memoria, memoria_tipado = ledger.memory_usage(deep=True).sum() / 2**20, tipado.memory_usage(deep=True).sum() / 2**20
+    print(f"{n} filas: {memoria:.1f} MB -> {memoria_tipado:.1f} MB ({memoria / memoria_tipado:.1f}x menos), tipado en {t_tipar:.3f}s")
+    for funcion in (filtrar_flujos_validos, calcular_kpis, calcular_rentabilidad_por_activo, calcular_rentabilidad_anual,
+                    calcular_tir_anual, calcular_tir_acumulado_en_tiempo):
+        t_objeto, _ = cronometrar(funcion, ledger, repeticiones=3)
+        t_tipado, _ = cronometrar(funcion, tipado, repeticiones=3)
+        print(f"{funcion.__name__:<36}: objeto {t_objeto:.4f}s | tipado {t_tipado:.4f}s | {t_objeto / t_tipado:.1f}x")
+
+
+def benchmark_escenarios(lista_caminos, n_activos, meses, aportacion):
+    # Tiempo de la simulación Monte Carlo por nº de caminos; la media del valor final tiene que acercarse a su
+    # esperanza analítica (cada activo crece a su rentabilidad esperada, también las aportaciones)
+    rng = np.random.default_rng(0)
+    valores = rng.uniform(1_000, 20_000, n_activos)
+    rentabilidades, volatilidades = rng.uniform(-0.02, 0.12, n_activos), rng.uniform(0.05, 0.4, n_activos)
+    crecimiento = (1 + rentabilidades) ** (1 / 12)
+    aportaciones = aportacion * valores / valores.sum()
+    esperado = (valores * crecimiento ** meses + aportaciones * (crecimiento ** np.arange(meses)[:, None]).sum(axis=0)).sum()
+    print(f"{n_activos} activos, {meses} meses, aportación {aportacion:.0f} €/mes, {os.cpu_count()} CPUs")
+    for n_caminos in lista_caminos:
+        tiempo, resultado = cronometrar(simular_escenarios, valores, rentabilidades, volatilidades, meses, aportacion, n_caminos)
+        media = resultado["valor_final"].mean()
+        print(f"{n_caminos:>7} caminos: {tiempo:.2f}s | media {media:,.0f} € vs esperada {esperado:,.0f} € ({(media / esperado - 1) * 100:+.2f} %)")
+
+
+# === SUITE CON REFERENCIA ===
+def _cashflows_ledger(df):
+    # Flujos válidos de toda la cartera más su valor actual, en el formato de xirr (lista de tuplas)
+    flujos = filtrar_flujos_validos(df)
+    fechas, importes = obtener_cashflows(flujos)
+    cashflows = list(zip(pd.to_datetime(fechas).to_pydatetime(), importes.tolist()))
+    cashflows.append((df["fecha_hora"].max().to_pydatetime(), float(df["importe_euros"].sum())))
+    return (cashflows,)
+
+
+# nombre -> (preparación fuera del cronómetro, función medida)
+CASOS_SUITE = {
+    "xirr": (_cashflows_ledger, xirr),
+    "calcular_rentabilidad_por_activo": (lambda df: (df,), calcular_rentabilidad_por_activo),
+    "calcular_rentabilidad_anual": (lambda df: (df,), calcular_rentabilidad_anual),
+    "calcular_tir_anual": (lambda df: (df,), calcular_tir_anual),
+    "calcular_tir_acumulado_en_tiempo": (lambda df: (df,), calcular_tir_acumulado_en_tiempo)
+}
+
+
+def leer_referencia(ruta=RUTA_REFERENCIA):
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def benchmark_suite(tamanos, casos=None, ruta_referencia=RUTA_REFERENCIA, guardar=False, tolerancia=1.5, margen=0.01):
+    # Mide cada caso sobre ledgers sintéticos deterministas y lo compara con la referencia guardada.
+    # Se compara la mediana de varias repeticiones (también la guardada como referencia): el mínimo de pocas
+    # repeticiones depende de la suerte y una referencia "afortunada" daba regresiones falsas.
+    # Regresión: más lento que referencia * tolerancia y, además, por más de "margen" segundos (ruido de medida).
+    # Un caso que sale lento se vuelve a medir antes de reportarlo: una sola medida lenta suele ser ruido
+    # Devuelve la lista de regresiones; con guardar=True sustituye la referencia por esta ejecución
+    casos = casos or list(CASOS_SUITE)
+    referencia = leer_referencia(ruta_referencia).get("resultados", {})
+    resultados, regresiones = {}, []
+
+    print(f"{'caso':<36} | {'filas':>9} | {'tiempo (s)':>10} | {'ref. (s)':>9} | {'ratio':>6}")
+    for n in tamanos:
+        ledger = generar_ledger_sintetico(n)
+        repeticiones = 7 if n <= 100_000 else 3
+        for caso in casos:
+            preparar, funcion = CASOS_SUITE[caso]
+            argumentos = preparar(ledger)
+            tiempo, _ = cronometrar(funcion, *argumentos, repeticiones=repeticiones, estadistico=statistics.median)
+            clave = f"{caso}@{n}"
+            previo = referencia.get(clave)
+
+            def es_regresion(t):
+                return previo is not None and t > previo * tolerancia and t - previo > margen
+
+            if es_regresion(tiempo):
+                tiempo = min(tiempo, cronometrar(funcion, *argumentos, repeticiones=repeticiones, estadistico=statistics.median)[0])
+            resultados[clave] = round(tiempo, 6)
+
+            if previo is None:
+                print(f"{caso:<36} | {n:>9} | {tiempo:>10.4f} | {'-':>9} | {'-':>6}")
+                continue
+            ratio = tiempo / previo if previo > 0 else float("inf")
+            marca = ""
+            if es_regresion(tiempo):
+                regresiones.append(clave)
+                marca = "  ⚠️ regresión"
+            print(f"{caso:<36} | {n:>9} | {tiempo:>10.4f} | {previo:>9.4f} | {ratio:>5.2f}x{marca}")
+
+    if guardar:
+        datos = leer_referencia(ruta_referencia)
+        datos["maquina"] = {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                            "procesador": platform.processor() or platform.machine(), "fecha": datetime.now().isoformat(timespec="seconds")}
+        datos["resultados"] = {**datos.get("resultados", {}), **resultados}
+        with open(ruta_referencia, "w", encoding="utf-8") as f:
+            json.dump(datos, f, indent=2, ensure_ascii=False)
+        print(f"Referencia guardada en {ruta_referencia}")
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de las funciones de helper.py")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_xirr = subparsers.add_parser("xirr", help="xirr NumPy frente a la implementación anterior")
+    parser_xirr.add_argument("--tamanos", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser_xirr.add_argument("--sin-legado", action="store_true", help="No ejecutar la implementación anterior")
+
+    parser_columnar = subparsers.add_parser("columnar", help="Flujos y porcentajes columnares frente a DataFrame.apply")
+    parser_columnar.add_argument("--filas", type=int, default=1_000_000)
+
+    parser_paralelo = subparsers.add_parser("paralelo", help="Escalado de calcular_rentabilidad_por_activo con hilos y procesos")
+    parser_paralelo.add_argument("--filas", type=int, default=1_000_000)
+    parser_paralelo.add_argument("--activos", type=int, default=400)
+    parser_paralelo.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser_paralelo.add_argument("--backends", nargs="+", choices=["hilos", "procesos"], default=["hilos", "procesos"])
+
+    parser_tipado = subparsers.add_parser("tipado", help="Memoria y tiempos del ledger tipado (categorías y banderas) frente a objetos")
+    parser_tipado.add_argument("--filas", type=int, default=1_000_000)
+
+    parser_escenarios = subparsers.add_parser("escenarios", help="Simulación Monte Carlo de escenarios futuros por nº de caminos")
+    parser_escenarios.add_argument("--caminos", type=int, nargs="+", default=[10_000, 100_000])
+    parser_escenarios.add_argument("--activos", type=int, default=30)
+    parser_escenarios.add_argument("--meses", type=int, default=120)
+    parser_escenarios.add_argument("--aportacion", type=float, default=500.0)
+
+    parser_suite = subparsers.add_parser("suite", help="Funciones de helper.py sobre ledgers sintéticos, comparadas con la referencia guardada")
+    parser_suite.add_argument("--tamanos", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser_suite.add_argument("--casos", nargs="+", choices=list(CASOS_SUITE))
+    parser_suite.add_argument("--guardar-referencia", action="store_true", help="Guardar estos tiempos como nueva referencia")
+    parser_suite.add_argument("--tolerancia", type=float, default=1.5, help="Ratio sobre la referencia a partir del cual hay regresión")
+
+    args = parser.parse_args()
+    if args.benchmark == "xirr":
+        benchmark_xirr(args.tamanos, incluir_legado=not args.sin_legado)
+    elif args.benchmark == "columnar":
+        benchmark_columnar(args.filas)
+    elif args.benchmark == "paralelo":
+        benchmark_paralelo(args.filas, args.activos, args.workers, args.backends)
+    elif args.benchmark == "tipado":
+        benchmark_tipado(args.filas)
+    elif args.benchmark == "escenarios":
+        benchmark_escenarios(args.caminos, args.activos, args.meses, args.aportacion)
+    elif args.benchmark == "suite":
+        regresiones = benchmark_suite(args.tamanos, args.casos, guardar=args.guardar_referencia, tolerancia=args.tolerancia)
+        if regresiones:
+            print(f"❌ {len(regresiones)} regresiones de rendimiento: {', '.join(regresiones)}")
+            sys.exit(1)
@@ -0,0 +1,82 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+
+# === CLAVE DEL ESTADO DE FILTROS ===
+def clave_filtros(version, fecha_inicio, fecha_fin, activos, tipos):
+    # Los conjuntos de activos y tipos se ordenan: el orden de selección no cambia el resultado
+    contenido = repr((str(version), str(fecha_inicio), str(fecha_fin), sorted(map(str, activos)), sorted(map(str, tipos))))
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def tamano_aproximado(valor):
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano_aproximado(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(tamano_aproximado(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+# === CACHÉ LRU ACOTADA EN MEMORIA ===
+class CacheLRU:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obtener_o_calcular(self, clave, funcion, *args, **kwargs):
+        # Los resultados se comparten entre llamadas: quien los reciba no debe modificarlos
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave][0]
+            self.fallos += 1
+
+        valor = funcion(*args, **kwargs)
+        self.guardar(clave, valor)
+        return valor
+
+    def guardar(self, clave, valor):
+        tamano = tamano_aproximado(valor)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._bytes -= self._entradas.pop(clave)[1]
+            self._entradas[clave] = (valor, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, tamano_expulsado) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_expulsado
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+
+def memoizar(cache, clave_estado, funcion, *args, **kwargs):
+    # La clave combina el estado de filtros con la función y sus parámetros adicionales
+    clave = (clave_estado, funcion.__name__, repr(kwargs))
+    return cache.obtener_o_calcular(clave, funcion, *args, **kwargs)
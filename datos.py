@@ -0,0 +1,191 @@
+import os
+import threading
+import pandas as pd
+import streamlit as st
+from esquema import PoolConexiones, existe_tabla
+from helper import COLUMNAS_CATEGORICAS, tipar_ledger
+from posiciones import existen_posiciones, leer_posiciones
+from snapshots import existen_snapshots, leer_sumas_por_bucket
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # el snapshot columnar es opcional
+    pa = pq = None
+
+DB_PATH = "cartera_inversiones.db"
+# Conexiones de solo lectura compartidas por página, API y tareas en segundo plano (por base de datos)
+TAMANO_POOL = int(os.environ.get("CARTERA_CONEXIONES", 4))
+# Cambia cuando cambian las columnas o tipos del ledger en memoria: invalida los snapshots Parquet anteriores
+FORMATO_LEDGER = "2"
+
+
+# === CONEXIONES ===
+_pools = {}
+_lock_pools = threading.Lock()
+
+
+def obtener_pool(db_path=DB_PATH, tamano=None):
+    # El tamaño solo se aplica al crear el pool (la primera vez que se pide para esa base de datos)
+    with _lock_pools:
+        if db_path not in _pools:
+            _pools[db_path] = PoolConexiones(db_path, tamano or TAMANO_POOL)
+        return _pools[db_path]
+
+
+# === VERSIÓN DE LOS DATOS ===
+def version_bd(db_path=DB_PATH):
+    # Cambia solo cuando cambian transacciones o activos: contador de version_datos (esquema v5), que no mueven
+    # ni la caché de tipos de cambio ni los checkpoints del WAL
+    with obtener_pool(db_path).conexion() as conn:
+        if existe_tabla(conn, "version_datos"):
+            instancia, contador = conn.execute("SELECT instancia, contador FROM version_datos").fetchone()
+            return f"{instancia}:{contador}"
+    # Bases sin migrar: mtime/tamaño del fichero (y de su WAL) más una marca de agua de filas
+    partes = []
+    for ruta in (db_path, db_path + "-wal"):
+        if os.path.exists(ruta):
+            stat = os.stat(ruta)
+            partes.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    with obtener_pool(db_path).conexion() as conn:
+        n_filas, max_rowid = conn.execute("SELECT COUNT(*), MAX(rowid) FROM transacciones").fetchone()
+    partes.append(f"{n_filas}:{max_rowid}")
+    return "|".join(partes)
+
+
+# === CARGA ===
+def _condiciones_filtro(fecha_inicio=None, fecha_fin=None, activos=None, tipos=None):
+    # Mismos criterios que el filtro del dashboard: fecha_inicio <= fecha_hora <= fecha_fin y pertenencia a listas
+    condiciones, parametros = [], []
+    if fecha_inicio is not None:
+        condiciones.append("fecha_hora >= ?")
+        parametros.append(pd.Timestamp(fecha_inicio).strftime("%Y-%m-%d %H:%M:%S"))
+    if fecha_fin is not None:
+        condiciones.append("fecha_hora <= ?")
+        parametros.append(pd.Timestamp(fecha_fin).strftime("%Y-%m-%d %H:%M:%S"))
+    for columna, valores in (("activo", activos), ("tipo_operacion", tipos)):
+        if valores is None:
+            continue
+        valores = list(valores)
+        if not valores:
+            condiciones.append("0")
+            continue
+        condiciones.append(f"{columna} IN ({', '.join('?' * len(valores))})")
+        parametros += valores
+    return condiciones, parametros
+
+
+def leer_ledger(db_path=DB_PATH, fecha_inicio=None, fecha_fin=None, activos=None, tipos=None):
+    # Los filtros se resuelven en SQL (con los índices de esquema.py) antes de llegar a pandas
+    condiciones, parametros = _condiciones_filtro(fecha_inicio, fecha_fin, activos, tipos)
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    with obtener_pool(db_path).conexion() as conn:
+        trans = pd.read_sql(f"SELECT * FROM transacciones{where} ORDER BY rowid", conn, params=parametros)
+        activos_df = pd.read_sql("SELECT * FROM activos", conn)
+
+    df = trans.merge(activos_df, on="activo", how="left")
+    df["fecha_hora"] = pd.to_datetime(df["fecha_hora"], errors="coerce")
+    return tipar_ledger(df)
+
+
+def leer_opciones_filtro(db_path=DB_PATH):
+    with obtener_pool(db_path).conexion() as conn:
+        fecha_min, fecha_max = conn.execute("SELECT MIN(fecha_hora), MAX(fecha_hora) FROM transacciones").fetchone()
+        # Orden de primera aparición, como df["columna"].unique()
+        activos = [f[0] for f in conn.execute("SELECT activo FROM transacciones GROUP BY activo ORDER BY MIN(rowid)")]
+        tipos = [f[0] for f in conn.execute("SELECT tipo_operacion FROM transacciones GROUP BY tipo_operacion ORDER BY MIN(rowid)")]
+    return {"fecha_min": pd.to_datetime(fecha_min), "fecha_max": pd.to_datetime(fecha_max), "activos": activos, "tipos": tipos}
+
+
+def ruta_snapshot(db_path=DB_PATH):
+    return os.path.splitext(db_path)[0] + ".parquet"
+
+
+def leer_snapshot(ruta, version):
+    if pq is None or not os.path.exists(ruta):
+        return None
+    try:
+        metadatos = pq.read_schema(ruta).metadata or {}
+        if metadatos.get(b"version_bd") != version.encode() or metadatos.get(b"formato_ledger") != FORMATO_LEDGER.encode():
+            return None
+        return pq.read_table(ruta).to_pandas()
+    except Exception:
+        return None
+
+
+def guardar_snapshot(df, ruta, version):
+    if pa is None:
+        return
+    try:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        tabla = tabla.replace_schema_metadata({
+            **(tabla.schema.metadata or {}), b"version_bd": version.encode(), b"formato_ledger": FORMATO_LEDGER.encode()
+        })
+        pq.write_table(tabla, ruta + ".tmp")
+        os.replace(ruta + ".tmp", ruta)
+    except Exception:
+        # Un snapshot que no se puede escribir solo implica un arranque en frío más lento
+        pass
+
+
+def filtrar_ledger(df, fecha_inicio=None, fecha_fin=None, activos=None, tipos=None):
+    # Mismos criterios que _condiciones_filtro, sobre el ledger ya cargado. Devuelve siempre un DataFrame nuevo
+    # (el completo está compartido en caché) sin las categorías de texto que no aparecen, igual que leer_ledger filtrado
+    mascara = pd.Series(True, index=df.index)
+    if fecha_inicio is not None:
+        mascara &= df["fecha_hora"] >= pd.Timestamp(fecha_inicio)
+    if fecha_fin is not None:
+        mascara &= df["fecha_hora"] <= pd.Timestamp(fecha_fin)
+    for columna, valores in (("activo", activos), ("tipo_operacion", tipos)):
+        if valores is not None:
+            mascara &= df[columna].isin(list(valores))
+    df = df[mascara].reset_index(drop=True)
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns:
+            df[columna] = df[columna].cat.remove_unused_categories()
+    return df
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def cargar_ledger_completo(version, db_path=DB_PATH, usar_snapshot=True):
+    # El ledger tipado completo, una vez por versión de datos: del snapshot Parquet si está al día o de SQLite (y
+    # entonces se regenera el snapshot para el próximo arranque). cache_resource y no cache_data: cada acierto de
+    # cache_data deserializa una copia del ledger entero, y este solo se lee (filtrar_ledger devuelve copias)
+    if usar_snapshot:
+        df = leer_snapshot(ruta_snapshot(db_path), version)
+        if df is not None:
+            return df
+    df = leer_ledger(db_path)
+    if usar_snapshot:
+        guardar_snapshot(df, ruta_snapshot(db_path), version)
+    return df
+
+
+def cargar_ledger(version, fecha_inicio=None, fecha_fin=None, activos=None, tipos=None, db_path=DB_PATH, usar_snapshot=True):
+    # Cada combinación de filtros es un corte en memoria del ledger completo: cambiar fechas, activos o tipos no
+    # vuelve a la base de datos. "version" solo forma parte de la clave de la caché: al cambiar los datos se recarga
+    return filtrar_ledger(cargar_ledger_completo(version, db_path, usar_snapshot), fecha_inicio, fecha_fin, activos, tipos)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def cargar_opciones_filtro(version, db_path=DB_PATH):
+    return leer_opciones_filtro(db_path)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cargar_sumas_por_bucket(version, fecha_inicio, fecha_fin, activos, db_path=DB_PATH):
+    # Devuelve None si la base de datos aún no tiene la tabla snapshots_diarios
+    with obtener_pool(db_path).conexion() as conn:
+        if not existen_snapshots(conn):
+            return None
+        return leer_sumas_por_bucket(conn, fecha_inicio, fecha_fin, activos)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cargar_posiciones(version, activos=None, db_path=DB_PATH):
+    # Estado actual de las posiciones (tablas posiciones y lotes); None si la base de datos aún no las tiene
+    with obtener_pool(db_path).conexion() as conn:
+        if not existen_posiciones(conn):
+            return None
+        return leer_posiciones(conn, activos)
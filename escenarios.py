@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from helper import BUCKETS, calcular_rentabilidad_por_activo, clasificar_operaciones, xirr_lote
+from rendimiento import cronometrado
+
+PERCENTILES = [5, 25, 50, 75, 95]
+TAMANO_BLOQUE = 10_000
+# Límites a los parámetros estimados: la TIR de un activo con pocos meses de historia puede ser de cientos de %
+LIMITES_RENTABILIDAD = (-0.5, 0.5)
+LIMITES_VOLATILIDAD = (0.01, 1.0)
+VOLATILIDAD_POR_DEFECTO = 0.15
+MESES_MINIMOS_VOLATILIDAD = 6
+
+_BUCKETS_CAPITAL = ["compra", "aporte_otro", "reinv", "retirada", "ajuste", "retirada_otro"]
+
+
+# === CALIBRACIÓN DESDE EL HISTORIAL ===
+@cronometrado
+def parametros_por_activo(df):
+    # Por activo con valor actual positivo: valor de partida, rentabilidad anual esperada (su TIR histórica) y
+    # volatilidad anual (desviación de la rentabilidad mensual revalorización / capital invertido, × √12)
+    tabla = calcular_rentabilidad_por_activo(df)
+    if tabla.empty:
+        return pd.DataFrame(columns=["activo", "valor_actual", "rentabilidad", "volatilidad"])
+    tabla = tabla[tabla["valor_actual"] > 0]
+
+    buckets = np.asarray(BUCKETS, dtype=object)[np.asarray(clasificar_operaciones(df).codes)]
+    mensual = pd.DataFrame({
+        "activo": df["activo"].astype(str).to_numpy(),
+        "mes": df["fecha_hora"].dt.to_period("M").to_numpy(),
+        "capital": np.where(np.isin(buckets, _BUCKETS_CAPITAL), df["importe_euros"].to_numpy(dtype=np.float64), 0.0),
+        "flotante": np.where(buckets == "flotante", df["importe_euros"].to_numpy(dtype=np.float64), 0.0)
+    }).groupby(["activo", "mes"], sort=True)[["capital", "flotante"]].sum()
+    invertido = mensual["capital"].groupby(level="activo").cumsum()
+    rentabilidad_mes = (mensual["flotante"] / invertido.where(invertido > 0)).dropna()
+    meses = rentabilidad_mes.groupby(level="activo").size()
+    volatilidad = (rentabilidad_mes.groupby(level="activo").std() * np.sqrt(12)).where(meses >= MESES_MINIMOS_VOLATILIDAD)
+
+    tir = tabla["TIR %"].to_numpy() / 100
+    return pd.DataFrame({
+        "activo": tabla["activo"].to_numpy(),
+        "valor_actual": tabla["valor_actual"].to_numpy(),
+        "rentabilidad": np.clip(np.where(np.isfinite(tir), tir, np.nanmedian(tir) if np.isfinite(tir).any() else 0.0), *LIMITES_RENTABILIDAD),
+        "volatilidad": np.clip(volatilidad.reindex(tabla["activo"]).fillna(VOLATILIDAD_POR_DEFECTO).to_numpy(), *LIMITES_VOLATILIDAD)
+    })
+
+
+# === SIMULACIÓN ===
+@cronometrado
+def simular_escenarios(valores, rentabilidades, volatilidades, meses=120, aportacion_mensual=0.0, n_caminos=10_000,
+                       correlacion=0.3, semilla=0, tamano_bloque=TAMANO_BLOQUE, percentiles=PERCENTILES, inicio=None):
+    # Caminos mensuales lognormales por activo (rentabilidad y volatilidad anuales), con un factor común que da
+    # la correlación entre activos. La aportación mensual se reparte según el peso actual de cada activo.
+    # Se generan por bloques de caminos: la memoria es O(tamano_bloque × activos) más el valor total de cada
+    # camino por mes (float32), no O(caminos × activos × meses). Misma semilla y parámetros -> mismo resultado
+    valores = np.asarray(valores, dtype=np.float64)
+    rentabilidades = np.asarray(rentabilidades, dtype=np.float64)
+    volatilidades = np.asarray(volatilidades, dtype=np.float64)
+    if valores.size == 0 or valores.sum() <= 0:
+        raise ValueError("No hay activos con valor actual positivo que proyectar")
+    if not 0 <= correlacion < 1:
+        raise ValueError("La correlación debe estar en [0, 1)")
+
+    inicio = pd.Timestamp(inicio or pd.Timestamp.today().normalize())
+    pesos = valores / valores.sum()
+    sigma_mes = volatilidades / np.sqrt(12)
+    deriva_mes = (np.log1p(rentabilidades) / 12 - sigma_mes ** 2 / 2).astype(np.float32)
+    sigma_mes = sigma_mes.astype(np.float32)
+    aportacion_activo = (aportacion_mensual * pesos).astype(np.float32)
+    factor_comun, factor_propio = np.float32(np.sqrt(correlacion)), np.float32(np.sqrt(1 - correlacion))
+
+    totales = np.empty((n_caminos, meses + 1), dtype=np.float32)
+    totales[:, 0] = valores.sum()
+    semillas = np.random.SeedSequence(semilla).spawn(-(-n_caminos // tamano_bloque))
+    for bloque, semilla_bloque in enumerate(semillas):
+        rng = np.random.default_rng(semilla_bloque)
+        desde = bloque * tamano_bloque
+        n = min(tamano_bloque, n_caminos - desde)
+        # float32 y buffers reutilizados: generar y exponenciar los choques es casi todo el coste
+        valor = np.broadcast_to(valores.astype(np.float32), (n, valores.size)).copy()
+        choque = np.empty((n, valores.size), dtype=np.float32)
+        comun = np.empty((n, 1), dtype=np.float32)
+        for mes in range(1, meses + 1):
+            rng.standard_normal(dtype=np.float32, out=choque)
+            rng.standard_normal(dtype=np.float32, out=comun)
+            choque *= factor_propio
+            comun *= factor_comun
+            choque += comun
+            choque *= sigma_mes
+            choque += deriva_mes
+            np.exp(choque, out=choque)
+            valor *= choque
+            valor += aportacion_activo
+            totales[desde:desde + n, mes] = valor.sum(axis=1, dtype=np.float64)
+
+    fechas = pd.date_range(inicio, periods=meses + 1, freq=pd.DateOffset(months=1))
+    bandas = pd.DataFrame(np.percentile(totales, percentiles, axis=0).T, columns=[f"p{p}" for p in percentiles])
+    bandas.insert(0, "fecha", fechas)
+    bandas["aportado"] = valores.sum() + aportacion_mensual * np.arange(meses + 1)
+    return {
+        "bandas": bandas,
+        "valor_final": totales[:, -1].astype(np.float64),
+        "tir": tir_de_caminos(totales[:, -1], valores.sum(), aportacion_mensual, fechas, tamano_bloque)
+    }
+
+
+@cronometrado
+def tir_de_caminos(valores_finales, valor_inicial, aportacion_mensual, fechas, tamano_bloque=TAMANO_BLOQUE):
+    # TIR anual de cada camino: se invierte el valor actual, se aporta cada mes (también el último, que ya está
+    # en el valor final) y se recupera el valor final. Todos los caminos comparten los flujos salvo el último;
+    # se resuelven por bloques con xirr_lote
+    n_caminos, n_fechas = len(valores_finales), len(fechas)
+    flujos = np.full(n_fechas, -aportacion_mensual, dtype=np.float64)
+    flujos[0] = -valor_inicial
+    fechas = np.asarray(fechas, dtype="datetime64[s]")
+
+    tirs = np.empty(n_caminos)
+    for desde in range(0, n_caminos, tamano_bloque):
+        finales = np.asarray(valores_finales[desde:desde + tamano_bloque], dtype=np.float64)
+        n = len(finales)
+        importes = np.tile(flujos, (n, 1))
+        importes[:, -1] += finales
+        claves = np.repeat(np.arange(n), n_fechas)
+        tirs[desde:desde + n] = xirr_lote(claves, np.tile(fechas, n), importes.ravel()).to_numpy()
+    return tirs * 100
+
+
+def resumen_escenarios(resultado, percentiles=PERCENTILES):
+    valor_final, tir = resultado["valor_final"], resultado["tir"]
+    aportado = resultado["bandas"]["aportado"].iloc[-1]
+    return {
+        "valor_final": dict(zip(percentiles, np.percentile(valor_final, percentiles))),
+        "tir": dict(zip(percentiles, np.nanpercentile(tir, percentiles))),
+        "prob_perdida": float(np.mean(valor_final < aportado)),
+        "aportado": float(aportado)
+    }
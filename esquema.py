@@ -0,0 +1,293 @@
+import queue
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from posiciones import DDL_LOTES, DDL_POSICIONES, reconstruir_posiciones
+from snapshots import DDL_SNAPSHOTS, reconstruir_snapshots
+
+# Versión del esquema guardada en PRAGMA user_version (0 = tablas creadas con DataFrame.to_sql,
+# 1 = tablas tipadas, 2 = clave natural con ocurrencia para importaciones idempotentes, 3 = caché fx_rates,
+# 4 = posiciones y lotes FIFO, 5 = contador de versión de los datos)
+VERSION_ESQUEMA = 5
+
+# fecha_hora se guarda como texto ISO "YYYY-MM-DD HH:MM:SS": ordena igual que la fecha y es el formato
+# que escriben el formulario de registro y pandas
+DDL_ACTIVOS = """
+    CREATE TABLE IF NOT EXISTS activos (
+        activo TEXT PRIMARY KEY,
+        plataforma TEXT,
+        tipo_activo TEXT,
+        objetivo_inversion TEXT,
+        tipo_rentabilidad_pred TEXT
+    )
+"""
+
+DDL_TRANSACCIONES = """
+    CREATE TABLE IF NOT EXISTS transacciones (
+        id INTEGER PRIMARY KEY,
+        fecha_hora TEXT NOT NULL,
+        activo TEXT NOT NULL REFERENCES activos (activo),
+        importe_original REAL,
+        moneda TEXT,
+        tipo_cambio REAL,
+        importe_euros REAL NOT NULL,
+        etiqueta TEXT,
+        tipo_operacion TEXT NOT NULL,
+        subtipo_operacion TEXT,
+        porcentaje_participacion REAL,
+        ocurrencia INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+# Caché de tipos de cambio (ver tipos_cambio.py), en la convención de transacciones.tipo_cambio: moneda por 1 EUR
+DDL_FX_RATES = """
+    CREATE TABLE IF NOT EXISTS fx_rates (
+        moneda TEXT NOT NULL,
+        fecha TEXT NOT NULL,
+        tipo_cambio REAL NOT NULL,
+        proveedor TEXT,
+        actualizado TEXT NOT NULL,
+        PRIMARY KEY (moneda, fecha)
+    )
+"""
+
+# Versión de los datos del ledger (ver datos.version_bd): los triggers suben el contador con cualquier cambio en
+# transacciones o activos, y solo con ellos (fx_rates, snapshots o un checkpoint del WAL no lo mueven).
+# "instancia" es aleatoria por base de datos: una base regenerada desde cero no repite una versión anterior
+DDL_VERSION_DATOS = """
+    CREATE TABLE IF NOT EXISTS version_datos (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        instancia TEXT NOT NULL,
+        contador INTEGER NOT NULL
+    )
+"""
+TRIGGERS_VERSION_DATOS = [
+    f"""CREATE TRIGGER IF NOT EXISTS tr_version_{tabla}_{evento.lower()} AFTER {evento} ON {tabla}
+        BEGIN UPDATE version_datos SET contador = contador + 1; END"""
+    for tabla in ("transacciones", "activos") for evento in ("INSERT", "UPDATE", "DELETE")
+]
+
+# Clave natural de una operación: "ocurrencia" distingue operaciones idénticas en fecha, activo y tipo
+CLAVE_NATURAL = ["fecha_hora", "activo", "tipo_operacion", "subtipo_operacion", "ocurrencia"]
+
+INDICES = [
+    "CREATE INDEX IF NOT EXISTS idx_transacciones_activo_fecha ON transacciones (activo, fecha_hora)",
+    "CREATE INDEX IF NOT EXISTS idx_transacciones_tipo ON transacciones (tipo_operacion, subtipo_operacion)",
+    "CREATE INDEX IF NOT EXISTS idx_transacciones_fecha ON transacciones (fecha_hora)",
+    f"CREATE UNIQUE INDEX IF NOT EXISTS ux_transacciones_clave_natural ON transacciones ({', '.join(CLAVE_NATURAL)})"
+]
+
+COLUMNAS_TRANSACCIONES = [
+    "fecha_hora", "activo", "importe_original", "moneda", "tipo_cambio", "importe_euros",
+    "etiqueta", "tipo_operacion", "subtipo_operacion", "porcentaje_participacion"
+]
+COLUMNAS_ACTIVOS = ["activo", "plataforma", "tipo_activo", "objetivo_inversion", "tipo_rentabilidad_pred"]
+
+
+# === CONEXIONES ===
+def conectar(db_path, solo_lectura=False):
+    if solo_lectura:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+class PoolConexiones:
+    # Conexiones de solo lectura reutilizables entre hilos (dashboard, API): cada una la usa un hilo a la vez y
+    # se crean bajo demanda hasta "tamano"; si están todas ocupadas se espera a que se libere una
+    def __init__(self, db_path, tamano=4, espera=30):
+        self.db_path = db_path
+        self.tamano = tamano
+        self.espera = espera
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def conexion(self):
+        conn = self._tomar()
+        fallida = False
+        try:
+            yield conn
+        except sqlite3.Error:
+            # Una conexión que ha fallado no vuelve al pool
+            fallida = True
+            raise
+        finally:
+            if fallida:
+                self._descartar(conn)
+            else:
+                self._libres.put(conn)
+
+    def _tomar(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            crear = self._creadas < self.tamano
+            if crear:
+                self._creadas += 1
+        if crear:
+            try:
+                return conectar(self.db_path, solo_lectura=True)
+            except sqlite3.Error:
+                with self._lock:
+                    self._creadas -= 1
+                raise
+        try:
+            return self._libres.get(timeout=self.espera)
+        except queue.Empty:
+            raise TimeoutError(f"Sin conexiones libres a {self.db_path} tras {self.espera} s") from None
+
+    def _descartar(self, conn):
+        conn.close()
+        with self._lock:
+            self._creadas -= 1
+
+    def cerrar(self):
+        while True:
+            try:
+                self._descartar(self._libres.get_nowait())
+            except queue.Empty:
+                return
+
+
+def version_esquema(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def existe_tabla(conn, nombre):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nombre,)).fetchone() is not None
+
+
+def crear_version_datos(conn):
+    conn.execute(DDL_VERSION_DATOS)
+    conn.execute("INSERT OR IGNORE INTO version_datos (id, instancia, contador) VALUES (1, lower(hex(randomblob(8))), 0)")
+    for trigger in TRIGGERS_VERSION_DATOS:
+        conn.execute(trigger)
+
+
+# === CREACIÓN Y MIGRACIÓN ===
+def crear_esquema(conn):
+    # WAL: los lectores del dashboard no bloquean al formulario de registro (y viceversa)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(DDL_ACTIVOS)
+    conn.execute(DDL_TRANSACCIONES)
+    for indice in INDICES:
+        conn.execute(indice)
+    conn.execute(DDL_SNAPSHOTS)
+    conn.execute(DDL_FX_RATES)
+    conn.execute(DDL_POSICIONES)
+    conn.execute(DDL_LOTES)
+    crear_version_datos(conn)
+    conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+    conn.commit()  # el INSERT de version_datos abre una transacción implícita
+
+
+def _migrar_a_v1(conn):
+    # Tablas creadas con to_sql -> esquema tipado, conservando los datos
+    for tabla in ("transacciones", "activos"):
+        if existe_tabla(conn, tabla):
+            conn.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}_legado")
+
+    conn.execute(DDL_ACTIVOS)
+    conn.execute(DDL_TRANSACCIONES)
+
+    if existe_tabla(conn, "activos_legado"):
+        conn.execute(f"""
+            INSERT OR IGNORE INTO activos ({', '.join(COLUMNAS_ACTIVOS)})
+            SELECT {', '.join(COLUMNAS_ACTIVOS)} FROM activos_legado WHERE activo IS NOT NULL
+        """)
+    if existe_tabla(conn, "transacciones_legado"):
+        # Activos usados en transacciones pero ausentes del catálogo: se dan de alta para la clave ajena.
+        # Las filas sin fecha, activo o importe no cumplen el esquema y se descartan
+        conn.execute("INSERT OR IGNORE INTO activos (activo) SELECT DISTINCT activo FROM transacciones_legado WHERE activo IS NOT NULL")
+        columnas = ", ".join(COLUMNAS_TRANSACCIONES[1:])
+        conn.execute(f"""
+            INSERT INTO transacciones (fecha_hora, {columnas})
+            SELECT strftime('%Y-%m-%d %H:%M:%S', fecha_hora), {columnas}
+            FROM transacciones_legado
+            WHERE fecha_hora IS NOT NULL AND activo IS NOT NULL AND importe_euros IS NOT NULL
+            ORDER BY rowid
+        """)
+
+    conn.execute("DROP TABLE IF EXISTS transacciones_legado")
+    conn.execute("DROP TABLE IF EXISTS activos_legado")
+
+
+def _migrar_a_v2(conn):
+    # Añade "ocurrencia" (si la tabla v1 no la tiene) numerando las operaciones repetidas por orden de id
+    columnas = [fila[1] for fila in conn.execute("PRAGMA table_info(transacciones)")]
+    if "ocurrencia" not in columnas:
+        conn.execute("ALTER TABLE transacciones ADD COLUMN ocurrencia INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE transacciones SET subtipo_operacion = '' WHERE subtipo_operacion IS NULL")
+    # Una sola pasada con ROW_NUMBER (los índices aún no existen: una subconsulta correlacionada sería cuadrática)
+    conn.execute("""
+        CREATE TEMP TABLE ocurrencias AS
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY fecha_hora, activo, tipo_operacion, subtipo_operacion ORDER BY id
+        ) - 1 AS ocurrencia
+        FROM transacciones
+    """)
+    conn.execute("""
+        UPDATE transacciones SET ocurrencia = ocurrencias.ocurrencia
+        FROM ocurrencias WHERE ocurrencias.id = transacciones.id
+    """)
+    conn.execute("DROP TABLE ocurrencias")
+
+
+def _migrar_a_v3(conn):
+    conn.execute(DDL_FX_RATES)
+
+
+def _migrar_a_v4(conn):
+    # Las tablas se llenan con reconstruir_posiciones al final de migrar
+    conn.execute(DDL_POSICIONES)
+    conn.execute(DDL_LOTES)
+
+
+def _migrar_a_v5(conn):
+    crear_version_datos(conn)
+
+
+MIGRACIONES = {1: _migrar_a_v1, 2: _migrar_a_v2, 3: _migrar_a_v3, 4: _migrar_a_v4, 5: _migrar_a_v5}
+
+
+def migrar(conn):
+    # Aplica en orden las migraciones pendientes dentro de una única transacción
+    version_actual = version_esquema(conn)
+    if version_actual >= VERSION_ESQUEMA:
+        return False
+
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with conn:
+            # BEGIN explícito: sqlite3 no abre transacción antes de DDL y la migración debe ser atómica
+            conn.execute("BEGIN")
+            for version in range(version_actual + 1, VERSION_ESQUEMA + 1):
+                MIGRACIONES[version](conn)
+            for indice in INDICES:
+                conn.execute(indice)
+            reconstruir_snapshots(conn)
+            reconstruir_posiciones(conn)
+            conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA}")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+    conn.execute("PRAGMA journal_mode = WAL")
+    return True
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "cartera_inversiones.db"
+    conn = conectar(db_path)
+    if migrar(conn):
+        print(f"Base de datos '{db_path}' migrada al esquema v{VERSION_ESQUEMA}.")
+    else:
+        print(f"La base de datos '{db_path}' ya usa el esquema v{version_esquema(conn)}.")
+    conn.close()
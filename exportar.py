@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+from datetime import datetime
+from itertools import chain
+from openpyxl import Workbook
+from esquema import COLUMNAS_TRANSACCIONES, conectar
+from importar import en_lotes, leer_filas
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # la exportación a Parquet es opcional
+    pa = pq = None
+
+TAMANO_LOTE = 5000
+FORMATOS = {".xlsx", ".csv", ".parquet"}
+
+# Mismo orden de columnas que los Excel de partida, para que exportar e importar sean simétricos
+COLUMNAS_EXPORTACION = {
+    "transacciones": COLUMNAS_TRANSACCIONES,
+    "activos": ["plataforma", "activo", "tipo_activo", "objetivo_inversion", "tipo_rentabilidad_pred"]
+}
+TIPOS_PARQUET = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+
+# === LECTURA POR LOTES ===
+def leer_lotes(conn, tabla, desde_rowid=0, tamano_lote=TAMANO_LOTE):
+    # Una sola consulta recorrida con fetchmany: con WAL es una foto consistente de la tabla
+    # y en memoria solo hay un lote a la vez. Cada fila empieza por su rowid
+    cursor = conn.execute(
+        f"SELECT rowid, {', '.join(COLUMNAS_EXPORTACION[tabla])} FROM {tabla} WHERE rowid > ? ORDER BY rowid",
+        (desde_rowid,)
+    )
+    while lote := cursor.fetchmany(tamano_lote):
+        yield lote
+
+
+def _con_fechas(lotes, columnas):
+    # fecha_hora se guarda como texto ISO; en Excel y Parquet se escribe como fecha
+    if "fecha_hora" not in columnas:
+        yield from lotes
+        return
+    i = columnas.index("fecha_hora")
+    for lote in lotes:
+        yield [fila[:i] + (datetime.fromisoformat(fila[i]),) + fila[i + 1:] for fila in lote]
+
+
+# === ESCRITURA EN STREAMING ===
+def escribir_xlsx(ruta, columnas, lotes, hoja="Sheet1"):
+    # Libro write_only: las filas se vuelcan a disco al añadirlas
+    libro = Workbook(write_only=True)
+    ws = libro.create_sheet(hoja)
+    ws.append(columnas)
+    for lote in lotes:
+        for fila in lote:
+            ws.append(fila)
+    libro.save(ruta)
+
+
+def escribir_csv(ruta, columnas, lotes, anadir=False):
+    with open(ruta, "a" if anadir else "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if not anadir:
+            writer.writerow(columnas)
+        for lote in lotes:
+            writer.writerows(lote)
+
+
+def esquema_parquet(conn, tabla):
+    tipos = {fila[1]: fila[2] for fila in conn.execute(f"PRAGMA table_info({tabla})")}
+    return pa.schema([
+        (c, pa.timestamp("s") if c == "fecha_hora" else pa.type_for_alias(TIPOS_PARQUET.get(tipos[c], "string")))
+        for c in COLUMNAS_EXPORTACION[tabla]
+    ])
+
+
+def escribir_parquet(ruta, esquema, lotes):
+    # Un row group por lote
+    with pq.ParquetWriter(ruta, esquema) as writer:
+        for lote in lotes:
+            columnas = list(zip(*lote))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)], schema=esquema
+            ))
+
+
+def _lotes_existentes(ruta, columnas, extension):
+    # Filas ya exportadas en un fichero delta, leídas también por lotes (para reescribirlo con las nuevas al final)
+    if extension == ".parquet":
+        for batch in pq.ParquetFile(ruta).iter_batches(batch_size=TAMANO_LOTE, columns=columnas):
+            yield [tuple(fila[c] for c in columnas) for fila in batch.to_pylist()]
+        return
+    for lote in en_lotes(leer_filas(ruta), TAMANO_LOTE):
+        yield [tuple(fila.get(c) for c in columnas) for fila in lote]
+
+
+# === MARCA DE AGUA Y DELTA ===
+def ruta_marca(ruta):
+    return ruta + ".marca.json"
+
+
+def ruta_delta(ruta):
+    base, extension = os.path.splitext(ruta)
+    return f"{base}.delta{extension}"
+
+
+def leer_marca(ruta, tabla):
+    try:
+        with open(ruta_marca(ruta), encoding="utf-8") as f:
+            marca = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return marca["ultimo_rowid"] if marca.get("tabla") == tabla else None
+
+
+def guardar_marca(ruta, tabla, ultimo_rowid):
+    with open(ruta_marca(ruta) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"tabla": tabla, "ultimo_rowid": ultimo_rowid, "exportado": datetime.now().isoformat(timespec="seconds")}, f)
+    os.replace(ruta_marca(ruta) + ".tmp", ruta_marca(ruta))
+
+
+def exportar_tabla(conn, tabla, ruta, delta=False, tamano_lote=TAMANO_LOTE, progreso=print):
+    # delta=True: solo las filas posteriores a la marca de agua de la última exportación, añadidas a
+    # <ruta>.delta.<ext>. Detecta altas (rowid creciente), no modificaciones ni bajas: para eso, exportación completa
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {extension} (usa {', '.join(sorted(FORMATOS))})")
+    if extension == ".parquet" and pq is None:
+        raise ImportError("La exportación a Parquet necesita pyarrow")
+
+    columnas = COLUMNAS_EXPORTACION[tabla]
+    marca = leer_marca(ruta, tabla) if delta else None
+    if delta and (marca is None or not os.path.exists(ruta)):
+        progreso(f"  {ruta}: sin exportación previa, se hace una exportación completa")
+        delta = False
+
+    resumen = {"tabla": tabla, "ruta": ruta_delta(ruta) if delta else ruta, "filas": 0, "ultimo_rowid": marca or 0}
+
+    def sin_rowid(lotes):
+        for lote in lotes:
+            resumen["filas"] += len(lote)
+            resumen["ultimo_rowid"] = lote[-1][0]
+            progreso(f"  {tabla}: {resumen['filas']} filas exportadas")
+            yield [fila[1:] for fila in lote]
+
+    lotes = sin_rowid(leer_lotes(conn, tabla, marca or 0, tamano_lote))
+    if extension != ".csv":
+        lotes = _con_fechas(lotes, columnas)
+    destino = resumen["ruta"]
+    anadir = delta and os.path.exists(destino)
+    if anadir and extension != ".csv":
+        # xlsx y Parquet no admiten añadir filas: se reescribe el delta copiando sus filas por lotes
+        lotes = chain(_lotes_existentes(destino, columnas, extension), lotes)
+
+    if extension == ".csv" and anadir:
+        escribir_csv(destino, columnas, lotes, anadir=True)
+    else:
+        # Se escribe en un temporal y se renombra: un fallo a mitad no deja un fichero a medias
+        temporal = destino + ".tmp" + extension
+        if extension == ".xlsx":
+            escribir_xlsx(temporal, columnas, lotes)
+        elif extension == ".csv":
+            escribir_csv(temporal, columnas, lotes)
+        else:
+            escribir_parquet(temporal, esquema_parquet(conn, tabla), lotes)
+        os.replace(temporal, destino)
+
+    if not delta and os.path.exists(ruta_delta(ruta)):
+        # La exportación completa ya incluye lo que hubiera en el delta
+        os.remove(ruta_delta(ruta))
+    guardar_marca(ruta, tabla, resumen["ultimo_rowid"])
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta tablas de la base de datos a xlsx, csv o parquet por lotes")
+    parser.add_argument("--db", default="cartera_inversiones.db")
+    parser.add_argument("--transacciones", help="Fichero de salida de transacciones (.xlsx, .csv o .parquet)")
+    parser.add_argument("--activos", help="Fichero de salida de activos (.xlsx, .csv o .parquet)")
+    parser.add_argument("--delta", action="store_true", help="Exportar solo las filas nuevas desde la última exportación")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    args = parser.parse_args()
+
+    if not args.transacciones and not args.activos:
+        parser.error("indica al menos --transacciones o --activos")
+
+    conn = conectar(args.db, solo_lectura=True)
+    for tabla, ruta in (("transacciones", args.transacciones), ("activos", args.activos)):
+        if ruta:
+            resumen = exportar_tabla(conn, tabla, ruta, args.delta, args.lote)
+            print(f"✔️ {resumen['filas']} filas de {tabla} exportadas a {resumen['ruta']}")
+    conn.close()
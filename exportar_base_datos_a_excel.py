@@ -0,0 +1,14 @@
+import sys
+from esquema import conectar
+from exportar import exportar_tabla
+
+# Ruta de la base de datos
+db_path = "cartera_inversiones.db"
+delta = "--delta" in sys.argv
+
+# Exportar las dos tablas a los Excel de los que parte regenerar_base_datos.py
+conn = conectar(db_path, solo_lectura=True)
+for tabla, excel_path in (("transacciones", "transacciones.xlsx"), ("activos", "activos_para_etiquetar.xlsx")):
+    resumen = exportar_tabla(conn, tabla, excel_path, delta=delta)
+    print(f"✔️ Archivo actualizado: {resumen['ruta']} ({resumen['filas']} filas)")
+conn.close()
@@ -1,16 +1,16 @@
-import sqlite3
-import pandas as pd
+import sys
+from esquema import conectar
+from exportar import exportar_tabla
 
 # Ruta de la base de datos
 db_path = "cartera_inversiones.db"
 
-# Conexión y consulta
-conn = sqlite3.connect(db_path)
-df_transacciones = pd.read_sql("SELECT * FROM transacciones", conn)
-conn.close()
+# Exportar a Excel (o a .csv/.parquet según la extensión); con --delta solo las operaciones nuevas
+excel_path = next((a for a in sys.argv[1:] if not a.startswith("--")), "transacciones.xlsx")
+delta = "--delta" in sys.argv
 
-# Exportar a Excel
-excel_path = "transacciones.xlsx"
-df_transacciones.to_excel(excel_path, index=False)
+conn = conectar(db_path, solo_lectura=True)
+resumen = exportar_tabla(conn, "transacciones", excel_path, delta=delta)
+conn.close()
 
-print(f"✔️ Archivo actualizado: {excel_path}")
+print(f"✔️ Archivo actualizado: {resumen['ruta']} ({resumen['filas']} filas)")
@@ -0,0 +1,137 @@
+import argparse
+import numpy as np
+import pandas as pd
+from esquema import COLUMNAS_TRANSACCIONES
+from helper import SUBTIPOS_OPERACION
+
+# Peso de cada (tipo_operacion, subtipo_operacion) entre las operaciones que no son revalorizaciones,
+# en la proporción aproximada de transacciones.xlsx
+MEZCLA_POR_DEFECTO = {
+    ("aporte", "compra"): 400, ("aporte", "reinv_benef"): 240, ("aporte", "reinv_recom"): 2,
+    ("beneficio", "venta"): 220, ("beneficio", "dividendo"): 14, ("beneficio", "interes"): 19, ("beneficio", "cashback"): 2,
+    ("perdida", "venta"): 40, ("retirada", "ajuste_por_perdida"): 31, ("retirada", "retirada"): 28,
+    ("comision", "comision_compra"): 4, ("comision", "comision_venta"): 2, ("otro", "ajuste"): 1
+}
+
+# Signo e importe típico (mediana en euros, dispersión lognormal) de cada operación
+IMPORTES = {
+    ("aporte", "compra"): (1, 50, 0.9), ("aporte", "reinv_benef"): (1, 1, 1.2), ("aporte", "reinv_recom"): (1, 15, 0.5),
+    ("beneficio", "venta"): (1, 3, 1.5), ("beneficio", "dividendo"): (1, 1, 1.2), ("beneficio", "interes"): (1, 1, 0.6),
+    ("beneficio", "cashback"): (1, 15, 0.5), ("perdida", "venta"): (-1, 3, 1.3), ("retirada", "ajuste_por_perdida"): (-1, 3, 1.0),
+    ("retirada", "retirada"): (-1, 250, 1.0), ("comision", "comision_compra"): (1, 1.5, 0.4), ("comision", "comision_venta"): (1, 1, 0.3),
+    ("otro", "ajuste"): (-1, 0.5, 0.5)
+}
+
+
+def _validar_mezcla(mezcla):
+    for tipo, subtipo in mezcla:
+        if subtipo not in SUBTIPOS_OPERACION.get(tipo, []):
+            raise ValueError(f"Operación fuera del vocabulario de SUBTIPOS_OPERACION: {tipo}/{subtipo}")
+        if (tipo, subtipo) not in IMPORTES or subtipo in ("revalorizacion", "devaluacion"):
+            raise ValueError(f"La mezcla no admite {tipo}/{subtipo} (las revalorizaciones se generan aparte)")
+
+
+# === GENERADOR ===
+def generar_ledger_sintetico(filas=10_000, n_activos=20, años=10, mezcla=None, frecuencia_revalorizacion="W",
+                             semilla=0, inicio="2015-01-01", fraccion_usd=0.2):
+    # Ledger determinista (misma semilla -> mismo DataFrame) con las columnas de transacciones:
+    # - cada activo tiene su ventana de vida dentro de [inicio, inicio + años); algunos se cierran antes
+    # - las operaciones se reparten entre activos con pesos desiguales y siguen la "mezcla" de tipos
+    # - cada activo anota una revalorización/devaluación por periodo de "frecuencia_revalorizacion" sobre
+    #   su capital aportado; si no caben en la mitad de las filas se espacian más
+    mezcla = mezcla or MEZCLA_POR_DEFECTO
+    _validar_mezcla(mezcla)
+    rng = np.random.default_rng(semilla)
+    inicio = pd.Timestamp(inicio)
+    fin = inicio + pd.DateOffset(years=años)
+    minutos_totales = int((fin - inicio).total_seconds() // 60)
+
+    activos = np.array([f"Activo {i:02d}" for i in range(n_activos)])
+    apertura = rng.integers(0, int(minutos_totales * 0.7), size=n_activos)
+    cierra_antes = rng.random(n_activos) < 0.2
+    cierre = np.where(cierra_antes, apertura + ((minutos_totales - apertura) * rng.uniform(0.3, 0.9, n_activos)).astype(np.int64), minutos_totales)
+    es_usd = rng.random(n_activos) < fraccion_usd
+
+    # Calendario de revalorizaciones por activo, limitado a la mitad de las filas
+    calendario = pd.date_range(inicio, fin, freq=frecuencia_revalorizacion, inclusive="left")
+    minutos_calendario = ((calendario - inicio).total_seconds() // 60).to_numpy(dtype=np.int64)
+    reval_activo, reval_minuto = [], []
+    for i in range(n_activos):
+        dentro = minutos_calendario[(minutos_calendario > apertura[i]) & (minutos_calendario <= cierre[i])]
+        reval_activo.append(np.full(len(dentro), i))
+        reval_minuto.append(dentro)
+    reval_activo, reval_minuto = np.concatenate(reval_activo), np.concatenate(reval_minuto)
+    if len(reval_activo) > filas // 2:
+        elegidas = np.unique(np.linspace(0, len(reval_activo) - 1, filas // 2).astype(np.int64))
+        reval_activo, reval_minuto = reval_activo[elegidas], reval_minuto[elegidas]
+
+    # Operaciones ordinarias
+    n_operaciones = filas - len(reval_activo)
+    pesos_activo = rng.dirichlet(np.full(n_activos, 0.8))
+    op_activo = rng.choice(n_activos, size=n_operaciones, p=pesos_activo)
+    op_minuto = apertura[op_activo] + (rng.random(n_operaciones) * (cierre[op_activo] - apertura[op_activo])).astype(np.int64)
+    claves = list(mezcla)
+    pesos = np.array([mezcla[c] for c in claves], dtype=np.float64)
+    op_tipo = rng.choice(len(claves), size=n_operaciones, p=pesos / pesos.sum())
+    # La primera operación de cada activo es, en su fecha de apertura, una compra (si la mezcla las incluye)
+    primeras = np.unique(op_activo, return_index=True)[1]
+    op_minuto[primeras] = apertura[op_activo[primeras]]
+    if ("aporte", "compra") in claves:
+        op_tipo[primeras] = claves.index(("aporte", "compra"))
+    signo, mediana, sigma = (np.array([IMPORTES[c][k] for c in claves]) for k in range(3))
+    op_importe = signo[op_tipo] * rng.lognormal(np.log(mediana[op_tipo]), sigma[op_tipo])
+
+    operaciones = pd.DataFrame({
+        "minuto": op_minuto, "i_activo": op_activo, "importe_euros": op_importe,
+        "tipo_operacion": np.array([c[0] for c in claves])[op_tipo],
+        "subtipo_operacion": np.array([c[1] for c in claves])[op_tipo]
+    })
+
+    # Revalorizaciones: rendimiento por periodo ~ N(0.4 %, 3 %) sobre el capital aportado hasta esa fecha
+    compras = operaciones[operaciones["tipo_operacion"] == "aporte"].sort_values("minuto")
+    compras = compras.assign(capital=compras.groupby("i_activo")["importe_euros"].cumsum())
+    revalorizaciones = pd.DataFrame({"minuto": reval_minuto, "i_activo": reval_activo}).sort_values("minuto", kind="stable")
+    revalorizaciones = pd.merge_asof(revalorizaciones, compras[["minuto", "i_activo", "capital"]], on="minuto", by="i_activo")
+    rendimiento = rng.normal(0.004, 0.03, size=len(revalorizaciones))
+    revalorizaciones["importe_euros"] = revalorizaciones["capital"].fillna(0).to_numpy() * rendimiento
+    revalorizaciones["tipo_operacion"] = "otro"
+    revalorizaciones["subtipo_operacion"] = np.where(rendimiento >= 0, "revalorizacion", "devaluacion")
+
+    ledger = pd.concat([operaciones, revalorizaciones.drop(columns="capital")], ignore_index=True)
+    ledger = ledger.sort_values(["minuto", "i_activo"], kind="stable").reset_index(drop=True)
+
+    usd = es_usd[ledger["i_activo"].to_numpy()]
+    tipo_cambio = np.where(usd, rng.uniform(1.04, 1.13, size=len(ledger)).round(4), 1.0)
+    importe_euros = ledger["importe_euros"].to_numpy().round(2)
+    return pd.DataFrame({
+        "fecha_hora": inicio + pd.to_timedelta(ledger["minuto"].to_numpy(), unit="min"),
+        "activo": activos[ledger["i_activo"].to_numpy()],
+        "importe_original": (importe_euros * tipo_cambio).round(2),
+        "moneda": np.where(usd, "USD", "EUR"),
+        "tipo_cambio": tipo_cambio,
+        "importe_euros": importe_euros,
+        "etiqueta": "sintetico",
+        "tipo_operacion": ledger["tipo_operacion"].to_numpy(),
+        "subtipo_operacion": ledger["subtipo_operacion"].to_numpy(),
+        "porcentaje_participacion": 1.0
+    })[COLUMNAS_TRANSACCIONES]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un ledger sintético determinista (xlsx, csv o parquet)")
+    parser.add_argument("salida", help="Fichero de salida; importable con importar.py")
+    parser.add_argument("--filas", type=int, default=10_000)
+    parser.add_argument("--activos", type=int, default=20)
+    parser.add_argument("--años", type=int, default=10)
+    parser.add_argument("--revalorizacion", default="W", help="Frecuencia de revalorizaciones (alias de pandas: D, W, MS...)")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+
+    ledger = generar_ledger_sintetico(args.filas, args.activos, args.años, frecuencia_revalorizacion=args.revalorizacion, semilla=args.semilla)
+    if args.salida.endswith(".csv"):
+        ledger.to_csv(args.salida, index=False)
+    elif args.salida.endswith(".parquet"):
+        ledger.to_parquet(args.salida, index=False)
+    else:
+        ledger.to_excel(args.salida, index=False)
+    print(f"✔️ {len(ledger)} operaciones de {ledger['activo'].nunique()} activos en {args.salida}")
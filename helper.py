@@ -1,179 +1,531 @@
 from datetime import datetime
 import math
+import numpy as np
 import pandas as pd
 from typing import List, Tuple
+from paralelo import ejecutar_por_claves
+from rendimiento import cronometrado
 
 # === XIRR ===
-def xirr(cashflows: List[Tuple[datetime, float]], guess: float = 0.1, max_iterations: int = 100, tol: float = 1e-6):
-    cashflows = sorted(cashflows, key=lambda x: x[0])
-    if len(cashflows) < 2:
-        return None
+# Límites del intervalo en el que se busca la tasa cuando Newton no converge
+_TASA_MINIMA = -0.9999
+_TASAS_BUSQUEDA = np.array([-0.9999, -0.99, -0.9, -0.75, -0.5, -0.25, 0.0, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 100.0, 1e3, 1e4, 1e5, 1e6])
 
-    days = [(cf[0] - cashflows[0][0]).days for cf in cashflows]
-    values = [cf[1] for cf in cashflows]
 
-    def f(rate):
-        try:
-            return sum([v / ((1 + rate) ** (d / 365.0)) for v, d in zip(values, days)])
-        except Exception:
-            return float('nan')
+def _dias_desde_inicio(fechas):
+    fechas = np.asarray(fechas, dtype="datetime64[s]")
+    return (fechas - fechas.min()).astype("timedelta64[D]").astype(np.float64)
+
+
+def _vpn_y_derivada(rate, años, valores):
+    with np.errstate(all="ignore"):
+        descuento = (1.0 + rate) ** -años
+        vpn = np.dot(valores, descuento)
+        derivada = -np.dot(años * valores, descuento) / (1.0 + rate)
+    return vpn, derivada
+
+
+def _vpn(rate, años, valores):
+    with np.errstate(all="ignore"):
+        return np.dot(valores, (1.0 + rate) ** -años)
 
-    def f_derivative(rate):
-        try:
-            return sum([- (d / 365.0) * v / ((1 + rate) ** ((d / 365.0) + 1)) for v, d in zip(values, days)])
-        except Exception:
-            return float('nan')
 
+def _xirr_biseccion(años, valores, guess, max_iterations, tol):
+    # Busca un intervalo con cambio de signo lo más cerca posible de guess y lo reduce por bisección
+    vpns = np.array([_vpn(r, años, valores) for r in _TASAS_BUSQUEDA])
+    finitos = np.isfinite(vpns)
+    if not (finitos & (vpns != 0)).any():
+        # VPN nulo con cualquier tasa (p. ej. todos los flujos el mismo día): no hay una TIR que devolver
+        return None
+    signos = np.sign(vpns)
+    cambios = np.flatnonzero(finitos[:-1] & finitos[1:] & (signos[:-1] * signos[1:] < 0))
+    raices = np.flatnonzero(finitos & (vpns == 0))
+    if cambios.size == 0 and raices.size == 0:
+        return None
+
+    centro = np.clip(guess, _TASAS_BUSQUEDA[0], _TASAS_BUSQUEDA[-1])
+    if raices.size:
+        # Una tasa de la rejilla que anula el VPN se devuelve tal cual si no hay un intervalo más cercano a guess
+        raiz = raices[np.argmin(np.abs(_TASAS_BUSQUEDA[raices] - centro))]
+        if cambios.size == 0 or abs(_TASAS_BUSQUEDA[raiz] - centro) <= np.abs(_TASAS_BUSQUEDA[cambios] - centro).min():
+            return float(_TASAS_BUSQUEDA[raiz])
+
+    i = cambios[np.argmin(np.abs(_TASAS_BUSQUEDA[cambios] - centro))]
+    lo, hi = _TASAS_BUSQUEDA[i], _TASAS_BUSQUEDA[i + 1]
+    f_lo = vpns[i]
+
+    for _ in range(max(max_iterations, 200)):
+        mid = 0.5 * (lo + hi)
+        f_mid = _vpn(mid, años, valores)
+        if f_mid == 0 or (hi - lo) < tol:
+            return float(mid)
+        if np.sign(f_mid) == np.sign(f_lo):
+            lo, f_lo = mid, f_mid
+        else:
+            hi = mid
+    return float(0.5 * (lo + hi))
+
+
+def _xirr_años(años, valores, guess, max_iterations, tol):
     rate = guess
     for _ in range(max_iterations):
         if rate <= -0.999:
-            return None
+            break
 
-        f_val, f_deriv = f(rate), f_derivative(rate)
-        if math.isnan(f_val) or math.isnan(f_deriv) or abs(f_deriv) < 1e-10:
-            return None
+        f_val, f_deriv = _vpn_y_derivada(rate, años, valores)
+        if not (math.isfinite(f_val) and math.isfinite(f_deriv)) or abs(f_deriv) < 1e-10:
+            break
 
         new_rate = rate - f_val / f_deriv
         if abs(new_rate - rate) < tol:
-            return new_rate
+            return float(new_rate)
         rate = new_rate
 
-    return None
+    # Newton diverge o se estanca: se recurre a la búsqueda acotada
+    return _xirr_biseccion(años, valores, guess, max_iterations, tol)
+
+
+@cronometrado
+def xirr_arrays(fechas, importes, guess: float = 0.1, max_iterations: int = 100, tol: float = 1e-6):
+    importes = np.asarray(importes, dtype=np.float64)
+    if importes.size < 2:
+        return None
+    return _xirr_años(_dias_desde_inicio(fechas) / 365.0, importes, guess, max_iterations, tol)
+
+
+@cronometrado
+def xirr(cashflows: List[Tuple[datetime, float]], guess: float = 0.1, max_iterations: int = 100, tol: float = 1e-6):
+    if len(cashflows) < 2:
+        return None
+    fechas = pd.to_datetime([cf[0] for cf in cashflows]).values
+    importes = np.fromiter((cf[1] for cf in cashflows), dtype=np.float64, count=len(cashflows))
+    return xirr_arrays(fechas, importes, guess, max_iterations, tol)
+
+
+# === XIRR POR LOTES ===
+@cronometrado
+def xirr_lote(claves, fechas, importes, guess=0.1, max_iterations: int = 100, tol: float = 1e-6):
+    # Resuelve a la vez una serie de flujos por cada clave distinta (activo, año, fecha de corte...).
+    # guess puede ser un escalar o un array con una estimación inicial por clave (en orden de aparición).
+    codigos, unicos = pd.factorize(np.asarray(claves))
+    n_series = len(unicos)
+    tasas = np.full(n_series, np.nan)
+    if n_series == 0:
+        return pd.Series(tasas, index=unicos, dtype=np.float64)
+
+    segundos = np.asarray(fechas, dtype="datetime64[s]").astype(np.int64)
+    valores = np.asarray(importes, dtype=np.float64)
+    inicio = np.full(n_series, np.iinfo(np.int64).max)
+    np.minimum.at(inicio, codigos, segundos)
+    años = ((segundos - inicio[codigos]) // 86400) / 365.0
+
+    rates = np.broadcast_to(np.asarray(guess, dtype=np.float64), (n_series,)).copy()
+    pendiente = np.bincount(codigos, minlength=n_series) >= 2
+    a_biseccion = np.zeros(n_series, dtype=bool)
+
+    # Solo se iteran las filas de las series que siguen sin converger
+    filas = np.flatnonzero(pendiente[codigos])
+    c, t, v = codigos[filas], años[filas], valores[filas]
+    for _ in range(max_iterations):
+        if not pendiente.any():
+            break
+
+        with np.errstate(all="ignore"):
+            descuento = (1.0 + rates[c]) ** -t
+            vpn = np.bincount(c, v * descuento, minlength=n_series)
+            derivada = -np.bincount(c, t * v * descuento, minlength=n_series) / (1.0 + rates)
+            new_rates = rates - vpn / derivada
+
+        fallo = pendiente & ((rates <= -0.999) | ~np.isfinite(vpn) | ~np.isfinite(derivada) | (np.abs(derivada) < 1e-10))
+        convergida = pendiente & ~fallo & (np.abs(new_rates - rates) < tol)
+        tasas[convergida] = new_rates[convergida]
+        a_biseccion |= fallo
+
+        rates = np.where(pendiente & ~fallo, new_rates, rates)
+        terminadas = fallo | convergida
+        if terminadas.any():
+            pendiente &= ~terminadas
+            sigue = pendiente[c]
+            c, t, v = c[sigue], t[sigue], v[sigue]
+
+    # Las series que divergen o agotan las iteraciones se resuelven una a una por bisección
+    a_biseccion |= pendiente
+    if a_biseccion.any():
+        orden = np.argsort(codigos, kind="stable")
+        limites = np.searchsorted(codigos[orden], np.arange(n_series + 1))
+        guesses = np.broadcast_to(np.asarray(guess, dtype=np.float64), (n_series,))
+        for i in np.flatnonzero(a_biseccion):
+            idx = orden[limites[i]:limites[i + 1]]
+            tasa = _xirr_biseccion(años[idx], valores[idx], guesses[i], max_iterations, tol)
+            tasas[i] = np.nan if tasa is None else tasa
+
+    return pd.Series(tasas, index=unicos, dtype=np.float64)
+
+
+@cronometrado
+def xirr_por_grupo(df, clave, fecha="fecha_hora", importe="importe", guess=0.1):
+    return xirr_lote(df[clave].to_numpy(), df[fecha].to_numpy(), df[importe].to_numpy(), guess=guess)
+
+
+def _resolver_series(claves, fechas, importes, xirr_func=None):
+    # Con xirr_func se mantiene el cálculo serie a serie (compatibilidad); si no, se usa el motor por lotes
+    if xirr_func is None:
+        return xirr_lote(claves, fechas, importes)
+
+    flujos = pd.DataFrame({"clave": claves, "fecha": fechas, "importe": importes})
+    resultado = {}
+    for clave, grupo in flujos.groupby("clave", sort=False):
+        try:
+            tasa = xirr_func([(fecha.to_pydatetime(), importe) for fecha, importe in zip(grupo["fecha"], grupo["importe"])])
+        except Exception:
+            tasa = None
+        resultado[clave] = np.nan if tasa is None else tasa
+    return pd.Series(resultado, dtype=np.float64)
+
+
+def _a_porcentaje(tasa):
+    return None if tasa is None or pd.isna(tasa) else tasa * 100
 
 
 # === UTILIDADES COMPARTIDAS ===
-def filtrar_flujos_validos(df):
-    return df[
-        df["tipo_operacion"].isin(["aporte", "comision", "retirada"]) &
-        ~((df["tipo_operacion"] == "aporte") & df["subtipo_operacion"].str.startswith("reinv")) &
-        ~((df["tipo_operacion"] == "retirada") & (df["subtipo_operacion"] == "ajuste_por_perdida"))
+# Categoría de cada operación según su tipo y subtipo
+# Vocabulario de tipo_operacion -> subtipos válidos (formulario de registro, validación de lotes, generador sintético)
+SUBTIPOS_OPERACION = {
+    "aporte": ["compra", "reinv_benef", "reinv_recom"],
+    "retirada": ["retirada", "ajuste_por_perdida"],
+    "comision": ["comision_compra", "comision_venta"],
+    "beneficio": ["cashback", "venta", "dividendo", "interes"],
+    "perdida": ["venta"],
+    "otro": ["revalorizacion", "devaluacion", "ajuste"]
+}
+
+BUCKETS = ["compra", "aporte_otro", "reinv", "retirada", "ajuste", "retirada_otro", "comision", "consolidado", "flotante", "otro"]
+BUCKETS_FLUJO_VALIDO = ["compra", "aporte_otro", "retirada", "retirada_otro", "comision"]
+
+# Ledger tipado (ver tipar_ledger): texto repetitivo como Categorical, importes en float64 y banderas precalculadas
+COLUMNAS_CATEGORICAS = [
+    "activo", "moneda", "etiqueta", "tipo_operacion", "subtipo_operacion",
+    "plataforma", "tipo_activo", "objetivo_inversion", "tipo_rentabilidad_pred"
+]
+COLUMNAS_IMPORTE = ["importe_original", "tipo_cambio", "importe_euros", "porcentaje_participacion"]
+BANDERAS = ["es_reinversion", "es_flujo_valido", "es_flotante"]
+COLUMNAS_DERIVADAS = ["bucket"] + BANDERAS
+
+@cronometrado
+def clasificar_operaciones(df):
+    # Solo se clasifican las combinaciones distintas de tipo/subtipo (unas decenas) y se expanden por código:
+    # comparar cadenas fila a fila era la parte más cara de los cálculos por activo
+    if "bucket" in df.columns:
+        # Ledger tipado: el bucket ya se calculó al cargar (el Parquet puede devolver las categorías en otro orden)
+        buckets = df["bucket"].array
+        return buckets if list(buckets.categories) == BUCKETS else buckets.set_categories(BUCKETS)
+    if len(df) == 0:
+        return pd.Categorical([], categories=BUCKETS)
+    codigos_tipo, tipos = pd.factorize(df["tipo_operacion"], use_na_sentinel=False)
+    codigos_subtipo, subtipos = pd.factorize(df["subtipo_operacion"], use_na_sentinel=False)
+    codigos, combinaciones = pd.factorize(codigos_tipo.astype(np.int64) * len(subtipos) + codigos_subtipo)
+
+    tipo = np.asarray(tipos, dtype=object)[combinaciones // len(subtipos)]
+    subtipo = pd.Series(np.asarray(subtipos, dtype=object)[combinaciones % len(subtipos)]).fillna("").astype(str)
+    es_reinv = subtipo.str.startswith("reinv").to_numpy()
+    subtipo = subtipo.to_numpy()
+    condiciones = [
+        (tipo == "aporte") & (subtipo == "compra"),
+        (tipo == "aporte") & es_reinv,
+        tipo == "aporte",
+        (tipo == "retirada") & (subtipo == "retirada"),
+        (tipo == "retirada") & (subtipo == "ajuste_por_perdida"),
+        tipo == "retirada",
+        tipo == "comision",
+        (tipo == "beneficio") | (tipo == "perdida"),
+        (tipo == "otro") & ((subtipo == "revalorizacion") | (subtipo == "devaluacion"))
     ]
+    buckets = ["compra", "reinv", "aporte_otro", "retirada", "ajuste", "retirada_otro", "comision", "consolidado", "flotante"]
+    por_combinacion = pd.Categorical(np.select(condiciones, buckets, default="otro"), categories=BUCKETS)
+    return pd.Categorical.from_codes(por_combinacion.codes[codigos], categories=BUCKETS)
+
+def banderas_operacion(buckets):
+    # Banderas booleanas por fila a partir de los códigos de bucket (comparaciones de enteros)
+    codigos = np.asarray(buckets.codes)
+    return {
+        "es_reinversion": codigos == BUCKETS.index("reinv"),
+        "es_flujo_valido": np.isin(codigos, [BUCKETS.index(bucket) for bucket in BUCKETS_FLUJO_VALIDO]),
+        "es_flotante": codigos == BUCKETS.index("flotante")
+    }
+
+def _bandera(df, nombre):
+    # Bandera precalculada si el DataFrame viene de tipar_ledger; si no, se deriva de la clasificación
+    if nombre in df.columns:
+        return df[nombre].to_numpy(dtype=bool)
+    return banderas_operacion(clasificar_operaciones(df))[nombre]
+
+@cronometrado
+def tipar_ledger(df):
+    # Representación compacta del ledger cargado: un código entero por fila en las columnas de texto, importes
+    # float64 y, calculados una sola vez, el bucket de cada operación y sus banderas (filtros sin comparar cadenas)
+    df = df.copy()
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns:
+            df[columna] = df[columna].astype("category")
+    for columna in COLUMNAS_IMPORTE:
+        if columna in df.columns:
+            df[columna] = pd.to_numeric(df[columna], errors="coerce").astype(np.float64)
+    df = df.drop(columns=COLUMNAS_DERIVADAS, errors="ignore")
+    buckets = clasificar_operaciones(df)
+    df["bucket"] = buckets
+    for nombre, valores in banderas_operacion(buckets).items():
+        df[nombre] = valores
+    return df
+
+@cronometrado
+def filtrar_flujos_validos(df):
+    return df[_bandera(df, "es_flujo_valido")]
 
+@cronometrado
 def obtener_cashflows(df):
-    return df.apply(
-        lambda r: (
-            r["fecha_hora"].to_pydatetime(),
-            -r["importe_euros"]
-        ), axis=1
-    ).values.tolist()
+    # Flujos como arrays paralelos (fechas datetime64, importes float64) con el signo del inversor
+    return df["fecha_hora"].to_numpy(dtype="datetime64[ns]"), -df["importe_euros"].to_numpy(dtype=np.float64)
 
+@cronometrado
 def obtener_flotante(df):
-    return df[(df["tipo_operacion"] == "otro") & (df["subtipo_operacion"].isin(["revalorizacion", "devaluacion"]))]["importe_euros"].sum()
+    return df.loc[_bandera(df, "es_flotante"), "importe_euros"].sum()
+
+@cronometrado
+def calcular_porcentaje(numerador, denominador, solo_positivo=False, defecto=np.nan):
+    # División enmascarada: donde el denominador no es válido se devuelve el valor por defecto
+    numerador = np.asarray(numerador, dtype=np.float64)
+    denominador = np.asarray(denominador, dtype=np.float64)
+    valido = denominador > 0 if solo_positivo else denominador != 0
+    cociente = np.divide(numerador, denominador, out=np.zeros_like(numerador), where=valido)
+    return np.where(valido, cociente * 100, defecto)
+
+@cronometrado
+def obtener_flotante_por(df, clave):
+    return df[_bandera(df, "es_flotante")].groupby(clave, observed=True)["importe_euros"].sum()
 
 
 # === FUNCIONES ===
-def calcular_rentabilidad_por_activo(df):
-    resultados = []
-    for activo in df["activo"].dropna().unique():
-        sub = df[df["activo"] == activo]
-
-        aporte_compras = sub[(sub["tipo_operacion"] == "aporte") & (sub["subtipo_operacion"] == "compra")]["importe_euros"].sum()
-        retiradas = sub[(sub["tipo_operacion"] == "retirada") & (sub["subtipo_operacion"] == "retirada")]["importe_euros"].sum()
-        aporte_reinv = sub[(sub["tipo_operacion"] == "aporte") & (sub["subtipo_operacion"].str.startswith("reinv"))]["importe_euros"].sum()
-        ajuste_perdida = sub[(sub["tipo_operacion"] == "retirada") & (sub["subtipo_operacion"] == "ajuste_por_perdida")]["importe_euros"].sum()
-
-        aportado = aporte_compras + retiradas
-        aporte_neto = aportado + aporte_reinv + ajuste_perdida
-
-        beneficio_consolidado = sub[sub["tipo_operacion"].isin(["beneficio", "perdida"])]["importe_euros"].sum()
-        beneficio_flotante = obtener_flotante(sub)
-        valor_actual = aporte_neto + beneficio_flotante
-        beneficio_total = beneficio_consolidado + beneficio_flotante
-        rentabilidad_pct = (beneficio_total / aportado) * 100 if aportado != 0 else None
-
-        tir = calcular_tir_desde_df(sub, valor_actual)
-
-        resultados.append({
-            "activo": activo,
-            "aportado": aportado,
-            "beneficio_consolidado": beneficio_consolidado,
-            "valor_flotante": beneficio_flotante,
-            "beneficio_neto": beneficio_total,
-            "valor_actual": valor_actual,
-            "% rentabilidad_total": rentabilidad_pct,
-            "TIR %": tir * 100 if tir is not None else None,
-            "n_aportes": sub[(sub["tipo_operacion"] == "aporte") & (~sub["subtipo_operacion"].str.startswith("reinv"))].shape[0],
-            "primera_fecha": sub["fecha_hora"].min(),
-            "última_fecha": sub["fecha_hora"].max()
-        })
-    return pd.DataFrame(resultados)
+def _agregar_activos(codigos, n_activos, buckets, segundos, importes):
+    # Núcleo de calcular_rentabilidad_por_activo sobre arrays compactos: código de activo (0..n_activos-1),
+    # código de bucket, fecha en segundos e importe. Es lo que se ejecuta en cada worker (ver paralelo.py)
+    nb = len(BUCKETS)
+    b = {bucket: k for k, bucket in enumerate(BUCKETS)}
+    indice = codigos * nb + buckets
+    sumas = np.bincount(indice, np.nan_to_num(importes), minlength=n_activos * nb).reshape(n_activos, nb)
+    conteos = np.bincount(indice, minlength=n_activos * nb).reshape(n_activos, nb)
+
+    con_fecha = segundos != np.iinfo(np.int64).min  # NaT
+    primera = np.full(n_activos, np.iinfo(np.int64).max)
+    ultima = np.full(n_activos, np.iinfo(np.int64).min)
+    np.minimum.at(primera, codigos[con_fecha], segundos[con_fecha])
+    np.maximum.at(ultima, codigos[con_fecha], segundos[con_fecha])
+
+    # TIR de todos los activos de la partición en una sola resolución por lotes
+    valor_actual = sumas[:, b["compra"]] + sumas[:, b["retirada"]] + sumas[:, b["reinv"]] + sumas[:, b["ajuste"]] + sumas[:, b["flotante"]]
+    es_flujo = np.isin(buckets, [b[bucket] for bucket in BUCKETS_FLUJO_VALIDO])
+    con_flujos = pd.unique(codigos[es_flujo])
+    tirs = xirr_lote(
+        np.concatenate([codigos[es_flujo], con_flujos]),
+        np.concatenate([segundos[es_flujo], ultima[con_flujos]]).astype("datetime64[s]"),
+        np.concatenate([-importes[es_flujo], valor_actual[con_flujos]])
+    ).reindex(np.arange(n_activos)).to_numpy()
+    return {"sumas": sumas, "conteos": conteos, "primera": primera, "ultima": ultima, "tir": tirs}
+
+
+@cronometrado
+def calcular_rentabilidad_por_activo(df, backend=None, workers=None):
+    # backend: "serie", "hilos" o "procesos" (por defecto paralelo.BACKEND_POR_DEFECTO). Los activos se reparten
+    # entre workers y el resultado no depende del backend: mismas filas, en orden de primera aparición
+    df = df[df["activo"].notna()]
+    if df.empty:
+        return pd.DataFrame()
 
+    codigos, activos = pd.factorize(df["activo"])
+    agregados = ejecutar_por_claves(_agregar_activos, codigos, len(activos), (
+        clasificar_operaciones(df).codes.astype(np.int64),
+        df["fecha_hora"].to_numpy(dtype="datetime64[s]").astype(np.int64),
+        df["importe_euros"].to_numpy(dtype=np.float64)
+    ), backend, workers)
+
+    sumas = pd.DataFrame(agregados["sumas"], columns=BUCKETS)
+    conteos = pd.DataFrame(agregados["conteos"], columns=BUCKETS)
+    aportado = sumas["compra"] + sumas["retirada"]
+    aporte_neto = aportado + sumas["reinv"] + sumas["ajuste"]
+    beneficio_consolidado = sumas["consolidado"]
+    beneficio_flotante = sumas["flotante"]
+    valor_actual = aporte_neto + beneficio_flotante
+    beneficio_total = beneficio_consolidado + beneficio_flotante
+
+    return pd.DataFrame({
+        "activo": np.asarray(activos, dtype=object),
+        "aportado": aportado.to_numpy(),
+        "beneficio_consolidado": beneficio_consolidado.to_numpy(),
+        "valor_flotante": beneficio_flotante.to_numpy(),
+        "beneficio_neto": beneficio_total.to_numpy(),
+        "valor_actual": valor_actual.to_numpy(),
+        "% rentabilidad_total": calcular_porcentaje(beneficio_total, aportado),
+        "TIR %": agregados["tir"] * 100,
+        "n_aportes": (conteos["compra"] + conteos["aporte_otro"]).to_numpy(),
+        "primera_fecha": agregados["primera"].astype("datetime64[s]").astype("datetime64[ns]"),
+        "última_fecha": agregados["ultima"].astype("datetime64[s]").astype("datetime64[ns]")
+    })
+
+@cronometrado
+def kpis_desde_buckets(sumas):
+    # sumas: importe total por bucket (de clasificar_operaciones o de la tabla snapshots_diarios)
+    sumas = sumas.reindex(BUCKETS, fill_value=0)
+    aporte_bruto_compras = sumas["compra"] + sumas["retirada"]
+    aporte_bruto_reinv = sumas["reinv"] + sumas["ajuste"]
+    aporte_neto = aporte_bruto_compras + aporte_bruto_reinv
+    beneficio_bruto = sumas["consolidado"]
+    beneficio_flotante = sumas["flotante"]
+    beneficio_neto = beneficio_bruto + beneficio_flotante
+
+    return {
+        "aporte_bruto_compras": aporte_bruto_compras,
+        "aporte_bruto_reinv": aporte_bruto_reinv,
+        "aporte_neto": aporte_neto,
+        "beneficio_bruto": beneficio_bruto,
+        "beneficio_flotante": beneficio_flotante,
+        "beneficio_neto": beneficio_neto,
+        "valor_actual": aporte_neto + beneficio_flotante,
+        "rent_total_con": (beneficio_neto / aporte_neto * 100) if aporte_neto else 0,
+        "rent_total_sin": (beneficio_neto / aporte_bruto_compras * 100) if aporte_bruto_compras else 0
+    }
+
+@cronometrado
+def calcular_kpis(df):
+    kpis = kpis_desde_buckets(df.groupby(clasificar_operaciones(df), observed=False)["importe_euros"].sum())
+    kpis["tir_total"] = calcular_tir_desde_df(df, kpis["valor_actual"])
+    return kpis
+
+@cronometrado
+def calcular_rentabilidad_mensual(df):
+    df_mes = df.copy()
+    df_mes["mes"] = df_mes["fecha_hora"].dt.to_period("M").dt.to_timestamp()
+
+    flot_mes = df_mes[df_mes["subtipo_operacion"].isin(["revalorizacion", "devaluacion"])].groupby("mes")["importe_euros"].sum().reset_index(name="flotante")
+    net_mes = df_mes[df_mes["tipo_operacion"].isin(["beneficio", "perdida", "pérdida"])].groupby("mes")["importe_euros"].sum().reset_index(name="neta")
+    aport_mes = df_mes[df_mes["tipo_operacion"].isin(["aporte", "comision"])].groupby("mes")["importe_euros"].sum().reset_index(name="aportado")
+
+    mensual = pd.merge(flot_mes, net_mes, on="mes", how="outer")
+    mensual = pd.merge(mensual, aport_mes, on="mes", how="outer")
+    mensual = mensual.fillna(0).sort_values("mes")
+
+    mensual["% flotante"] = calcular_porcentaje(mensual["flotante"], mensual["aportado"], solo_positivo=True, defecto=0)
+    mensual["% neta"] = calcular_porcentaje(mensual["neta"], mensual["aportado"], solo_positivo=True, defecto=0)
+    return mensual
+
+@cronometrado
+def calcular_rentabilidad_acumulada(df):
+    df_flot = df[df["subtipo_operacion"].isin(["revalorizacion", "devaluacion"])]
+    df_net = df[df["tipo_operacion"].isin(["beneficio", "perdida", "pérdida"])]
+    df_aport = df[df["tipo_operacion"].isin(["aporte", "comision"])]
+
+    aportado = df_aport.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="aportado")
+    neta = df_net.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="neta")
+    flotante = df_flot.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="flotante")
+
+    area = aportado.merge(neta, on="fecha_hora", how="outer").merge(flotante, on="fecha_hora", how="outer").sort_values("fecha_hora").ffill().fillna(0)
+    area["% neta"] = calcular_porcentaje(area["neta"], area["aportado"], solo_positivo=True, defecto=0)
+    area["% flotante"] = calcular_porcentaje(area["flotante"], area["aportado"], solo_positivo=True, defecto=0)
+    return area
+
+@cronometrado
 def calcular_rentabilidad_anual(df):
     df = df.copy()
     df["año"] = df["fecha_hora"].dt.year
-    df["subtipo_operacion"] = df["subtipo_operacion"].fillna("")
 
     aportado = df[df["tipo_operacion"].isin(["aporte", "comision"])].groupby("año")["importe_euros"].sum().reset_index(name="aportado")
     consolidado = df[df["tipo_operacion"].isin(["beneficio", "perdida"])].groupby("año")["importe_euros"].sum().reset_index(name="beneficio_consolidado")
-    flotante = df[(df["tipo_operacion"] == "otro") & (df["subtipo_operacion"].isin(["revalorizacion", "devaluacion"]))].groupby("año")["importe_euros"].sum().reset_index(name="beneficio_flotante")
+    flotante = df[_bandera(df, "es_flotante")].groupby("año")["importe_euros"].sum().reset_index(name="beneficio_flotante")
 
     df_anual = aportado.merge(consolidado, on="año", how="outer").merge(flotante, on="año", how="outer").fillna(0)
     df_anual["beneficio_total"] = df_anual["beneficio_consolidado"] + df_anual["beneficio_flotante"]
-    df_anual["% rentabilidad total"] = df_anual.apply(lambda r: (r["beneficio_total"] / r["aportado"] * 100) if r["aportado"] != 0 else None, axis=1)
-    df_anual["% consolidado"] = df_anual.apply(lambda r: (r["beneficio_consolidado"] / r["aportado"] * 100) if r["aportado"] != 0 else None, axis=1)
-    df_anual["% flotante"] = df_anual.apply(lambda r: (r["beneficio_flotante"] / r["aportado"] * 100) if r["aportado"] != 0 else None, axis=1)
+    df_anual["% rentabilidad total"] = calcular_porcentaje(df_anual["beneficio_total"], df_anual["aportado"])
+    df_anual["% consolidado"] = calcular_porcentaje(df_anual["beneficio_consolidado"], df_anual["aportado"])
+    df_anual["% flotante"] = calcular_porcentaje(df_anual["beneficio_flotante"], df_anual["aportado"])
 
     return df_anual.sort_values("año")
 
+@cronometrado
 def calcular_tir_desde_df(df, valor_actual):
     flujos_validos = filtrar_flujos_validos(df)
     if flujos_validos.empty:
         return None
-    cashflows = obtener_cashflows(flujos_validos)
-    if not cashflows:
-        return None
-    fecha_final = df["fecha_hora"].max().to_pydatetime()
-    cashflows.append((fecha_final, valor_actual))
-    return xirr(cashflows)
+    fechas, importes = obtener_cashflows(flujos_validos)
+    fechas = np.append(fechas, df["fecha_hora"].max().to_datetime64())
+    importes = np.append(importes, valor_actual)
+    return xirr_arrays(fechas, importes)
 
+@cronometrado
 def calcular_tir_acumulado_en_tiempo(df, frecuencia="W"):
     if df.empty or df["fecha_hora"].isna().all():
         return pd.DataFrame()
 
     fechas = pd.date_range(start=df["fecha_hora"].min(), end=df["fecha_hora"].max(), freq=frecuencia)
-    resultado = []
-
-    for fecha_corte in fechas:
-        df_corte = df[df["fecha_hora"] <= fecha_corte]
-        flujos_validos = filtrar_flujos_validos(df_corte)
-        cashflows = obtener_cashflows(flujos_validos)
-
-        valor_estimado = flujos_validos["importe_euros"].sum() + obtener_flotante(df_corte)
+    if len(fechas) == 0:
+        return pd.DataFrame(columns=["fecha", "TIR %"])
+
+    # Se ordena una sola vez; cada fecha de corte es un prefijo de los flujos ordenados
+    df = df[df["fecha_hora"].notna()]
+    flujos = filtrar_flujos_validos(df).sort_values("fecha_hora", kind="stable")
+    flotantes = df[_bandera(df, "es_flotante")].sort_values("fecha_hora", kind="stable")
+
+    cortes = fechas.to_numpy()
+    n_flujos = np.searchsorted(flujos["fecha_hora"].to_numpy(), cortes, side="right")
+    n_flotantes = np.searchsorted(flotantes["fecha_hora"].to_numpy(), cortes, side="right")
+
+    # Sumas acumuladas: valor estimado en cada corte = flujos válidos + flotante hasta esa fecha
+    importes = -flujos["importe_euros"].to_numpy(dtype=np.float64)
+    acumulado = np.concatenate([[0.0], np.cumsum(importes)])
+    flotante = np.concatenate([[0.0], np.cumsum(flotantes["importe_euros"].to_numpy(dtype=np.float64))])
+    valor_estimado = -acumulado[n_flujos] + flotante[n_flotantes]
+
+    # Flujos agregados por día transcurrido desde el primero (el origen no cambia entre cortes)
+    segundos = flujos["fecha_hora"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    segundos_corte = cortes.astype("datetime64[s]").astype(np.int64)
+    origen = segundos[0] if len(segundos) else 0
+    dias, inicio_dia = np.unique((segundos - origen) // 86400, return_index=True)
+    años_dia = dias / 365.0
+    suma_dia = np.diff(acumulado[np.append(inicio_dia, len(importes))])
 
+    resultado = []
+    guess = 0.1
+    for k, fecha_corte in enumerate(fechas):
+        n = n_flujos[k]
         tir_pct = None
-        if len(cashflows) > 0:
-            cashflows.append((fecha_corte.to_pydatetime(), valor_estimado))
-            try:
-                tir = xirr(cashflows)
-                tir_pct = tir * 100 if tir is not None else None
-            except Exception:
-                pass
+        if n > 0:
+            # Días completos hasta el corte; el último puede estar incluido solo en parte
+            n_dias = np.searchsorted(inicio_dia, n)
+            valores = np.append(suma_dia[:n_dias], valor_estimado[k])
+            valores[n_dias - 1] = acumulado[n] - acumulado[inicio_dia[n_dias - 1]]
+            años = np.append(años_dia[:n_dias], ((segundos_corte[k] - origen) // 86400) / 365.0)
+
+            # Arranque en caliente con la TIR del corte anterior
+            tir = _xirr_años(años, valores, guess, 100, 1e-6)
+            if tir is not None:
+                guess = tir
+                tir_pct = tir * 100
 
         resultado.append({"fecha": fecha_corte, "TIR %": tir_pct})
 
     return pd.DataFrame(resultado)
 
-def calcular_tir_anual(df, xirr_func):
+@cronometrado
+def calcular_tir_anual(df, xirr_func=None):
     df = df.copy()
     df["año"] = df["fecha_hora"].dt.year
-    df["subtipo_operacion"] = df["subtipo_operacion"].fillna("")
 
-    resultado = []
-    for año in sorted(df["año"].unique()):
-        df_año = df[df["año"] == año]
-        flujos = filtrar_flujos_validos(df_año)
-        cashflows = obtener_cashflows(flujos)
-        valor_estimado = flujos["importe_euros"].sum() + obtener_flotante(df_año)
+    años = sorted(df["año"].unique())
+    flujos = filtrar_flujos_validos(df)
+    valor_estimado = flujos.groupby("año")["importe_euros"].sum().add(obtener_flotante_por(df, "año"), fill_value=0)
+    años_con_flujos = set(flujos["año"])
+    con_flujos = [año for año in años if año in años_con_flujos]
 
-        tir_pct = None
-        if len(cashflows) > 0:
-            cashflows.append((datetime(año, 12, 31), valor_estimado))
-            try:
-                tir = xirr_func(cashflows)
-                tir_pct = tir * 100 if tir is not None else None
-            except Exception:
-                pass
+    claves = np.concatenate([flujos["año"].to_numpy(), con_flujos])
+    fechas = np.concatenate([flujos["fecha_hora"].to_numpy(), np.array([datetime(año, 12, 31) for año in con_flujos], dtype="datetime64[ns]")])
+    importes = np.concatenate([-flujos["importe_euros"].to_numpy(dtype=np.float64), [valor_estimado[año] for año in con_flujos]])
+    tirs = _resolver_series(claves, fechas, importes, xirr_func)
 
-        resultado.append({"año": año, "TIR %": tir_pct})
-
-    return pd.DataFrame(resultado)
+    return pd.DataFrame({"año": años, "TIR %": [_a_porcentaje(tirs.get(año)) for año in años]})
@@ -0,0 +1,245 @@
+import argparse
+import csv
+import os
+from collections import Counter
+from itertools import islice
+import pandas as pd
+from openpyxl import load_workbook
+from esquema import CLAVE_NATURAL, COLUMNAS_ACTIVOS, COLUMNAS_TRANSACCIONES, conectar, crear_esquema, migrar
+from posiciones import reconstruir_posiciones
+from snapshots import reconstruir_snapshots
+
+TAMANO_LOTE = 5000
+COLUMNAS_NUMERICAS = {"importe_original", "tipo_cambio", "importe_euros", "porcentaje_participacion"}
+COLUMNAS_UPSERT = COLUMNAS_TRANSACCIONES + ["ocurrencia"]
+COLUMNAS_PAYLOAD = [c for c in COLUMNAS_UPSERT if c not in CLAVE_NATURAL]
+TOLERANCIA_IMPORTES = 1e-9
+
+
+# === LECTURA EN STREAMING ===
+def leer_filas(ruta, hoja=None):
+    # Devuelve un iterador de dicts sin cargar el fichero completo en memoria
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension == ".csv":
+        with open(ruta, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+        return
+
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = (libro[hoja] if hoja else libro.worksheets[0]).iter_rows(values_only=True)
+        cabecera = [str(c).strip() if c is not None else None for c in next(filas, [])]
+        for valores in filas:
+            if all(v is None for v in valores):
+                continue
+            yield {columna: valor for columna, valor in zip(cabecera, valores) if columna}
+    finally:
+        libro.close()
+
+
+def en_lotes(iterable, tamano):
+    iterador = iter(iterable)
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+
+def _numero(valor):
+    return None if valor is None else float(valor)
+
+
+def _vacio(valor):
+    return valor is None or valor == "" or (not isinstance(valor, str) and pd.isna(valor))
+
+
+def normalizar_transaccion(fila):
+    if _vacio(fila.get("fecha_hora")) or _vacio(fila.get("activo")):
+        return None
+    normalizada = {}
+    for columna in COLUMNAS_TRANSACCIONES:
+        valor = fila.get(columna)
+        if _vacio(valor):
+            valor = None
+        if columna == "fecha_hora":
+            valor = pd.Timestamp(valor).strftime("%Y-%m-%d %H:%M:%S")
+        elif columna in COLUMNAS_NUMERICAS:
+            valor = _numero(valor)
+        elif columna == "subtipo_operacion":
+            valor = valor or ""
+        elif valor is not None:
+            valor = str(valor)
+        normalizada[columna] = valor
+    if normalizada["importe_euros"] is None:
+        return None
+    return normalizada
+
+
+def validar_operaciones(df, activos_validos, subtipos):
+    # Valida un lote de operaciones introducidas a mano (editor o CSV pegado) contra el catálogo de activos y
+    # el diccionario tipo -> subtipos. Devuelve (operaciones válidas, lista de errores "Fila n: ...")
+    df = df.dropna(how="all").reset_index(drop=True)
+    df = df.reindex(columns=list(dict.fromkeys([*df.columns, *COLUMNAS_TRANSACCIONES])))
+    df["fecha_hora"] = pd.to_datetime(df["fecha_hora"], errors="coerce")
+    df["importe_original"] = pd.to_numeric(df["importe_original"], errors="coerce")
+    df["tipo_cambio"] = pd.to_numeric(df["tipo_cambio"], errors="coerce")
+    df["moneda"] = df["moneda"].fillna("EUR").astype(str).str.strip().str.upper()
+    df["porcentaje_participacion"] = pd.to_numeric(df["porcentaje_participacion"], errors="coerce").fillna(1.0)
+
+    comprobaciones = [
+        (df["fecha_hora"].isna(), "fecha_hora no válida"),
+        (~df["activo"].isin(activos_validos), "activo desconocido"),
+        (~df["tipo_operacion"].isin(list(subtipos)), "tipo_operacion no válido"),
+        (~pd.Series([s in subtipos.get(t, []) for t, s in zip(df["tipo_operacion"], df["subtipo_operacion"])], index=df.index, dtype=bool),
+         "subtipo_operacion no corresponde al tipo"),
+        (df["importe_original"].isna(), "importe no numérico"),
+        (df["tipo_cambio"].le(0), "tipo_cambio debe ser positivo")
+    ]
+    errores = []
+    for i in df.index:
+        motivos = [mensaje for mascara, mensaje in comprobaciones if mascara[i]]
+        if motivos:
+            errores.append(f"Fila {i + 1}: {', '.join(motivos)}")
+    return df, errores
+
+
+def filtrar_subconjunto(filas, activos=None, fecha_inicio=None, fecha_fin=None):
+    for fila in filas:
+        if activos and fila["activo"] not in activos:
+            continue
+        if fecha_inicio and fila["fecha_hora"] < fecha_inicio:
+            continue
+        if fecha_fin and fila["fecha_hora"] > fecha_fin:
+            continue
+        yield fila
+
+
+# === ESCRITURA ===
+def _cambia(columna):
+    # Condición "el valor del fichero es distinto del guardado". Los importes se comparan con tolerancia relativa:
+    # un xlsx no conserva los float64 bit a bit y una exportación reimportada sin cambios no debe reescribir filas
+    if columna not in COLUMNAS_NUMERICAS:
+        return f"{columna} IS NOT excluded.{columna}"
+    return (f"({columna} IS NULL) != (excluded.{columna} IS NULL) OR "
+            f"abs({columna} - excluded.{columna}) > {TOLERANCIA_IMPORTES} * max(1.0, abs({columna}), abs(excluded.{columna}))")
+
+
+SQL_UPSERT_TRANSACCION = f"""
+    INSERT INTO transacciones ({', '.join(COLUMNAS_UPSERT)})
+    VALUES ({', '.join('?' * len(COLUMNAS_UPSERT))})
+    ON CONFLICT ({', '.join(CLAVE_NATURAL)}) DO UPDATE SET
+        {', '.join(f'{c} = excluded.{c}' for c in COLUMNAS_PAYLOAD)}
+    WHERE {' OR '.join(map(_cambia, COLUMNAS_PAYLOAD))}
+"""
+
+SQL_UPSERT_ACTIVO = f"""
+    INSERT INTO activos ({', '.join(COLUMNAS_ACTIVOS)})
+    VALUES ({', '.join('?' * len(COLUMNAS_ACTIVOS))})
+    ON CONFLICT (activo) DO UPDATE SET
+        {', '.join(f'{c} = excluded.{c}' for c in COLUMNAS_ACTIVOS[1:])}
+    WHERE {' OR '.join(f'{c} IS NOT excluded.{c}' for c in COLUMNAS_ACTIVOS[1:])}
+"""
+
+
+def upsert_activos(conn, filas):
+    filas = [{c: (str(f[c]) if f.get(c) is not None else None) for c in COLUMNAS_ACTIVOS} for f in filas if f.get("activo")]
+    # rowcount y no total_changes: este también cuenta las filas que tocan los triggers de version_datos
+    return conn.executemany(SQL_UPSERT_ACTIVO, [tuple(f[c] for c in COLUMNAS_ACTIVOS) for f in filas]).rowcount
+
+
+def upsert_transacciones(conn, lote, ocurrencias):
+    # ocurrencias: contador compartido entre lotes para numerar operaciones repetidas en orden de fichero
+    filas = []
+    for fila in lote:
+        clave = tuple(fila[c] for c in CLAVE_NATURAL[:-1])
+        fila["ocurrencia"] = ocurrencias[clave]
+        ocurrencias[clave] += 1
+        filas.append(tuple(fila[c] for c in COLUMNAS_UPSERT))
+
+    # Activos nuevos se dan de alta en el catálogo para respetar la clave ajena
+    conn.executemany("INSERT OR IGNORE INTO activos (activo) VALUES (?)", {(f[1],) for f in filas})
+    return conn.executemany(SQL_UPSERT_TRANSACCION, filas).rowcount
+
+
+def insertar_transacciones(conn, filas):
+    # Altas nuevas (formulario de registro): la ocurrencia es el nº de operaciones ya guardadas con la misma clave
+    filas = [f for f in map(normalizar_transaccion, filas) if f is not None]
+    conn.executemany(f"""
+        INSERT INTO transacciones ({', '.join(COLUMNAS_UPSERT)})
+        VALUES ({', '.join('?' * len(COLUMNAS_TRANSACCIONES))}, (
+            SELECT COUNT(*) FROM transacciones WHERE {' AND '.join(f'{c} = ?' for c in CLAVE_NATURAL[:-1])}
+        ))
+    """, [tuple(f[c] for c in COLUMNAS_TRANSACCIONES) + tuple(f[c] for c in CLAVE_NATURAL[:-1]) for f in filas])
+    return filas
+
+
+def importar(conn, ruta_transacciones=None, ruta_activos=None, activos=None, fecha_inicio=None, fecha_fin=None,
+             sincronizar=False, tamano_lote=TAMANO_LOTE, progreso=print):
+    # Toda la importación va en una única transacción; con WAL los lectores siguen viendo la versión anterior
+    if fecha_inicio:
+        fecha_inicio = pd.Timestamp(fecha_inicio).strftime("%Y-%m-%d %H:%M:%S")
+    if fecha_fin:
+        fecha_fin = pd.Timestamp(fecha_fin).strftime("%Y-%m-%d %H:%M:%S")
+
+    resumen = {"leidas": 0, "cambiadas": 0, "eliminadas": 0, "activos_cambiados": 0}
+    with conn:
+        conn.execute("BEGIN")
+        if ruta_activos:
+            resumen["activos_cambiados"] = upsert_activos(conn, leer_filas(ruta_activos))
+
+        if ruta_transacciones:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS importadas (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM importadas")
+            ocurrencias = Counter()
+            filas = (f for f in map(normalizar_transaccion, leer_filas(ruta_transacciones)) if f is not None)
+            for lote in en_lotes(filtrar_subconjunto(filas, activos, fecha_inicio, fecha_fin), tamano_lote):
+                resumen["leidas"] += len(lote)
+                resumen["cambiadas"] += upsert_transacciones(conn, lote, ocurrencias)
+                if sincronizar:
+                    conn.executemany(f"""
+                        INSERT OR IGNORE INTO importadas (id)
+                        SELECT id FROM transacciones WHERE {' AND '.join(f'{c} = ?' for c in CLAVE_NATURAL)}
+                    """, [tuple(f[c] for c in CLAVE_NATURAL) for f in lote])
+                progreso(f"  {resumen['leidas']} filas procesadas ({resumen['cambiadas']} insertadas o actualizadas)")
+
+            if sincronizar:
+                # Las filas del subconjunto que ya no están en el fichero se eliminan
+                condiciones, parametros = ["id NOT IN (SELECT id FROM importadas)"], []
+                if activos:
+                    condiciones.append(f"activo IN ({', '.join('?' * len(activos))})")
+                    parametros += list(activos)
+                if fecha_inicio:
+                    condiciones.append("fecha_hora >= ?")
+                    parametros.append(fecha_inicio)
+                if fecha_fin:
+                    condiciones.append("fecha_hora <= ?")
+                    parametros.append(fecha_fin)
+                resumen["eliminadas"] = conn.execute(f"DELETE FROM transacciones WHERE {' AND '.join(condiciones)}", parametros).rowcount
+
+        if resumen["cambiadas"] or resumen["eliminadas"]:
+            reconstruir_snapshots(conn)
+            reconstruir_posiciones(conn)
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa transacciones y activos (xlsx o csv) a la base de datos por lotes")
+    parser.add_argument("--db", default="cartera_inversiones.db")
+    parser.add_argument("--transacciones", help="Fichero .xlsx o .csv de transacciones")
+    parser.add_argument("--activos", help="Fichero .xlsx o .csv de activos")
+    parser.add_argument("--activo", action="append", help="Importar solo este activo (se puede repetir)")
+    parser.add_argument("--desde", help="Importar solo operaciones desde esta fecha")
+    parser.add_argument("--hasta", help="Importar solo operaciones hasta esta fecha")
+    parser.add_argument("--sincronizar", action="store_true", help="Eliminar del subconjunto las filas que no estén en el fichero")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE)
+    args = parser.parse_args()
+
+    if not args.transacciones and not args.activos:
+        parser.error("indica al menos --transacciones o --activos")
+
+    conn = conectar(args.db)
+    migrar(conn)
+    crear_esquema(conn)
+    resumen = importar(conn, args.transacciones, args.activos, args.activo, args.desde, args.hasta, args.sincronizar, args.lote)
+    conn.close()
+
+    print(f"✔️ {resumen['leidas']} filas leídas, {resumen['cambiadas']} insertadas o actualizadas, "
+          f"{resumen['eliminadas']} eliminadas, {resumen['activos_cambiados']} activos actualizados.")
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Puntos por serie que se envían al navegador: del orden del ancho en píxeles de un gráfico
+MAX_PUNTOS = 1500
+
+
+# === ALGORITMOS DE REDUCCIÓN ===
+def _a_numerico(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, n_puntos):
+    # Largest-Triangle-Three-Buckets: índices de los n_puntos que mejor conservan la forma visual de la serie.
+    # El primer y el último punto se conservan siempre
+    n = len(y)
+    if n_puntos >= n or n_puntos < 3:
+        return np.arange(n)
+    x, y = _a_numerico(x), np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    limites = np.linspace(1, n - 1, n_puntos - 1).astype(np.int64)
+    indices = np.empty(n_puntos, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    anterior = 0
+    for i in range(n_puntos - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        # Punto medio del bucket siguiente (o el último punto en el último bucket)
+        siguiente_fin = limites[i + 2] if i + 2 < len(limites) else n
+        media_x, media_y = x[fin:siguiente_fin].mean(), y[fin:siguiente_fin].mean()
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fin] - y[anterior]) - (x[anterior] - x[inicio:fin]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
+
+
+def minmax(y, n_buckets):
+    # Mínimo y máximo de cada bucket (de igual nº de puntos): conserva los picos de series muy ruidosas
+    n = len(y)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    limites = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    indices = [0, n - 1]
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        if fin > inicio:
+            indices += [inicio + int(np.argmin(y[inicio:fin])), inicio + int(np.argmax(y[inicio:fin]))]
+    return np.unique(indices)
+
+
+# === REDUCCIÓN DE DATAFRAMES PARA GRÁFICOS ===
+def reducir_serie(df, x, columnas, max_puntos=MAX_PUNTOS, metodo="lttb"):
+    # Filas de df (ordenado por x) a dibujar: unión de los puntos elegidos para cada columna, más el mínimo y el
+    # máximo exactos de cada una y el primer y último punto, para que los extremos y el valor final no cambien.
+    # Todas las columnas comparten las mismas filas, así los rellenos apilados (tonexty) siguen alineados
+    if len(df) <= max_puntos:
+        return df
+    por_columna = max(3, max_puntos // len(columnas))
+    elegidos = [np.array([0, len(df) - 1])]
+    for columna in columnas:
+        valores = df[columna].to_numpy(dtype=np.float64)
+        if metodo == "minmax":
+            elegidos.append(minmax(valores, por_columna // 2))
+        else:
+            elegidos.append(lttb(df[x].to_numpy(), valores, por_columna))
+        if not np.isnan(valores).all():
+            elegidos.append(np.array([np.nanargmin(valores), np.nanargmax(valores)]))
+    return df.iloc[np.unique(np.concatenate(elegidos))]
+
+
+def recortar(df, x, ventana):
+    # Filas dentro de la ventana visible (inicio, fin); sin ventana se devuelve todo
+    if ventana is None:
+        return df
+    inicio, fin = ventana
+    return df[(df[x] >= inicio) & (df[x] <= fin)]
+
+
+def ventana_de_seleccion(evento):
+    # Rango de fechas de una selección de caja en un gráfico de Plotly (st.plotly_chart con on_select), o None
+    try:
+        caja = evento["selection"]["box"][0]
+        extremos = caja["x"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    try:
+        # Plotly devuelve las fechas como texto ("2024-03-01 12:00:00.000") o, según la versión, en milisegundos
+        extremos = [pd.Timestamp(v, unit="ms") if isinstance(v, (int, float)) else pd.Timestamp(v) for v in extremos]
+    except (TypeError, ValueError):
+        return None
+    return min(extremos), max(extremos)
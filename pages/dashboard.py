@@ -1,70 +1,122 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from datos import cargar_ledger, cargar_opciones_filtro, cargar_posiciones, cargar_sumas_por_bucket, version_bd
+from cache_analitica import CacheLRU, clave_filtros, memoizar
+from muestreo import recortar, reducir_serie, ventana_de_seleccion
+from rendimiento import MODOS_PERFIL, Perfilador, exportar_json, iniciar_registro
 from helper import (
-    xirr,
+    COLUMNAS_DERIVADAS,
+    kpis_desde_buckets,
+    calcular_kpis,
     calcular_tir_desde_df,
     calcular_rentabilidad_por_activo,
+    calcular_rentabilidad_mensual,
+    calcular_rentabilidad_acumulada,
     calcular_tir_acumulado_en_tiempo,
     calcular_rentabilidad_anual,
     calcular_tir_anual
 )
 
-# --- Cargar datos ---
-conn = sqlite3.connect("cartera_inversiones.db")
-trans = pd.read_sql("SELECT * FROM transacciones", conn)
-activos = pd.read_sql("SELECT * FROM activos", conn)
-conn.close()
-print(trans.head())
 
-# --- Unir y preparar ---
-df = trans.merge(activos, on="activo", how="left")
-df["fecha_hora"] = pd.to_datetime(df["fecha_hora"], errors="coerce")
-df["importe_euros"] = pd.to_numeric(df["importe_euros"], errors="coerce")
-
-# --- Filtros ---
-min_date, max_date = df["fecha_hora"].min(), df["fecha_hora"].max()
+@st.cache_resource
+def obtener_cache_analitica():
+    # Compartida entre sesiones y reruns; la versión de datos forma parte de cada clave
+    return CacheLRU(max_bytes=256 * 1024 * 1024)
+
+
+def puntos_a_dibujar(serie, x, columnas, clave_grafico):
+    # Solo la ventana seleccionada en el gráfico (selección de caja) y, como mucho, ~1500 puntos por serie:
+    # al acotar la ventana se vuelve a reducir desde la serie completa, con más detalle
+    visible = recortar(serie, x, ventana_de_seleccion(st.session_state.get(clave_grafico)))
+    return reducir_serie(visible if not visible.empty else serie, x, columnas)
+
+
+def leyenda_muestreo(dibujada, completa, clave_grafico):
+    if ventana_de_seleccion(st.session_state.get(clave_grafico)) is not None or len(dibujada) < len(completa):
+        st.caption(f"Mostrando {len(dibujada):,} de {len(completa):,} puntos. Selecciona un rango con la herramienta de caja "
+                   "para verlo con más detalle; doble clic para volver a la serie completa.")
+
+
+def panel_rendimiento(registro, perfilador):
+    # Detiene el perfil y cierra el registro de esta ejecución; se llama en cualquier salida de la página
+    if perfilador is not None:
+        registro.perfil = perfilador.detener()
+    registro.cerrar()
+    historial = st.session_state.setdefault("historial_rendimiento", [])
+    historial.append(registro.a_dict())
+    del historial[:-20]
+
+    if st.sidebar.toggle("Rendimiento", key="mostrar_rendimiento"):
+        with st.sidebar.expander(f"Rendimiento · {registro.total_ms:.0f} ms", expanded=True):
+            # Secciones del dashboard y, dentro de ellas, las funciones de helper.py que se han ejecutado (no las servidas de caché)
+            tiempos = pd.DataFrame(registro.resumen())
+            st.dataframe(
+                tiempos.sort_values("duracion_ms", ascending=False), hide_index=True,
+                column_config={"duracion_ms": st.column_config.NumberColumn("ms", format="%.1f")}
+            )
+            st.checkbox("Perfilar las siguientes ejecuciones", key="perfilar")
+            st.selectbox("Perfilador", MODOS_PERFIL, key="modo_perfil")
+            st.download_button("Exportar tiempos (JSON)", exportar_json(historial), file_name="rendimiento_dashboard.json", mime="application/json")
+        if registro.perfil:
+            with st.expander("Perfil de la ejecución"):
+                st.code(registro.perfil)
+
+
+# --- Instrumentación: tiempos de esta ejecución por sección (panel "Rendimiento") y perfil opcional ---
+registro = iniciar_registro("dashboard")
+perfilador = None
+if st.session_state.get("perfilar"):
+    perfilador = Perfilador(st.session_state.get("modo_perfil", MODOS_PERFIL[0]))
+    perfilador.iniciar()
+
+# --- Filtros (opciones leídas de la base de datos, en caché hasta que cambie) ---
+registro.seccion("Filtros")
+version = version_bd()
+opciones = cargar_opciones_filtro(version)
+min_date, max_date = opciones["fecha_min"], opciones["fecha_max"]
 start_date, end_date = st.sidebar.date_input("Rango de fechas", [min_date, max_date], min_value=min_date, max_value=max_date)
-activo_sel = st.sidebar.multiselect("Activo", options=df["activo"].unique(), default=df["activo"].unique())
-tipo_sel = st.sidebar.multiselect("Tipo de operación", options=df["tipo_operacion"].unique(), default=df["tipo_operacion"].unique())
+activo_sel = st.sidebar.multiselect("Activo", options=opciones["activos"], default=opciones["activos"])
+tipo_sel = st.sidebar.multiselect("Tipo de operación", options=opciones["tipos"], default=opciones["tipos"])
 
-# --- Aplicar filtros ---
-df = df[(df["fecha_hora"] >= pd.to_datetime(start_date)) & (df["fecha_hora"] <= pd.to_datetime(end_date))]
-df_filtrado = df[df["activo"].isin(activo_sel) & df["tipo_operacion"].isin(tipo_sel)]
+# --- Cargar datos ya filtrados (WHERE en SQLite o filtros sobre el snapshot Parquet) ---
+registro.seccion("Carga del ledger")
+df_filtrado = cargar_ledger(version, pd.to_datetime(start_date), pd.to_datetime(end_date), tuple(activo_sel), tuple(tipo_sel))
 
 if df_filtrado.empty:
     st.warning("No hay datos para mostrar con los filtros seleccionados.")
+    panel_rendimiento(registro, perfilador)
     st.stop()
 
+# --- Cálculos memoizados por estado de filtros ---
+cache = obtener_cache_analitica()
+estado = clave_filtros(version, start_date, end_date, activo_sel, tipo_sel)
+
 
 # --- Transacciones ---
+registro.seccion("Tabla de transacciones")
 st.subheader("Transacciones filtradas")
-st.dataframe(df_filtrado.sort_values("fecha_hora", ascending=False))
+st.dataframe(df_filtrado.drop(columns=COLUMNAS_DERIVADAS).sort_values("fecha_hora", ascending=False))
 
 
 
 # --- KPIs generales ---
-aporte_compras = df_filtrado.query("tipo_operacion == 'aporte' and subtipo_operacion == 'compra'")["importe_euros"].sum()
-retiradas = df_filtrado.query("tipo_operacion == 'retirada' and subtipo_operacion == 'retirada'")["importe_euros"].sum()
-aporte_reinv = df_filtrado.query("tipo_operacion == 'aporte' and subtipo_operacion.str.startswith('reinv')", engine="python")["importe_euros"].sum()
-ajuste_perdida = df_filtrado.query("tipo_operacion == 'retirada' and subtipo_operacion == 'ajuste_por_perdida'")["importe_euros"].sum()
-
-aporte_bruto_compras = aporte_compras + retiradas
-aporte_bruto_reinv = aporte_reinv + ajuste_perdida
-aporte_neto = aporte_bruto_compras + aporte_bruto_reinv
-
-beneficios = df_filtrado.query("tipo_operacion == 'beneficio'")["importe_euros"].sum()
-perdidas = df_filtrado.query("tipo_operacion == 'perdida'")["importe_euros"].sum()
-beneficio_bruto = beneficios + perdidas
-
-beneficio_flotante = df_filtrado.query("tipo_operacion == 'otro' and subtipo_operacion in ['revalorizacion', 'devaluacion']")["importe_euros"].sum()
-beneficio_neto = beneficio_bruto + beneficio_flotante
-valor_actual = aporte_neto + beneficio_flotante
-
-rent_total_con = (beneficio_neto / aporte_neto * 100) if aporte_neto else 0
-rent_total_sin = (beneficio_neto / aporte_bruto_compras * 100) if aporte_bruto_compras else 0
+# Sin filtro por tipo, las sumas salen de snapshots_diarios (O(días × activos)) con los mismos límites que el
+# filtro del ledger: hasta las 00:00:00 del día final incluidas
+registro.seccion("KPIs")
+sumas_snapshot = None
+if set(tipo_sel) == set(opciones["tipos"]):
+    sumas_snapshot = cargar_sumas_por_bucket(version, pd.to_datetime(start_date), pd.to_datetime(end_date), tuple(sorted(activo_sel)))
+
+if sumas_snapshot is not None:
+    kpis = kpis_desde_buckets(sumas_snapshot)
+    kpis["tir_total"] = memoizar(cache, estado, calcular_tir_desde_df, df_filtrado, valor_actual=kpis["valor_actual"])
+else:
+    kpis = memoizar(cache, estado, calcular_kpis, df_filtrado)
+aporte_bruto_compras, aporte_bruto_reinv, aporte_neto = kpis["aporte_bruto_compras"], kpis["aporte_bruto_reinv"], kpis["aporte_neto"]
+beneficio_bruto, beneficio_flotante, beneficio_neto = kpis["beneficio_bruto"], kpis["beneficio_flotante"], kpis["beneficio_neto"]
+valor_actual, rent_total_sin, tir_total = kpis["valor_actual"], kpis["rent_total_sin"], kpis["tir_total"]
 
 # --- Mostrar KPIs ---
 st.subheader("Valor actual de la cartera")
@@ -81,14 +133,14 @@ col4.metric("Beneficio Consolidado", f"{beneficio_bruto:,.2f} €")
 col5.metric("Beneficio Flotante", f"{beneficio_flotante:,.2f} €")
 col6.metric("Beneficio Neto", f"{beneficio_neto:,.2f} €")
 
-tir_total = calcular_tir_desde_df(df_filtrado, valor_actual)
 col7, col8, _ = st.columns(3)
 col7.metric("Rentabilidad total (%)", f"{rent_total_sin:.2f} %")
 col8.metric("TIR Cartera", f"{tir_total * 100:.2f} %" if tir_total else "No disponible")
 
 # --- Rentabilidad por activo ---
+registro.seccion("Rentabilidad por activo")
 st.subheader("Rentabilidad porcentual por activo")
-df_rentabilidad = calcular_rentabilidad_por_activo(df_filtrado)
+df_rentabilidad = memoizar(cache, estado, calcular_rentabilidad_por_activo, df_filtrado)
 if not df_rentabilidad.empty:
     st.dataframe(
         df_rentabilidad.sort_values("TIR %", ascending=False),
@@ -105,24 +157,33 @@ if not df_rentabilidad.empty:
 else:
     st.info("No hay resultados para mostrar o falta la columna TIR %.")
 
+# --- Posiciones actuales (lotes FIFO): estado guardado, no se recalcula el historial ---
+registro.seccion("Posiciones")
+posiciones = cargar_posiciones(version, tuple(sorted(activo_sel)))
+if posiciones is not None and not posiciones.empty:
+    st.subheader("Posiciones actuales (lotes FIFO)")
+    st.caption("Estado a día de hoy de los activos seleccionados, sin aplicar el rango de fechas. Cada activo se valora por "
+               "participaciones: las revalorizaciones mueven su precio y las retiradas venden primero los lotes más antiguos.")
+    euros = st.column_config.NumberColumn(format="%.2f €")
+    st.dataframe(
+        posiciones[["activo", "unidades", "precio", "coste", "valor", "no_realizado", "realizado", "cobrado", "comisiones",
+                    "beneficio_total", "n_lotes", "fecha_lote_mas_antiguo"]],
+        column_config={
+            "unidades": st.column_config.NumberColumn(format="%.4f"), "precio": st.column_config.NumberColumn(format="%.4f €"),
+            "coste": euros, "valor": euros, "no_realizado": euros, "realizado": euros, "cobrado": euros, "comisiones": euros,
+            "beneficio_total": euros
+        },
+        hide_index=True
+    )
 
 
-# --- Rentabilidad mensual: flotante, neta y porcentaje sobre aportes ---
-df_mes = df_filtrado.copy()
-df_mes["mes"] = df_mes["fecha_hora"].dt.to_period("M").dt.to_timestamp()
-
-flot_mes = df_mes[df_mes["subtipo_operacion"].isin(["revalorizacion", "devaluacion"])].groupby("mes")["importe_euros"].sum().reset_index(name="flotante")
-net_mes = df_mes[df_mes["tipo_operacion"].isin(["beneficio", "perdida", "pérdida"])].groupby("mes")["importe_euros"].sum().reset_index(name="neta")
-aport_mes = df_mes[df_mes["tipo_operacion"].isin(["aporte", "comision"])].groupby("mes")["importe_euros"].sum().reset_index(name="aportado")
-
-mensual = pd.merge(flot_mes, net_mes, on="mes", how="outer")
-mensual = pd.merge(mensual, aport_mes, on="mes", how="outer")
-mensual = mensual.fillna(0).sort_values("mes")
 
-mensual["% flotante"] = mensual.apply(lambda r: r["flotante"] / r["aportado"] * 100 if r["aportado"] > 0 else 0, axis=1)
-mensual["% neta"] = mensual.apply(lambda r: r["neta"] / r["aportado"] * 100 if r["aportado"] > 0 else 0, axis=1)
+# --- Rentabilidad mensual: flotante, neta y porcentaje sobre aportes ---
+registro.seccion("Beneficio mensual")
+mensual = memoizar(cache, estado, calcular_rentabilidad_mensual, df_filtrado)
 
 # --- Gráfico de barras: beneficio en euros ---
+registro.seccion("Beneficio mensual · figura")
 fig_beneficio_eur = go.Figure()
 fig_beneficio_eur.add_trace(go.Bar(x=mensual["mes"], y=mensual["flotante"], name="Flotante", marker_color="gold"))
 fig_beneficio_eur.add_trace(go.Bar(x=mensual["mes"], y=mensual["neta"], name="Consolidado", marker_color="steelblue"))
@@ -138,57 +199,59 @@ st.plotly_chart(fig_beneficio_eur, use_container_width=True)
 
 
 # --- Evolución del TIR acumulado en el tiempo ---
-df_tir_tiempo = calcular_tir_acumulado_en_tiempo(df_filtrado)
+registro.seccion("TIR acumulado")
+frecuencias_tir = {"Semanal": "W", "Diaria": "D"}
+frecuencia_tir = st.radio("Frecuencia del TIR acumulado", list(frecuencias_tir.keys()), horizontal=True)
+df_tir_tiempo = memoizar(cache, estado, calcular_tir_acumulado_en_tiempo, df_filtrado, frecuencia=frecuencias_tir[frecuencia_tir])
 
+registro.seccion("TIR acumulado · figura")
 if not df_tir_tiempo.empty and "fecha" in df_tir_tiempo.columns and "TIR %" in df_tir_tiempo.columns:
-    tir = df_tir_tiempo["TIR %"]
-    fechas = df_tir_tiempo["fecha"]
+    serie_tir = puntos_a_dibujar(df_tir_tiempo, "fecha", ["TIR %"], "grafico_tir")
+    tir = serie_tir["TIR %"]
+    fechas = serie_tir["fecha"]
     tir_pos = tir.where(tir > 0, 0)
     tir_neg = tir.where(tir < 0, 0)
 
     fig_tir = go.Figure()
     fig_tir.add_trace(go.Scatter(x=fechas, y=tir_pos, fill='tozeroy', mode='none', fillcolor='rgba(0, 200, 0, 0.3)', name='Zona positiva'))
     fig_tir.add_trace(go.Scatter(x=fechas, y=tir_neg, fill='tozeroy', mode='none', fillcolor='rgba(200, 0, 0, 0.3)', name='Zona negativa'))
-    fig_tir.add_trace(go.Scatter(x=fechas, y=tir, mode='lines+markers', line=dict(color='lightblue', width=2), name='TIR acumulada'))
+    fig_tir.add_trace(go.Scatter(x=fechas, y=tir, mode='lines+markers' if len(serie_tir) <= 200 else 'lines', line=dict(color='lightblue', width=2), name='TIR acumulada'))
     fig_tir.add_shape(type="line", x0=fechas.min(), y0=0, x1=fechas.max(), y1=0, line=dict(color="white", width=1, dash="dash"))
     fig_tir.update_layout(title='Evolución del TIR acumulado', xaxis_title='Fecha', yaxis_title='TIR %', hovermode="x unified")
-    st.plotly_chart(fig_tir)
+    st.plotly_chart(fig_tir, key="grafico_tir", on_select="rerun", selection_mode="box")
+    leyenda_muestreo(serie_tir, df_tir_tiempo, "grafico_tir")
 else:
     st.info("No hay datos para mostrar en el gráfico de TIR acumulado.")
 
 # --- Rentabilidad acumulada en € y % ---
-df_flot = df_filtrado[df_filtrado["subtipo_operacion"].isin(["revalorizacion", "devaluacion"])]
-df_net = df_filtrado[df_filtrado["tipo_operacion"].isin(["beneficio", "perdida", "pérdida"])]
-df_aport = df_filtrado[df_filtrado["tipo_operacion"].isin(["aporte", "comision"])]
-
-aportado = df_aport.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="aportado")
-neta = df_net.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="neta")
-flotante = df_flot.groupby("fecha_hora")["importe_euros"].sum().cumsum().reset_index(name="flotante")
-
-area = aportado.merge(neta, on="fecha_hora", how="outer").merge(flotante, on="fecha_hora", how="outer").sort_values("fecha_hora").ffill().fillna(0)
-area["% neta"] = area.apply(lambda r: r["neta"] / r["aportado"] * 100 if r["aportado"] > 0 else 0, axis=1)
-area["% flotante"] = area.apply(lambda r: r["flotante"] / r["aportado"] * 100 if r["aportado"] > 0 else 0, axis=1)
+registro.seccion("Rentabilidad acumulada")
+area = memoizar(cache, estado, calcular_rentabilidad_acumulada, df_filtrado)
 
+registro.seccion("Rentabilidad acumulada · figura")
+area_plot = puntos_a_dibujar(area, "fecha_hora", ["flotante", "neta", "% flotante", "% neta"], "grafico_area")
 fig_area = make_subplots(rows=1, cols=2, subplot_titles=["Beneficio acumulado (€)", "Rentabilidad acumulada (%)"], shared_xaxes=False)
-fig_area.add_trace(go.Scatter(x=area["fecha_hora"], y=area["flotante"], fill="tozeroy", name="Flotante €", line=dict(color="gold"), opacity=0.4), row=1, col=1)
-fig_area.add_trace(go.Scatter(x=area["fecha_hora"], y=area["neta"], fill="tonexty", name="Consolidado €", line=dict(color="steelblue")), row=1, col=1)
-fig_area.add_trace(go.Scatter(x=area["fecha_hora"], y=area["% flotante"], fill="tozeroy", name="Flotante %", line=dict(color="gold"), opacity=0.4), row=1, col=2)
-fig_area.add_trace(go.Scatter(x=area["fecha_hora"], y=area["% neta"], fill="tonexty", name="Consolidado %", line=dict(color="steelblue")), row=1, col=2)
+fig_area.add_trace(go.Scatter(x=area_plot["fecha_hora"], y=area_plot["flotante"], fill="tozeroy", name="Flotante €", line=dict(color="gold"), opacity=0.4), row=1, col=1)
+fig_area.add_trace(go.Scatter(x=area_plot["fecha_hora"], y=area_plot["neta"], fill="tonexty", name="Consolidado €", line=dict(color="steelblue")), row=1, col=1)
+fig_area.add_trace(go.Scatter(x=area_plot["fecha_hora"], y=area_plot["% flotante"], fill="tozeroy", name="Flotante %", line=dict(color="gold"), opacity=0.4), row=1, col=2)
+fig_area.add_trace(go.Scatter(x=area_plot["fecha_hora"], y=area_plot["% neta"], fill="tonexty", name="Consolidado %", line=dict(color="steelblue")), row=1, col=2)
 fig_area.update_xaxes(title_text="Fecha", row=1, col=1)
 fig_area.update_yaxes(title_text="€ acumulado", row=1, col=1)
 fig_area.update_xaxes(title_text="Fecha", row=1, col=2)
 fig_area.update_yaxes(title_text="% sobre aportado", row=1, col=2)
 fig_area.update_layout(title="Beneficio en euros vs rentabilidad en %", hovermode="x unified", legend=dict(orientation="h", yanchor="bottom", y=1.05, xanchor="center", x=0.5))
-st.plotly_chart(fig_area, use_container_width=True)
+st.plotly_chart(fig_area, use_container_width=True, key="grafico_area", on_select="rerun", selection_mode="box")
+leyenda_muestreo(area_plot, area, "grafico_area")
 
 # --- Rentabilidad anual ---
-df_rent = calcular_rentabilidad_anual(df_filtrado)
-df_tir = calcular_tir_anual(df_filtrado, xirr)
+registro.seccion("Rentabilidad anual")
+df_rent = memoizar(cache, estado, calcular_rentabilidad_anual, df_filtrado)
+df_tir = memoizar(cache, estado, calcular_tir_anual, df_filtrado)
 df_final = df_rent.merge(df_tir, on="año", how="left")
 
 st.subheader("Rentabilidad anual (% y €)")
 st.dataframe(df_final)
 
+registro.seccion("Rentabilidad anual · figura")
 fig_year = go.Figure()
 fig_year.add_trace(go.Bar(x=df_final["año"], y=df_final["% rentabilidad total"], name="Rentabilidad Total (%)"))
 fig_year.add_trace(go.Scatter(x=df_final["año"], y=df_final["TIR %"], name="TIR (%)", mode="lines+markers", yaxis="y2"))
@@ -209,3 +272,9 @@ fig_year.update_layout(
 
 st.plotly_chart(fig_year)
 
+# --- Estado de la caché de cálculos ---
+stats = cache.estadisticas()
+st.sidebar.caption(f"Caché de cálculos: {stats['aciertos']} aciertos · {stats['fallos']} fallos · {stats['entradas']} entradas ({stats['bytes'] / 1024 ** 2:.1f} MB)")
+
+# --- Panel de rendimiento ---
+panel_rendimiento(registro, perfilador)
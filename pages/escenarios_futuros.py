@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from datos import cargar_ledger, cargar_opciones_filtro, version_bd
+from escenarios import parametros_por_activo, resumen_escenarios, simular_escenarios
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cargar_parametros(version, activos):
+    return parametros_por_activo(cargar_ledger(version, activos=activos))
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def simular(version, activos, años, aportacion, n_caminos, correlacion, ajuste_rentabilidad, semilla):
+    # Caché por versión de datos y conjunto de parámetros: volver a una combinación ya simulada no recalcula
+    parametros = cargar_parametros(version, activos)
+    return simular_escenarios(
+        parametros["valor_actual"], parametros["rentabilidad"] + ajuste_rentabilidad, parametros["volatilidad"],
+        meses=años * 12, aportacion_mensual=aportacion, n_caminos=n_caminos, correlacion=correlacion, semilla=semilla
+    )
+
+
+st.subheader("Escenarios futuros")
+st.caption("Proyección Monte Carlo de la cartera actual: cada activo parte de su valor actual y evoluciona con su TIR "
+           "histórica como rentabilidad esperada y la variación mensual de sus revalorizaciones como volatilidad.")
+
+version = version_bd()
+opciones = cargar_opciones_filtro(version)
+activo_sel = st.sidebar.multiselect("Activos a proyectar", options=opciones["activos"], default=opciones["activos"])
+if not activo_sel:
+    st.warning("Selecciona al menos un activo.")
+    st.stop()
+activos = tuple(sorted(activo_sel))
+
+parametros = cargar_parametros(version, activos)
+if parametros.empty:
+    st.warning("Ninguno de los activos seleccionados tiene valor actual positivo que proyectar.")
+    st.stop()
+
+# --- Parámetros de la simulación ---
+col1, col2, col3 = st.columns(3)
+años = col1.slider("Horizonte (años)", 1, 30, 10)
+aportacion = col2.number_input("Aportación mensual (€)", min_value=0.0, value=0.0, step=50.0)
+n_caminos = col3.select_slider("Nº de escenarios", options=[10_000, 25_000, 50_000, 100_000], value=10_000)
+col4, col5, col6 = st.columns(3)
+correlacion = col4.slider("Correlación entre activos", 0.0, 0.9, 0.3, step=0.1)
+ajuste = col5.slider("Ajuste a la rentabilidad esperada (puntos %)", -10, 10, 0)
+semilla = col6.number_input("Semilla", min_value=0, value=0, step=1)
+
+with st.expander("Parámetros estimados por activo"):
+    st.dataframe(
+        parametros.assign(rentabilidad=parametros["rentabilidad"] * 100, volatilidad=parametros["volatilidad"] * 100),
+        column_config={
+            "valor_actual": st.column_config.NumberColumn(format="%.2f €"),
+            "rentabilidad": st.column_config.NumberColumn("rentabilidad anual", format="%.2f %%"),
+            "volatilidad": st.column_config.NumberColumn("volatilidad anual", format="%.2f %%")
+        },
+        hide_index=True
+    )
+
+with st.spinner(f"Simulando {n_caminos:,} escenarios..."):
+    resultado = simular(version, activos, años, aportacion, n_caminos, correlacion, ajuste / 100, int(semilla))
+resumen = resumen_escenarios(resultado)
+
+# --- Resumen ---
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Valor final (mediana)", f"{resumen['valor_final'][50]:,.0f} €")
+col2.metric("Rango 5 % – 95 %", f"{resumen['valor_final'][5]:,.0f} – {resumen['valor_final'][95]:,.0f} €")
+col3.metric("TIR (mediana)", f"{resumen['tir'][50]:.2f} %")
+col4.metric("Prob. de acabar por debajo de lo aportado", f"{resumen['prob_perdida'] * 100:.1f} %")
+
+# --- Bandas de percentiles ---
+bandas = resultado["bandas"]
+fig_bandas = go.Figure()
+for inferior, superior, nombre, opacidad in [("p5", "p95", "5 % – 95 %", 0.15), ("p25", "p75", "25 % – 75 %", 0.3)]:
+    fig_bandas.add_trace(go.Scatter(x=bandas["fecha"], y=bandas[superior], line=dict(width=0), showlegend=False, hoverinfo="skip"))
+    fig_bandas.add_trace(go.Scatter(x=bandas["fecha"], y=bandas[inferior], fill="tonexty", line=dict(width=0), name=nombre,
+                                    fillcolor=f"rgba(31, 119, 180, {opacidad})"))
+fig_bandas.add_trace(go.Scatter(x=bandas["fecha"], y=bandas["p50"], name="Mediana", line=dict(color="rgb(31, 119, 180)")))
+fig_bandas.add_trace(go.Scatter(x=bandas["fecha"], y=bandas["aportado"], name="Aportado", line=dict(color="gray", dash="dash")))
+fig_bandas.update_layout(title="Valor proyectado de la cartera", yaxis_title="€", hovermode="x unified")
+st.plotly_chart(fig_bandas, use_container_width=True)
+
+# --- Distribución de la TIR ---
+# Se envía el histograma ya agrupado, no los n_caminos valores
+tir = resultado["tir"][np.isfinite(resultado["tir"])]
+limites = np.percentile(tir, [0.5, 99.5]) if len(tir) else (0, 1)
+conteos, bordes = np.histogram(np.clip(tir, *limites), bins=60, range=tuple(limites))
+fig_tir = go.Figure(go.Bar(x=(bordes[:-1] + bordes[1:]) / 2, y=conteos / max(len(tir), 1) * 100, marker_color="teal", name="TIR"))
+fig_tir.add_vline(x=resumen["tir"][50], line_dash="dash", annotation_text="Mediana")
+fig_tir.update_layout(title=f"Distribución de la TIR a {años} años", xaxis_title="TIR %", yaxis_title="% de escenarios", bargap=0.02)
+st.plotly_chart(fig_tir, use_container_width=True)
+
+st.dataframe(
+    pd.DataFrame({
+        "percentil": [f"p{p}" for p in resumen["valor_final"]],
+        "valor final": list(resumen["valor_final"].values()),
+        "TIR %": list(resumen["tir"].values())
+    }),
+    column_config={"valor final": st.column_config.NumberColumn(format="%.2f €"), "TIR %": st.column_config.NumberColumn(format="%.2f %%")},
+    hide_index=True
+)
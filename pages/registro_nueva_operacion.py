@@ -1,87 +1,171 @@
-import sqlite3
+import io
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import requests
+from datos import DB_PATH
+from esquema import conectar
+from helper import SUBTIPOS_OPERACION
+from importar import insertar_transacciones, validar_operaciones
+from posiciones import actualizar_posiciones
+from snapshots import actualizar_snapshots
+from tipos_cambio import ServicioTiposCambio
+
+
+@st.cache_resource
+def obtener_servicio_tipos_cambio():
+    # Una instancia por proceso: comparte los refrescos en curso entre reruns y sesiones
+    return ServicioTiposCambio(DB_PATH)
+
 
 st.subheader("Registrar nuevo movimiento")
 
 # Leer activos desde la base de datos
-conn = sqlite3.connect("cartera_inversiones.db")
+conn = conectar(DB_PATH, solo_lectura=True)
 activos_df = pd.read_sql("SELECT DISTINCT activo FROM activos", conn)
 conn.close()
 opciones_activos = sorted(activos_df["activo"].dropna().unique())
 
 # Diccionario de subtipos
-subtipos_dict = {
-    "aporte": ["compra", "reinv_benef", "reinv_recom"],
-    "retirada": ["retirada", "ajuste_por_perdida"],
-    "comision": ["comision_compra", "comision_venta"],
-    "beneficio": ["cashback", "venta", "dividendo", "interes"],
-    "perdida": ["venta"],
-    "otro": ["revalorizacion", "devaluacion", "ajuste"]
-}
-
-# Utilizar estado de sesión para almacenar selección y forzar rerun
-if "tipo_operacion" not in st.session_state:
-    st.session_state.tipo_operacion = "aporte"
-
-tipo_operacion = st.selectbox("Tipo de operación", list(subtipos_dict.keys()),
-                                index=list(subtipos_dict.keys()).index(st.session_state.tipo_operacion),
-                                on_change=lambda: st.session_state.update(tipo_operacion=st.session_state.tipo_operacion))
-
-# Subtipos actualizados dinámicamente
-subtipo_opciones = subtipos_dict.get(tipo_operacion, [])
-
-with st.form("form_movimiento"):
-    col1, col2 = st.columns(2)
-    with col1:
-        fecha = st.date_input("Fecha", value=datetime.today())
-        hora = st.time_input("Hora", value=datetime.now().time())
-        activo = st.selectbox("Activo", opciones_activos)
-        importe = st.number_input("Importe en euros", format="%.2f")
-    with col2:
-        subtipo_operacion = st.selectbox("Subtipo de operación", subtipo_opciones)
-        moneda = st.selectbox("Moneda", ["EUR", "USD"])
-        usuario = st.text_input("Usuario", value="Pablo")
-
-    submitted = st.form_submit_button("Guardar movimiento")
-
-    tipo_cambio = 1.0
-    if moneda == "USD":
-        try:
-            response = requests.get("https://v6.exchangerate-api.com/v6/013d1a2c2928ad7aaa14e76c/latest/USD")
-            data = response.json()
-            if data.get("result") == "success":
-                tipo_cambio = data["conversion_rates"].get("EUR", 1.0)
-                tipo_cambio = 1/tipo_cambio
+subtipos_dict = SUBTIPOS_OPERACION
+
+pestana_individual, pestana_lote = st.tabs(["Un movimiento", "Lote / CSV"])
+
+with pestana_individual:
+    # Utilizar estado de sesión para almacenar selección y forzar rerun
+    if "tipo_operacion" not in st.session_state:
+        st.session_state.tipo_operacion = "aporte"
+
+    tipo_operacion = st.selectbox("Tipo de operación", list(subtipos_dict.keys()),
+                                    index=list(subtipos_dict.keys()).index(st.session_state.tipo_operacion),
+                                    on_change=lambda: st.session_state.update(tipo_operacion=st.session_state.tipo_operacion))
+
+    # Subtipos actualizados dinámicamente
+    subtipo_opciones = subtipos_dict.get(tipo_operacion, [])
+
+    with st.form("form_movimiento"):
+        col1, col2 = st.columns(2)
+        with col1:
+            fecha = st.date_input("Fecha", value=datetime.today())
+            hora = st.time_input("Hora", value=datetime.now().time())
+            activo = st.selectbox("Activo", opciones_activos)
+            importe = st.number_input("Importe en euros", format="%.2f")
+        with col2:
+            subtipo_operacion = st.selectbox("Subtipo de operación", subtipo_opciones)
+            moneda = st.selectbox("Moneda", ["EUR", "USD"])
+            usuario = st.text_input("Usuario", value="Pablo")
+
+        submitted = st.form_submit_button("Guardar movimiento")
+
+        tipo_cambio = 1.0
+        if moneda == "USD":
+            # Tipo del día de la operación desde la caché fx_rates; si está caducado se refresca en segundo plano
+            tipo = obtener_servicio_tipos_cambio().obtener(moneda, fecha)
+            if tipo is not None:
+                tipo_cambio = tipo["tipo_cambio"]
                 st.info(f"Tipo de cambio USD → EUR: {tipo_cambio:.4f}")
+                if tipo["obsoleto"]:
+                    st.caption(f"Tipo del {tipo['actualizado']:%d/%m/%Y %H:%M}; actualizándose en segundo plano.")
             else:
                 st.warning("No se pudo obtener tipo de cambio válido. Se usará 1.0 por defecto.")
-        except Exception as e:
-            st.error(f"Error al obtener el tipo de cambio. Se usará 1.0. ({e})")
-
-
-    if submitted:
-        try:
-            fecha_hora = datetime.combine(fecha, hora)
-            conn = sqlite3.connect("cartera_inversiones.db")
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO transacciones (
-                    fecha_hora, activo, importe_original, moneda,
-                    tipo_cambio, importe_euros, etiqueta, tipo_operacion,
-                    subtipo_operacion, porcentaje_participacion
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                fecha_hora.strftime("%Y-%m-%d %H:%M:%S"),
-                activo, importe, moneda, tipo_cambio,
-                importe / tipo_cambio, usuario,
-                tipo_operacion, subtipo_operacion, 1.0
-            ))
-            conn.commit()
-            conn.close()
-            st.success("Movimiento registrado con éxito. Redirigiendo al dashboard...")
-            st.rerun()
-        except Exception as e:
-            st.error(f"Error al guardar el movimiento: {e}")
+
+
+        if submitted:
+            try:
+                fecha_hora = datetime.combine(fecha, hora)
+                conn = conectar(DB_PATH)
+                operacion = {
+                    "fecha_hora": fecha_hora, "activo": activo, "importe_original": importe, "moneda": moneda,
+                    "tipo_cambio": tipo_cambio, "importe_euros": importe / tipo_cambio, "etiqueta": usuario,
+                    "tipo_operacion": tipo_operacion, "subtipo_operacion": subtipo_operacion, "porcentaje_participacion": 1.0
+                }
+                insertar_transacciones(conn, [operacion])
+                actualizar_snapshots(conn, [operacion])
+                actualizar_posiciones(conn, [operacion])
+                conn.commit()
+                conn.close()
+                st.success("Movimiento registrado con éxito. Redirigiendo al dashboard...")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error al guardar el movimiento: {e}")
+
+
+# === ALTA POR LOTES ===
+COLUMNAS_LOTE = ["fecha_hora", "activo", "importe_original", "moneda", "tipo_cambio", "tipo_operacion", "subtipo_operacion", "etiqueta"]
+
+with pestana_lote:
+    st.caption("Pega o sube un CSV con las columnas " + ", ".join(COLUMNAS_LOTE) +
+               " (tipo_cambio es opcional: si falta se usa el del día de cada operación), o escribe las filas en la tabla.")
+    fichero = st.file_uploader("CSV de movimientos", type=["csv"])
+    texto = st.text_area("...o pega aquí el CSV", height=100)
+
+    lote_inicial = pd.DataFrame({
+        "fecha_hora": pd.Series(dtype="datetime64[ns]"), "activo": pd.Series(dtype="object"),
+        "importe_original": pd.Series(dtype="float64"), "moneda": pd.Series(dtype="object"),
+        "tipo_cambio": pd.Series(dtype="float64"), "tipo_operacion": pd.Series(dtype="object"),
+        "subtipo_operacion": pd.Series(dtype="object"), "etiqueta": pd.Series(dtype="object")
+    })
+    try:
+        if fichero is not None:
+            lote_inicial = pd.read_csv(fichero)
+        elif texto.strip():
+            lote_inicial = pd.read_csv(io.StringIO(texto))
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        # CSV vacío o mal formado: se avisa y se sigue con la tabla vacía para escribir las filas a mano
+        st.error(f"No se ha podido leer el CSV: {e}")
+    # Columnas que faltan o con valores del tipo equivocado: el editor necesita el tipo de cada columna y los valores
+    # no válidos se quedan vacíos para que los señale validar_operaciones
+    lote_inicial = lote_inicial.reindex(columns=COLUMNAS_LOTE)
+    lote_inicial["fecha_hora"] = pd.to_datetime(lote_inicial["fecha_hora"], errors="coerce")
+    for columna in ("importe_original", "tipo_cambio"):
+        lote_inicial[columna] = pd.to_numeric(lote_inicial[columna], errors="coerce")
+    for columna in ("activo", "moneda", "tipo_operacion", "subtipo_operacion", "etiqueta"):
+        lote_inicial[columna] = lote_inicial[columna].map(lambda v: None if pd.isna(v) else str(v)).astype("object")
+
+    lote = st.data_editor(
+        lote_inicial, num_rows="dynamic", use_container_width=True, key="editor_lote",
+        column_config={
+            "fecha_hora": st.column_config.DatetimeColumn("Fecha y hora", format="DD/MM/YYYY HH:mm"),
+            "activo": st.column_config.SelectboxColumn("Activo", options=opciones_activos),
+            "importe_original": st.column_config.NumberColumn("Importe", format="%.2f"),
+            "moneda": st.column_config.SelectboxColumn("Moneda", options=["EUR", "USD"], default="EUR"),
+            "tipo_cambio": st.column_config.NumberColumn("Tipo de cambio", format="%.4f"),
+            "tipo_operacion": st.column_config.SelectboxColumn("Tipo", options=list(subtipos_dict)),
+            "subtipo_operacion": st.column_config.SelectboxColumn("Subtipo", options=sorted({s for v in subtipos_dict.values() for s in v})),
+            "etiqueta": st.column_config.TextColumn("Usuario", default="Pablo")
+        }
+    )
+
+    if st.button("Validar y guardar lote"):
+        operaciones, errores = validar_operaciones(lote, opciones_activos, subtipos_dict)
+        if operaciones.empty:
+            st.warning("El lote no tiene filas.")
+        elif errores:
+            st.error("El lote no se ha guardado. Corrige estas filas:\n\n" + "\n".join(f"- {e}" for e in errores))
+        else:
+            # Conversión de divisas de todo el lote en una sola consulta al servicio de tipos de cambio
+            sin_tipo = operaciones["tipo_cambio"].isna()
+            operaciones.loc[sin_tipo, "tipo_cambio"] = obtener_servicio_tipos_cambio().obtener_lote(
+                operaciones.loc[sin_tipo, "moneda"], operaciones.loc[sin_tipo, "fecha_hora"]
+            ).to_numpy()
+            faltan = operaciones.index[operaciones["tipo_cambio"].isna()]
+            if len(faltan):
+                st.error("No hay tipo de cambio para las filas " + ", ".join(str(i + 1) for i in faltan) + ". Indícalo a mano.")
+            else:
+                operaciones["importe_euros"] = operaciones["importe_original"] / operaciones["tipo_cambio"]
+                filas = operaciones.to_dict("records")
+                try:
+                    # Todo el lote en una transacción: se guardan todas las filas o ninguna
+                    conn = conectar(DB_PATH)
+                    with conn:
+                        filas = insertar_transacciones(conn, filas)
+                        actualizar_snapshots(conn, filas)
+                        actualizar_posiciones(conn, filas)
+                    conn.close()
+                    st.session_state.lote_guardado = len(filas)
+                    # Un solo rerun: la versión de la base de datos cambia una vez y las cachés se recalculan una vez
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error al guardar el lote: {e}")
+
+    if st.session_state.get("lote_guardado"):
+        st.success(f"{st.session_state.pop('lote_guardado')} movimientos registrados con éxito.")
@@ -0,0 +1,111 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+# Backend de ejecución de los cálculos por activo de helper.py. Se puede fijar por entorno para todo el dashboard
+BACKENDS = ("serie", "hilos", "procesos")
+BACKEND_POR_DEFECTO = os.environ.get("CARTERA_BACKEND", "serie")
+WORKERS_POR_DEFECTO = int(os.environ.get("CARTERA_WORKERS", 0)) or os.cpu_count() or 1
+
+_ejecutores = {}
+_lock_ejecutores = threading.Lock()
+_log = logging.getLogger(__name__)
+
+
+# === EJECUTORES REUTILIZABLES ===
+def obtener_ejecutor(backend, workers):
+    # Un pool por (backend, workers) para todo el proceso: crear procesos en cada rerun costaría más que el cálculo.
+    # Los procesos usan "spawn": hacer fork de un servidor con hilos (Streamlit) puede dejar bloqueos heredados
+    clave = (backend, workers)
+    with _lock_ejecutores:
+        if clave not in _ejecutores:
+            if backend == "hilos":
+                _ejecutores[clave] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analitica")
+            else:
+                _ejecutores[clave] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _ejecutores[clave]
+
+
+def descartar_ejecutor(backend, workers):
+    # Un pool roto (p. ej. un worker terminado por falta de memoria) no admite más trabajos: se saca de la caché
+    # para que la siguiente llamada cree uno nuevo
+    with _lock_ejecutores:
+        ejecutor = _ejecutores.pop((backend, workers), None)
+    if ejecutor is not None:
+        ejecutor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def cerrar_ejecutores():
+    with _lock_ejecutores:
+        for ejecutor in _ejecutores.values():
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+        _ejecutores.clear()
+
+
+# === PARTICIONADO POR CLAVE ===
+def repartir_claves(codigos, n_claves, n_particiones):
+    # Asigna claves completas (activos) a particiones equilibrando el nº de filas: la clave con más filas
+    # va a la partición menos cargada. Determinista: el empate se resuelve por código de clave
+    filas_por_clave = np.bincount(codigos, minlength=n_claves)
+    carga = np.zeros(n_particiones, dtype=np.int64)
+    particion_de_clave = np.empty(n_claves, dtype=np.int64)
+    for clave in np.argsort(-filas_por_clave, kind="stable"):
+        destino = int(np.argmin(carga))
+        particion_de_clave[clave] = destino
+        carga[destino] += filas_por_clave[clave]
+    return particion_de_clave
+
+
+def ejecutar_por_claves(funcion, codigos, n_claves, columnas, backend=None, workers=None):
+    # Ejecuta funcion(codigos_locales, n_claves_locales, *columnas) sobre cada partición de claves y une los
+    # resultados: funcion devuelve un dict de arrays con una fila por clave local, y el resultado final tiene
+    # una fila por clave global (0..n_claves-1), en el mismo orden sea cual sea el backend o el orden de llegada.
+    # A los workers solo viajan arrays NumPy, nunca DataFrames
+    backend = backend or BACKEND_POR_DEFECTO
+    workers = workers or WORKERS_POR_DEFECTO
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend} (usa {', '.join(BACKENDS)})")
+
+    codigos = np.asarray(codigos, dtype=np.int64)
+    n_particiones = min(workers, n_claves)
+    if backend == "serie" or n_particiones <= 1:
+        return funcion(codigos, n_claves, *columnas)
+
+    particion_de_clave = repartir_claves(codigos, n_claves, n_particiones)
+    particion_de_fila = particion_de_clave[codigos]
+    orden = np.argsort(particion_de_fila, kind="stable")
+    limites = np.searchsorted(particion_de_fila[orden], np.arange(n_particiones + 1))
+
+    # Códigos locales: posición de cada clave global dentro de su partición (en orden de código)
+    claves_de = [np.flatnonzero(particion_de_clave == p) for p in range(n_particiones)]
+    codigo_local = np.empty(n_claves, dtype=np.int64)
+    for claves in claves_de:
+        codigo_local[claves] = np.arange(len(claves))
+
+    try:
+        ejecutor = obtener_ejecutor(backend, workers)
+        futuros = []
+        for p in range(n_particiones):
+            filas = orden[limites[p]:limites[p + 1]]
+            futuros.append(ejecutor.submit(funcion, codigo_local[codigos[filas]], len(claves_de[p]), *(np.asarray(c)[filas] for c in columnas)))
+        partes = [futuro.result() for futuro in futuros]
+    except BrokenProcessPool:
+        # Esta llamada se resuelve en serie (reintentar en paralelo podría volver a agotar la memoria); la siguiente
+        # usará un pool nuevo
+        _log.warning("Pool de procesos roto (%d workers): se descarta y el cálculo se hace en serie", workers)
+        descartar_ejecutor(backend, workers)
+        return funcion(codigos, n_claves, *columnas)
+
+    resultado = {}
+    for claves, parte in zip(claves_de, partes):
+        for nombre, valores in parte.items():
+            if nombre not in resultado:
+                resultado[nombre] = np.empty((n_claves,) + valores.shape[1:], dtype=valores.dtype)
+            resultado[nombre][claves] = valores
+    return resultado
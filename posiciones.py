@@ -0,0 +1,293 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+from helper import BUCKETS, clasificar_operaciones
+
+# Posición por activo con lotes FIFO. El ledger no trae precios ni unidades, así que cada activo se "unitiza" como
+# un fondo: su valor liquidativo empieza en 1 € por unidad y lo mueven las revalorizaciones/devaluaciones. Las
+# compras y reinversiones abren lotes (unidades = importe / precio), las retiradas venden unidades empezando por
+# el lote más antiguo y realizan la diferencia con su coste. Los importes son importe_euros × porcentaje_participacion
+# (la parte del activo que es del usuario): importe_original no sirve como base porque un mismo activo mezcla monedas.
+DDL_POSICIONES = """
+    CREATE TABLE IF NOT EXISTS posiciones (
+        activo TEXT PRIMARY KEY,
+        unidades REAL NOT NULL,
+        coste REAL NOT NULL,
+        valor REAL NOT NULL,
+        realizado REAL NOT NULL,
+        cobrado REAL NOT NULL,
+        comisiones REAL NOT NULL,
+        n_operaciones INTEGER NOT NULL,
+        ultima_fecha TEXT
+    )
+"""
+
+DDL_LOTES = """
+    CREATE TABLE IF NOT EXISTS lotes (
+        activo TEXT NOT NULL,
+        orden INTEGER NOT NULL,
+        fecha TEXT NOT NULL,
+        unidades REAL NOT NULL,
+        coste REAL NOT NULL,
+        PRIMARY KEY (activo, orden)
+    )
+"""
+
+COLUMNAS_POSICION = ["activo", "unidades", "coste", "valor", "realizado", "cobrado", "comisiones", "n_operaciones", "ultima_fecha"]
+# Por debajo de esto una cantidad de unidades se considera cero (restos de redondeo al vender todo)
+_EPSILON = 1e-9
+
+# Qué hace cada bucket de helper.clasificar_operaciones sobre la posición
+_ACCION_BUCKET = {
+    "compra": "comprar", "aporte_otro": "comprar", "reinv": "comprar",
+    "retirada": "vender", "ajuste": "vender", "retirada_otro": "vender",
+    "flotante": "revalorizar", "consolidado": "cobrar", "comision": "comision", "otro": "ajustar"
+}
+
+
+# === POSICIÓN DE UN ACTIVO ===
+class PosicionActivo:
+    __slots__ = ("activo", "lotes", "unidades", "coste", "valor", "realizado", "cobrado", "comisiones", "n_operaciones", "ultima_fecha", "_orden")
+
+    def __init__(self, activo):
+        self.activo = activo
+        self.lotes = deque()  # [orden, fecha, unidades, coste], del más antiguo al más reciente
+        self.unidades = self.coste = self.valor = 0.0
+        self.realizado = self.cobrado = self.comisiones = 0.0
+        self.n_operaciones = 0
+        self.ultima_fecha = None
+        self._orden = 0
+
+    @property
+    def precio(self):
+        return self.valor / self.unidades if self.unidades > _EPSILON else 1.0
+
+    def aplicar(self, fecha, bucket, importe):
+        # Una operación en orden cronológico; coste amortizado O(1) (cada lote se abre y se cierra una vez)
+        # Un aporte negativo o una retirada positiva (correcciones) cuentan como la operación contraria
+        accion = _ACCION_BUCKET[bucket]
+        if accion in ("comprar", "vender"):
+            if importe >= 0:
+                self._comprar(fecha, importe)
+            else:
+                self._vender(-importe)
+        elif accion == "revalorizar":
+            self._revalorizar(importe)
+        elif accion == "cobrar":
+            self.cobrado += importe
+        elif accion == "comision":
+            self.comisiones += importe
+        else:
+            self.realizado += importe
+        self.n_operaciones += 1
+        self.ultima_fecha = fecha
+
+    def _comprar(self, fecha, importe):
+        if importe == 0:
+            return
+        unidades = importe / self.precio
+        self.lotes.append([self._orden, fecha, unidades, importe])
+        self._orden += 1
+        self.unidades += unidades
+        self.coste += importe
+        self.valor += importe
+
+    def _vender(self, importe):
+        # Se venden como mucho las unidades que hay; lo que se retire por encima del valor se realiza entero
+        precio = self.precio
+        pendientes = min(importe / precio, self.unidades) if self.unidades > _EPSILON else 0.0
+        coste_vendido = 0.0
+        vendidas = pendientes
+        while pendientes > _EPSILON and self.lotes:
+            lote = self.lotes[0]
+            if lote[2] <= pendientes + _EPSILON:
+                pendientes -= lote[2]
+                coste_vendido += lote[3]
+                self.lotes.popleft()
+            else:
+                fraccion = pendientes / lote[2]
+                coste_vendido += lote[3] * fraccion
+                lote[2] -= pendientes
+                lote[3] -= lote[3] * fraccion
+                pendientes = 0.0
+
+        self.realizado += importe - coste_vendido
+        if self.lotes:
+            self.unidades -= vendidas
+            self.coste -= coste_vendido
+            self.valor -= vendidas * precio
+        else:
+            self.unidades = self.coste = self.valor = 0.0
+
+    def _revalorizar(self, importe):
+        # Sin unidades no hay a qué asignar el cambio de valor: se realiza. Si una devaluación deja el valor en cero
+        # o menos, la posición se da por perdida: se cierran los lotes y se realiza su coste (y el exceso)
+        if self.unidades <= _EPSILON:
+            self.realizado += importe
+            return
+        nuevo_valor = self.valor + importe
+        if nuevo_valor <= 0:
+            self.realizado += nuevo_valor - self.coste
+            self.lotes.clear()
+            self.unidades = self.coste = self.valor = 0.0
+            return
+        self.valor = nuevo_valor
+
+    def resumen(self):
+        no_realizado = self.valor - self.coste
+        return {
+            "activo": self.activo, "unidades": self.unidades, "precio": self.precio, "coste": self.coste, "valor": self.valor,
+            "no_realizado": no_realizado, "realizado": self.realizado, "cobrado": self.cobrado, "comisiones": self.comisiones,
+            "beneficio_total": no_realizado + self.realizado + self.cobrado - self.comisiones,
+            "n_lotes": len(self.lotes), "n_operaciones": self.n_operaciones, "ultima_fecha": self.ultima_fecha
+        }
+
+
+def _preparar(operaciones):
+    # Operaciones (DataFrame o lista de dicts con columnas de transacciones) como tuplas (activo, fecha, bucket,
+    # importe) en orden cronológico; a igual fecha se respeta el orden de entrada (o de id, si viene)
+    df = pd.DataFrame(operaciones)
+    df = df[df["activo"].notna()]
+    if df.empty:
+        return []
+    fechas = pd.to_datetime(df["fecha_hora"], errors="coerce")
+    participacion = pd.to_numeric(df["porcentaje_participacion"], errors="coerce").fillna(1.0) if "porcentaje_participacion" in df else 1.0
+    importes = pd.to_numeric(df["importe_euros"], errors="coerce").fillna(0) * participacion
+    buckets = np.asarray(BUCKETS, dtype=object)[np.asarray(clasificar_operaciones(df).codes)]
+    tabla = pd.DataFrame({
+        "activo": df["activo"].astype(str).to_numpy(), "fecha": fechas.dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy(),
+        "bucket": buckets, "importe": importes.to_numpy(dtype=np.float64),
+        "id": df["id"].to_numpy() if "id" in df else np.arange(len(df))
+    }).dropna(subset=["fecha"])
+    tabla = tabla.sort_values(["fecha", "id"], kind="stable")
+    return list(tabla[["activo", "fecha", "bucket", "importe"]].itertuples(index=False, name=None))
+
+
+# === MOTOR EN MEMORIA ===
+class MotorPosiciones:
+    def __init__(self):
+        self.posiciones = {}
+
+    def aplicar(self, operaciones):
+        # Devuelve los activos con operaciones anteriores a su última fecha aplicada: esas no se aplican (el orden
+        # FIFO cambiaría) y hay que reconstruir el activo desde su historial
+        fuera_de_orden = set()
+        for activo, fecha, bucket, importe in _preparar(operaciones):
+            posicion = self.posiciones.get(activo)
+            if posicion is None:
+                posicion = self.posiciones[activo] = PosicionActivo(activo)
+            if activo in fuera_de_orden or (posicion.ultima_fecha is not None and fecha < posicion.ultima_fecha):
+                fuera_de_orden.add(activo)
+                continue
+            posicion.aplicar(fecha, bucket, importe)
+        return fuera_de_orden
+
+    def posicion(self, activo):
+        posicion = self.posiciones.get(activo)
+        return None if posicion is None else posicion.resumen()
+
+    def tabla(self):
+        return pd.DataFrame([p.resumen() for p in self.posiciones.values()])
+
+
+# === PERSISTENCIA (tablas posiciones y lotes) ===
+def existen_posiciones(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posiciones'").fetchone() is not None
+
+
+def _leer_historial(conn, activos=None):
+    consulta = "SELECT id, fecha_hora, activo, tipo_operacion, subtipo_operacion, importe_euros, porcentaje_participacion FROM transacciones"
+    parametros = []
+    if activos is not None:
+        consulta += f" WHERE activo IN ({', '.join('?' * len(activos))})"
+        parametros = list(activos)
+    return pd.read_sql(consulta + " ORDER BY fecha_hora, id", conn, params=parametros)
+
+
+def _cargar_estado(conn, activos):
+    motor = MotorPosiciones()
+    marcadores = ", ".join("?" * len(activos))
+    for fila in conn.execute(f"SELECT {', '.join(COLUMNAS_POSICION)} FROM posiciones WHERE activo IN ({marcadores})", list(activos)):
+        posicion = PosicionActivo(fila[0])
+        (posicion.unidades, posicion.coste, posicion.valor, posicion.realizado, posicion.cobrado,
+         posicion.comisiones, posicion.n_operaciones, posicion.ultima_fecha) = fila[1:]
+        motor.posiciones[fila[0]] = posicion
+    for activo, orden, fecha, unidades, coste in conn.execute(
+            f"SELECT activo, orden, fecha, unidades, coste FROM lotes WHERE activo IN ({marcadores}) ORDER BY activo, orden", list(activos)):
+        posicion = motor.posiciones[activo]
+        posicion.lotes.append([orden, fecha, unidades, coste])
+        posicion._orden = orden + 1
+    return motor
+
+
+def _guardar(conn, posiciones, orden_cargado=None):
+    # Solo se escribe lo que cambia en lotes: los cerrados (orden menor que el primero abierto), el primero abierto
+    # (puede haberse vendido en parte) y los abiertos después de cargar el estado (orden >= orden_cargado)
+    orden_cargado = orden_cargado or {}
+    cerrados, primeros, nuevos = [], [], []
+    for p in posiciones:
+        desde = orden_cargado.get(p.activo, 0)
+        if not p.lotes:
+            cerrados.append((p.activo, p._orden))
+            continue
+        cerrados.append((p.activo, p.lotes[0][0]))
+        if p.lotes[0][0] < desde:
+            primeros.append((p.lotes[0][2], p.lotes[0][3], p.activo, p.lotes[0][0]))
+        nuevos += [(p.activo, *lote) for lote in p.lotes if lote[0] >= desde]
+    conn.executemany("DELETE FROM lotes WHERE activo = ? AND orden < ?", cerrados)
+    conn.executemany("UPDATE lotes SET unidades = ?, coste = ? WHERE activo = ? AND orden = ?", primeros)
+    conn.executemany("INSERT OR REPLACE INTO lotes (activo, orden, fecha, unidades, coste) VALUES (?, ?, ?, ?, ?)", nuevos)
+    conn.executemany(f"INSERT OR REPLACE INTO posiciones ({', '.join(COLUMNAS_POSICION)}) VALUES ({', '.join('?' * len(COLUMNAS_POSICION))})", [
+        (p.activo, p.unidades, p.coste, p.valor, p.realizado, p.cobrado, p.comisiones, p.n_operaciones, p.ultima_fecha) for p in posiciones
+    ])
+
+
+def reconstruir_posiciones(conn, activos=None):
+    # Reconstrucción desde transacciones (de todos los activos o solo de los indicados); el commit lo hace quien llama
+    conn.execute(DDL_POSICIONES)
+    conn.execute(DDL_LOTES)
+    motor = MotorPosiciones()
+    motor.aplicar(_leer_historial(conn, activos))
+    if activos is None:
+        conn.execute("DELETE FROM posiciones")
+        conn.execute("DELETE FROM lotes")
+    else:
+        conn.executemany("DELETE FROM posiciones WHERE activo = ?", [(a,) for a in activos])
+        conn.executemany("DELETE FROM lotes WHERE activo = ?", [(a,) for a in activos])
+    _guardar(conn, list(motor.posiciones.values()))
+    return len(motor.posiciones)
+
+
+def actualizar_posiciones(conn, operaciones):
+    # Operaciones nuevas, ya insertadas en transacciones dentro de la transacción abierta por quien llama: solo
+    # se leen y reescriben las posiciones y lotes de sus activos. Si alguna es anterior a lo ya aplicado en su
+    # activo, ese activo se reconstruye desde su historial
+    if not existen_posiciones(conn):
+        reconstruir_posiciones(conn)
+        return
+    operaciones = pd.DataFrame(operaciones)
+    if operaciones.empty:
+        return
+    conn.execute(DDL_LOTES)
+    motor = _cargar_estado(conn, operaciones["activo"].dropna().astype(str).unique().tolist())
+    orden_cargado = {activo: p._orden for activo, p in motor.posiciones.items()}
+    fuera_de_orden = motor.aplicar(operaciones)
+    _guardar(conn, [p for activo, p in motor.posiciones.items() if activo not in fuera_de_orden], orden_cargado)
+    if fuera_de_orden:
+        reconstruir_posiciones(conn, sorted(fuera_de_orden))
+
+
+# === LECTURA ===
+def leer_posiciones(conn, activos=None):
+    # Estado actual por activo con las magnitudes derivadas (precio, P&L no realizado, beneficio total)
+    consulta = f"SELECT p.{', p.'.join(COLUMNAS_POSICION)}, COUNT(l.orden) AS n_lotes, MIN(l.fecha) AS fecha_lote_mas_antiguo FROM posiciones AS p LEFT JOIN lotes AS l USING (activo)"
+    parametros = []
+    if activos is not None:
+        activos = list(activos)
+        consulta += f" WHERE p.activo IN ({', '.join('?' * len(activos))})"
+        parametros = activos
+    df = pd.read_sql(consulta + " GROUP BY p.activo ORDER BY p.activo", conn, params=parametros)
+    df.insert(2, "precio", np.where(df["unidades"] > _EPSILON, df["valor"] / df["unidades"].where(df["unidades"] > _EPSILON, 1.0), 1.0))
+    df["no_realizado"] = df["valor"] - df["coste"]
+    df["beneficio_total"] = df["no_realizado"] + df["realizado"] + df["cobrado"] - df["comisiones"]
+    return df
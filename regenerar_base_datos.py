@@ -1,6 +1,6 @@
-import pandas as pd
-import sqlite3
 import os
+from esquema import conectar, crear_esquema, migrar
+from importar import importar
 
 # Detectar si estamos dentro de un contenedor Docker (muy básico)
 en_docker = os.path.exists("/.dockerenv")
@@ -9,18 +9,15 @@ en_docker = os.path.exists("/.dockerenv")
 db_path = "/app/cartera_inversiones.db" if en_docker else "cartera_inversiones.db"
 print(f"Creando base de datos en: {db_path}")
 
-# Crear conexión a SQLite
-conn = sqlite3.connect(db_path)
+# Crear conexión a SQLite con el esquema actualizado
+conn = conectar(db_path)
+migrar(conn)
+crear_esquema(conn)
 
-# Cargar archivos Excel
-df_trans = pd.read_excel("transacciones.xlsx")
-df_activos = pd.read_excel("activos_para_etiquetar.xlsx")
-
-# Guardar en SQLite
-df_trans.to_sql("transacciones", conn, if_exists="replace", index=False)
-df_activos.to_sql("activos", conn, if_exists="replace", index=False)
-
-conn.commit()
+# Sincronizar con los Excel en streaming: solo se escriben las filas nuevas o modificadas
+# y se eliminan las que ya no están en el fichero
+resumen = importar(conn, "transacciones.xlsx", "activos_para_etiquetar.xlsx", sincronizar=True)
 conn.close()
 
+print(f"{resumen['cambiadas']} transacciones insertadas o actualizadas, {resumen['eliminadas']} eliminadas.")
 print("Base de datos 'cartera_inversiones.db' actualizada correctamente.")
@@ -0,0 +1,133 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+try:
+    from pyinstrument import Profiler as ProfilerPyinstrument
+except ImportError:  # el modo pyinstrument es opcional
+    ProfilerPyinstrument = None
+
+# Registro de la ejecución en curso (un rerun del dashboard). Sin registro activo, medir y cronometrado no hacen nada
+_registro_actual = ContextVar("registro_tiempos", default=None)
+
+
+# === REGISTRO DE TIEMPOS POR EJECUCIÓN ===
+class RegistroTiempos:
+    def __init__(self, nombre=""):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.fecha = datetime.now().isoformat(timespec="seconds")
+        self.mediciones = []
+        self.perfil = None
+        self._profundidad = 0
+        self._seccion = None
+
+    def anotar(self, nombre, categoria, inicio, duracion, profundidad):
+        self.mediciones.append({
+            "nombre": nombre, "categoria": categoria, "profundidad": profundidad,
+            "inicio_ms": (inicio - self.inicio) * 1000, "duracion_ms": duracion * 1000
+        })
+
+    def seccion(self, nombre):
+        # Cronómetro por vueltas para scripts lineales: cierra la sección abierta y empieza la siguiente
+        ahora = time.perf_counter()
+        if self._seccion is not None:
+            anterior, inicio = self._seccion
+            self.anotar(anterior, "seccion", inicio, ahora - inicio, 0)
+        self._seccion = (nombre, ahora) if nombre else None
+
+    def cerrar(self):
+        self.seccion(None)
+        self.total_ms = (time.perf_counter() - self.inicio) * 1000
+
+    def resumen(self):
+        # Tiempo total y nº de llamadas por (categoría, nombre), en orden de primera aparición
+        agregado = {}
+        for m in self.mediciones:
+            fila = agregado.setdefault((m["categoria"], m["nombre"]), {"nombre": m["nombre"], "categoria": m["categoria"], "llamadas": 0, "duracion_ms": 0.0})
+            fila["llamadas"] += 1
+            fila["duracion_ms"] += m["duracion_ms"]
+        return list(agregado.values())
+
+    def a_dict(self):
+        return {
+            "nombre": self.nombre, "fecha": self.fecha, "total_ms": getattr(self, "total_ms", None),
+            "mediciones": self.mediciones, "perfil": self.perfil
+        }
+
+
+def iniciar_registro(nombre=""):
+    registro = RegistroTiempos(nombre)
+    _registro_actual.set(registro)
+    return registro
+
+
+def registro_actual():
+    return _registro_actual.get()
+
+
+@contextmanager
+def medir(nombre, categoria="bloque"):
+    registro = _registro_actual.get()
+    if registro is None:
+        yield
+        return
+    registro._profundidad += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro._profundidad -= 1
+        registro.anotar(nombre, categoria, inicio, time.perf_counter() - inicio, registro._profundidad + 1)
+
+
+def cronometrado(funcion=None, categoria="helper"):
+    # Decorador: anota cada llamada en el registro activo (coste despreciable si no hay ninguno)
+    if funcion is None:
+        return functools.partial(cronometrado, categoria=categoria)
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        if _registro_actual.get() is None:
+            return funcion(*args, **kwargs)
+        with medir(funcion.__name__, categoria):
+            return funcion(*args, **kwargs)
+    return envoltura
+
+
+def exportar_json(registros):
+    return json.dumps([r.a_dict() if isinstance(r, RegistroTiempos) else r for r in registros], indent=2, ensure_ascii=False)
+
+
+# === PERFILADO OPCIONAL ===
+MODOS_PERFIL = ["cProfile"] + (["pyinstrument"] if ProfilerPyinstrument is not None else [])
+
+
+class Perfilador:
+    # Captura un perfil de toda la ejecución; el informe de texto queda en registro.perfil
+    def __init__(self, modo="cProfile"):
+        if modo not in MODOS_PERFIL:
+            raise ValueError(f"Modo de perfilado no disponible: {modo} (disponibles: {', '.join(MODOS_PERFIL)})")
+        self.modo = modo
+        self._perfil = cProfile.Profile() if modo == "cProfile" else ProfilerPyinstrument()
+
+    def iniciar(self):
+        if self.modo == "cProfile":
+            self._perfil.enable()
+        else:
+            self._perfil.start()
+
+    def detener(self, lineas=40):
+        if self.modo == "cProfile":
+            self._perfil.disable()
+            salida = io.StringIO()
+            pstats.Stats(self._perfil, stream=salida).sort_stats("cumulative").print_stats(lineas)
+            return salida.getvalue()
+        self._perfil.stop()
+        return self._perfil.output_text(unicode=True, color=False)
@@ -0,0 +1,107 @@
+import pandas as pd
+from helper import clasificar_operaciones
+
+# Totales acumulados por día, activo y bucket (ver helper.BUCKETS). Solo hay fila en los días con operaciones:
+# el acumulado de cualquier fecha es el de la última fila anterior o igual.
+DDL_SNAPSHOTS = """
+    CREATE TABLE IF NOT EXISTS snapshots_diarios (
+        fecha TEXT NOT NULL,
+        activo TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        importe_dia REAL NOT NULL,
+        n_operaciones INTEGER NOT NULL,
+        acumulado REAL NOT NULL,
+        PRIMARY KEY (activo, bucket, fecha)
+    )
+"""
+
+
+def existen_snapshots(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshots_diarios'").fetchone() is not None
+
+
+def agregar_por_dia(df):
+    df = df[df["activo"].notna()]
+    agregados = pd.DataFrame({
+        "fecha": pd.to_datetime(df["fecha_hora"], errors="coerce").dt.strftime("%Y-%m-%d").to_numpy(),
+        "activo": df["activo"].to_numpy(),
+        "bucket": clasificar_operaciones(df).astype(str),
+        "importe_euros": pd.to_numeric(df["importe_euros"], errors="coerce").fillna(0).to_numpy()
+    }).dropna(subset=["fecha"])
+    return agregados.groupby(["activo", "bucket", "fecha"], sort=True)["importe_euros"].agg(importe_dia="sum", n_operaciones="size").reset_index()
+
+
+# === CONSTRUCCIÓN Y MANTENIMIENTO ===
+def reconstruir_snapshots(conn):
+    # Reconstrucción completa desde transacciones; el commit lo hace quien llama
+    trans = pd.read_sql("SELECT fecha_hora, activo, tipo_operacion, subtipo_operacion, importe_euros FROM transacciones", conn)
+    diario = agregar_por_dia(trans)
+    diario["acumulado"] = diario.groupby(["activo", "bucket"])["importe_dia"].cumsum()
+
+    conn.execute(DDL_SNAPSHOTS)
+    conn.execute("DELETE FROM snapshots_diarios")
+    conn.executemany(
+        "INSERT INTO snapshots_diarios (fecha, activo, bucket, importe_dia, n_operaciones, acumulado) VALUES (?, ?, ?, ?, ?, ?)",
+        diario[["fecha", "activo", "bucket", "importe_dia", "n_operaciones", "acumulado"]].itertuples(index=False, name=None)
+    )
+    return len(diario)
+
+
+def actualizar_snapshots(conn, operaciones):
+    # Aplica operaciones nuevas (DataFrame o lista de dicts con las columnas de transacciones) dentro
+    # de la transacción abierta por quien llama, para que inserción y snapshot se confirmen juntos
+    conn.execute(DDL_SNAPSHOTS)
+    for activo, bucket, fecha, importe, n in agregar_por_dia(pd.DataFrame(operaciones)).itertuples(index=False, name=None):
+        conn.execute("""
+            INSERT OR IGNORE INTO snapshots_diarios (fecha, activo, bucket, importe_dia, n_operaciones, acumulado)
+            VALUES (?, ?, ?, 0, 0, COALESCE((
+                SELECT acumulado FROM snapshots_diarios
+                WHERE activo = ? AND bucket = ? AND fecha < ?
+                ORDER BY fecha DESC LIMIT 1
+            ), 0))
+        """, (fecha, activo, bucket, activo, bucket, fecha))
+        conn.execute("""
+            UPDATE snapshots_diarios SET importe_dia = importe_dia + ?, n_operaciones = n_operaciones + ?
+            WHERE activo = ? AND bucket = ? AND fecha = ?
+        """, (importe, n, activo, bucket, fecha))
+        conn.execute("""
+            UPDATE snapshots_diarios SET acumulado = acumulado + ?
+            WHERE activo = ? AND bucket = ? AND fecha >= ?
+        """, (importe, activo, bucket, fecha))
+
+
+# === LECTURA ===
+def leer_sumas_por_bucket(conn, fecha_inicio, fecha_fin, activos=None):
+    # Suma por bucket de las operaciones con fecha_inicio <= fecha_hora <= fecha_fin, el mismo criterio que el filtro
+    # del ledger. Los días completos salen de los acumulados (acumulado del último día completo menos el de antes del
+    # primero, por activo y bucket); los tramos que no cubren un día entero, como las operaciones a las 00:00:00 del
+    # día final, se leen de transacciones
+    inicio, fin = pd.Timestamp(fecha_inicio), pd.Timestamp(fecha_fin)
+    primer_dia, fin_dias = inicio.ceil("D"), fin.floor("D")  # días completos: primer_dia <= día < fin_dias
+    if activos is not None:
+        activos = list(activos)
+        if not activos:
+            return pd.Series(dtype="float64")
+    filtro_activos = f" AND activo IN ({', '.join('?' * len(activos))})" if activos is not None else ""
+
+    sumas = pd.Series(dtype="float64")
+    if primer_dia < fin_dias:
+        filas = pd.read_sql(
+            f"SELECT fecha, activo, bucket, acumulado FROM snapshots_diarios WHERE fecha < ?{filtro_activos} ORDER BY activo, bucket, fecha",
+            conn, params=[fin_dias.strftime("%Y-%m-%d"), *(activos or [])]
+        )
+        ultimos = filas.groupby(["activo", "bucket"])["acumulado"].last()
+        previos = filas[filas["fecha"] < primer_dia.strftime("%Y-%m-%d")].groupby(["activo", "bucket"])["acumulado"].last()
+        sumas = ultimos.sub(previos, fill_value=0).groupby(level="bucket").sum()
+        tramos = [(inicio, primer_dia, "<"), (fin_dias, fin, "<=")]
+    else:
+        tramos = [(inicio, fin, "<=")]
+
+    condiciones = " OR ".join(f"(fecha_hora >= ? AND fecha_hora {operador} ?)" for _, _, operador in tramos)
+    parciales = pd.read_sql(
+        f"SELECT fecha_hora, activo, tipo_operacion, subtipo_operacion, importe_euros FROM transacciones WHERE ({condiciones}){filtro_activos}",
+        conn, params=[f.strftime("%Y-%m-%d %H:%M:%S") for desde, hasta, _ in tramos for f in (desde, hasta)] + (activos or [])
+    )
+    if not parciales.empty:
+        sumas = sumas.add(agregar_por_dia(parciales).groupby("bucket")["importe_dia"].sum(), fill_value=0)
+    return sumas
@@ -0,0 +1,23 @@
+import pandas as pd
+from api import resolver_filtros
+from esquema import conectar, crear_esquema
+from importar import insertar_transacciones
+
+
+def test_fechas_truncadas_al_dia_como_en_el_dashboard(tmp_path):
+    ruta = str(tmp_path / "cartera.db")
+    conn = conectar(ruta)
+    crear_esquema(conn)
+    with conn:
+        conn.execute("INSERT INTO activos (activo) VALUES ('A')")
+        insertar_transacciones(conn, [
+            {"fecha_hora": pd.Timestamp("2024-01-02 10:15:00"), "activo": "A", "importe_euros": 100.0, "tipo_operacion": "aporte", "subtipo_operacion": "compra"},
+            {"fecha_hora": pd.Timestamp("2024-06-30 18:45:00"), "activo": "A", "importe_euros": 5.0, "tipo_operacion": "beneficio", "subtipo_operacion": "revalorización"}
+        ])
+    conn.close()
+
+    filtros = resolver_filtros(db_path=ruta)
+    assert filtros["fecha_inicio"] == pd.Timestamp("2024-01-02")
+    assert filtros["fecha_fin"] == pd.Timestamp("2024-06-30")
+    filtros = resolver_filtros("2024-03-01 12:00", "2024-04-01 09:00", db_path=ruta)
+    assert (filtros["fecha_inicio"], filtros["fecha_fin"]) == (pd.Timestamp("2024-03-01"), pd.Timestamp("2024-04-01"))
@@ -0,0 +1,24 @@
+import platform
+import pytest
+from benchmark import benchmark_suite, leer_referencia
+
+# Puerta de rendimiento: los casos de la suite en los tamaños pequeños frente a benchmark_referencia.json, con la
+# misma tolerancia, mediana y segunda medida que "python benchmark.py suite". Los tiempos guardados solo valen
+# para la máquina en la que se grabaron: en otra se salta (se graba la suya con --guardar-referencia).
+# Es la parte lenta de la batería: se puede excluir con -m "not benchmark"
+TAMANOS = [1_000, 100_000]
+
+
+def _misma_maquina(maquina):
+    return maquina.get("python") == platform.python_version() and maquina.get("procesador") == (platform.processor() or platform.machine())
+
+
+@pytest.mark.benchmark
+def test_sin_regresiones_frente_a_la_referencia():
+    referencia = leer_referencia()
+    if not referencia.get("resultados"):
+        pytest.skip("No hay benchmark_referencia.json")
+    if not _misma_maquina(referencia.get("maquina", {})):
+        pytest.skip("La referencia se grabó en otra máquina")
+    regresiones = benchmark_suite(TAMANOS)
+    assert not regresiones, f"Regresiones frente a benchmark_referencia.json: {', '.join(regresiones)}"
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import obtener_cashflows_legado, porcentaje_legado
+from generador import generar_ledger_sintetico
+from helper import (
+    calcular_kpis,
+    calcular_porcentaje,
+    calcular_rentabilidad_anual,
+    calcular_rentabilidad_por_activo,
+    calcular_tir_acumulado_en_tiempo,
+    calcular_tir_anual,
+    filtrar_flujos_validos,
+    obtener_cashflows,
+    tipar_ledger
+)
+
+
+@pytest.fixture(scope="module")
+def ledger():
+    return generar_ledger_sintetico(5000, n_activos=12, años=6)
+
+
+# === VERSIONES COLUMNARES FRENTE A LAS DE apply POR FILAS ===
+def test_obtener_cashflows_igual_que_por_filas(ledger):
+    flujos = filtrar_flujos_validos(ledger)
+    legado = obtener_cashflows_legado(flujos)
+    fechas, importes = obtener_cashflows(flujos)
+    np.testing.assert_array_equal(pd.to_datetime([cf[0] for cf in legado]).values, fechas)
+    np.testing.assert_array_equal(np.array([cf[1] for cf in legado]), importes)
+
+
+@pytest.mark.parametrize("solo_positivo, defecto", [(False, None), (True, 0)])
+def test_calcular_porcentaje_igual_que_por_filas(ledger, solo_positivo, defecto):
+    # Denominadores nulos y negativos para los dos criterios de validez
+    tabla = pd.DataFrame({
+        "beneficio": ledger["importe_euros"],
+        "aportado": ledger["importe_euros"].shift(1).fillna(0).where(ledger.index % 10 != 0, 0)
+    })
+    legado = porcentaje_legado(tabla, "beneficio", "aportado", solo_positivo, defecto)
+    nuevo = calcular_porcentaje(tabla["beneficio"], tabla["aportado"], solo_positivo, np.nan if defecto is None else defecto)
+    np.testing.assert_array_equal(legado.astype(float).to_numpy(), nuevo)
+
+
+# === LEDGER TIPADO FRENTE AL LEDGER DE OBJETOS ===
+@pytest.mark.parametrize("funcion", [
+    filtrar_flujos_validos, calcular_rentabilidad_por_activo, calcular_rentabilidad_anual, calcular_tir_anual,
+    calcular_tir_acumulado_en_tiempo
+], ids=lambda f: f.__name__)
+def test_ledger_tipado_igual_que_sin_tipar(ledger, funcion):
+    tipado = tipar_ledger(ledger)
+    esperado, resultado = funcion(ledger), funcion(tipado)
+    resultado = resultado.drop(columns=[c for c in tipado.columns if c not in ledger.columns], errors="ignore")
+    pd.testing.assert_frame_equal(esperado, resultado, check_dtype=False, check_categorical=False)
+
+
+def test_kpis_del_ledger_tipado(ledger):
+    esperado, resultado = calcular_kpis(ledger), calcular_kpis(tipar_ledger(ledger))
+    assert esperado.keys() == resultado.keys()
+    for clave in esperado:
+        assert resultado[clave] == pytest.approx(esperado[clave], nan_ok=True), clave
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datos import filtrar_ledger, leer_ledger
+from esquema import conectar, crear_esquema
+from generador import generar_ledger_sintetico
+from importar import insertar_transacciones
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    ruta = str(tmp_path_factory.mktemp("datos") / "cartera.db")
+    ledger = generar_ledger_sintetico(3000, n_activos=6, años=3, inicio="2023-01-01")
+    ledger["fecha_hora"] = ledger["fecha_hora"].dt.floor("s")
+    conn = conectar(ruta)
+    crear_esquema(conn)
+    with conn:
+        conn.executemany("INSERT INTO activos (activo) VALUES (?)", [(a,) for a in ledger["activo"].unique()])
+        insertar_transacciones(conn, ledger.replace({np.nan: None}).to_dict("records"))
+    conn.close()
+    return ruta
+
+
+@pytest.fixture(scope="module")
+def completo(db_path):
+    return leer_ledger(db_path)
+
+
+@pytest.mark.parametrize("filtros", [
+    {},
+    {"fecha_inicio": pd.Timestamp("2024-03-01"), "fecha_fin": pd.Timestamp("2024-09-30")},
+    {"fecha_fin": pd.Timestamp("2023-06-15 12:00:00")},
+    {"activos": ("Activo 01", "Activo 04")},
+    {"tipos": ("aporte",), "fecha_inicio": pd.Timestamp("2025-01-01")},
+])
+def test_filtrar_en_memoria_igual_que_en_sql(db_path, completo, filtros):
+    # El corte en memoria del ledger completo tiene que dar lo mismo que la consulta filtrada, categorías incluidas
+    pd.testing.assert_frame_equal(filtrar_ledger(completo, **filtros), leer_ledger(db_path, **filtros))
+
+
+def test_lista_vacia_no_devuelve_filas(completo):
+    # Como la condición "0" de _condiciones_filtro; el DataFrame vacío conserva los tipos del ledger
+    vacio = filtrar_ledger(completo, activos=())
+    assert vacio.empty
+    assert list(vacio.columns) == list(completo.columns)
+
+
+def test_filtrar_no_modifica_el_ledger_completo(completo):
+    antes = completo.copy()
+    filtrado = filtrar_ledger(completo)
+    filtrado["importe_euros"] = 0.0
+    pd.testing.assert_frame_equal(completo, antes)
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+import numpy as np
+import paralelo
+from paralelo import ejecutar_por_claves
+
+
+def _suma_por_clave(codigos, n_claves, importes):
+    return {"suma": np.bincount(codigos, importes, minlength=n_claves)}
+
+
+def _muere_en_worker(codigos, n_claves, importes):
+    # Simula un worker terminado por el sistema (p. ej. por falta de memoria); en el proceso principal calcula
+    if multiprocessing.parent_process() is not None:
+        os._exit(1)
+    return _suma_por_clave(codigos, n_claves, importes)
+
+
+def test_pool_roto_se_descarta_y_se_recrea():
+    codigos = np.arange(400) % 8
+    importes = np.arange(400, dtype=np.float64)
+    esperado = _suma_por_clave(codigos, 8, importes)["suma"]
+    try:
+        # El pool se rompe: esa llamada se resuelve en serie y el pool sale de la caché
+        resultado = ejecutar_por_claves(_muere_en_worker, codigos, 8, [importes], backend="procesos", workers=2)
+        np.testing.assert_allclose(resultado["suma"], esperado)
+        assert ("procesos", 2) not in paralelo._ejecutores
+
+        # La siguiente llamada usa un pool nuevo
+        resultado = ejecutar_por_claves(_suma_por_clave, codigos, 8, [importes], backend="procesos", workers=2)
+        np.testing.assert_allclose(resultado["suma"], esperado)
+        assert ("procesos", 2) in paralelo._ejecutores
+    finally:
+        paralelo.cerrar_ejecutores()
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datos import leer_ledger
+from esquema import conectar, crear_esquema
+from generador import generar_ledger_sintetico
+from helper import calcular_kpis, kpis_desde_buckets
+from importar import insertar_transacciones
+from snapshots import leer_sumas_por_bucket, reconstruir_snapshots
+
+CLAVES_KPIS = ["aporte_bruto_compras", "aporte_bruto_reinv", "aporte_neto", "beneficio_bruto", "beneficio_flotante", "valor_actual"]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    ruta = str(tmp_path / "cartera.db")
+    ledger = generar_ledger_sintetico(2000, n_activos=5, años=3, inicio="2023-01-01")
+    ledger["fecha_hora"] = ledger["fecha_hora"].dt.floor("s")
+    activo = ledger["activo"].iloc[0]
+    # Operaciones a medianoche justo en los límites de los rangos que se comprueban
+    extra = pd.DataFrame([
+        {"fecha_hora": pd.Timestamp("2025-09-01 00:00:00"), "activo": activo, "importe_euros": 1000.0, "tipo_operacion": "aporte", "subtipo_operacion": "compra"},
+        {"fecha_hora": pd.Timestamp("2024-03-01 00:00:00"), "activo": activo, "importe_euros": 500.0, "tipo_operacion": "aporte", "subtipo_operacion": "compra"}
+    ])
+    ledger = pd.concat([ledger, extra], ignore_index=True)
+
+    conn = conectar(ruta)
+    crear_esquema(conn)
+    with conn:
+        conn.executemany("INSERT INTO activos (activo) VALUES (?)", [(a,) for a in ledger["activo"].unique()])
+        insertar_transacciones(conn, ledger.replace({np.nan: None}).to_dict("records"))
+        reconstruir_snapshots(conn)
+    conn.close()
+    return ruta
+
+
+@pytest.mark.parametrize("inicio, fin", [
+    ("2023-01-01", "2025-09-01"),           # 00:00:00 del día final dentro del rango
+    ("2024-03-01", "2025-01-01"),           # medianoche del día inicial
+    ("2024-03-01 12:30:00", "2024-03-01 18:00:00"),
+    ("2024-02-28 08:00:00", "2024-03-01 00:00:00")
+])
+def test_kpis_de_snapshots_igual_que_del_ledger(db_path, inicio, fin):
+    inicio, fin = pd.Timestamp(inicio), pd.Timestamp(fin)
+    esperado = calcular_kpis(leer_ledger(db_path, inicio, fin))
+    conn = conectar(db_path)
+    try:
+        obtenido = kpis_desde_buckets(leer_sumas_por_bucket(conn, inicio, fin))
+    finally:
+        conn.close()
+    for clave in CLAVES_KPIS:
+        assert obtenido[clave] == pytest.approx(esperado[clave], abs=1e-6), clave
+
+
+def test_filtro_por_activos(db_path):
+    inicio, fin = pd.Timestamp("2023-06-01"), pd.Timestamp("2025-09-01")
+    ledger = leer_ledger(db_path, inicio, fin)
+    activos = sorted(ledger["activo"].astype(str).unique())[:2]
+    esperado = calcular_kpis(leer_ledger(db_path, inicio, fin, activos=activos))
+    conn = conectar(db_path)
+    try:
+        obtenido = kpis_desde_buckets(leer_sumas_por_bucket(conn, inicio, fin, activos))
+        assert leer_sumas_por_bucket(conn, inicio, fin, []).empty
+    finally:
+        conn.close()
+    for clave in CLAVES_KPIS:
+        assert obtenido[clave] == pytest.approx(esperado[clave], abs=1e-6), clave
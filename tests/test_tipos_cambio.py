@@ -0,0 +1,57 @@
+import sqlite3
+import pandas as pd
+import pytest
+import tipos_cambio
+from esquema import conectar, crear_esquema
+from tipos_cambio import ProveedorFijo, ServicioTiposCambio
+
+
+class ProveedorSinRed:
+    nombre = "sin-red"
+
+    def obtener(self, moneda, fechas):
+        raise ConnectionError("sin conexión")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    ruta = str(tmp_path / "cartera.db")
+    conn = conectar(ruta)
+    crear_esquema(conn)
+    conn.close()
+    return ruta
+
+
+def test_error_de_red_pasa_al_siguiente_proveedor(db_path):
+    servicio = ServicioTiposCambio(db_path, proveedores=[ProveedorSinRed(), ProveedorFijo({"USD": 1.1})])
+    tipos = servicio.obtener_lote(["USD", "EUR"], ["2024-01-02", "2024-01-02"])
+    assert tipos.tolist() == [1.1, 1.0]
+    assert "sin conexión" in servicio.ultimo_error
+
+
+def test_base_de_datos_bloqueada_no_rompe_el_lote(db_path, monkeypatch):
+    # Sin espera al bloqueo para que la escritura falle en el acto
+    def conectar_sin_espera(ruta, solo_lectura=False):
+        conn = conectar(ruta, solo_lectura)
+        conn.execute("PRAGMA busy_timeout = 0")
+        return conn
+    monkeypatch.setattr(tipos_cambio, "conectar", conectar_sin_espera)
+
+    bloqueo = sqlite3.connect(db_path)
+    bloqueo.execute("BEGIN EXCLUSIVE")
+    try:
+        servicio = ServicioTiposCambio(db_path, proveedores=[ProveedorFijo({"USD": {"2024-01-02": 1.1, "2024-01-03": 1.2}})])
+        tipos = servicio.obtener_lote(["USD", "USD", "EUR"], [pd.Timestamp("2024-01-02"), "2024-01-03", "2024-01-03"])
+        assert tipos.tolist() == [1.1, 1.2, 1.0]
+        assert "fx_rates" in servicio.ultimo_error
+        assert servicio.obtener("USD", "2024-01-02")["tipo_cambio"] == 1.1
+    finally:
+        bloqueo.rollback()
+        bloqueo.close()
+
+    # Con la base de datos libre, la siguiente descarga se guarda y deja de servirse desde memoria
+    servicio._descargar("USD", ["2024-01-02"])
+    assert ("USD", "2024-01-02") not in servicio._sin_guardar
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT tipo_cambio FROM fx_rates WHERE moneda = 'USD' AND fecha = '2024-01-02'").fetchone() == (1.1,)
+    conn.close()
@@ -0,0 +1,92 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import xirr_legado
+from helper import xirr, xirr_arrays, xirr_lote
+
+
+# === FLUJOS DEGENERADOS ===
+@pytest.mark.parametrize("guess", [0.1, 0.25, -0.5])
+def test_flujos_del_mismo_dia_no_tienen_tir(guess):
+    # VPN nulo con cualquier tasa: antes se devolvía la tasa de la rejilla más cercana a guess
+    flujos = [(datetime(2020, 1, 1, 10), -100.0), (datetime(2020, 1, 1, 18), 100.0)]
+    assert xirr(flujos, guess=guess) is None
+
+
+def test_flujos_del_mismo_dia_sin_saldo_nulo():
+    flujos = [(datetime(2020, 1, 1, 10), -100.0), (datetime(2020, 1, 1, 18), 150.0)]
+    assert xirr(flujos) is None
+
+
+def test_flujos_todos_nulos():
+    assert xirr_arrays(np.array(["2020-01-01", "2021-01-01"], dtype="datetime64[s]"), [0.0, 0.0]) is None
+
+
+# === CASOS CON SOLUCIÓN ===
+def test_tir_de_un_año():
+    flujos = [(datetime(2020, 1, 1), -100.0), (datetime(2020, 12, 31), 110.0)]
+    assert xirr(flujos) == pytest.approx(0.10, abs=1e-6)
+
+
+def test_raiz_exacta_en_la_rejilla_por_biseccion():
+    # Newton no arranca (guess <= -0.999) y la búsqueda acotada encuentra la raíz exacta en un punto de la rejilla
+    flujos = [(datetime(2020, 1, 1), -100.0), (datetime(2020, 12, 31), 125.0)]
+    assert xirr(flujos, guess=-0.9999) == pytest.approx(0.25, abs=1e-6)
+
+
+# === XIRR POR LOTES FRENTE A LA IMPLEMENTACIÓN ESCALAR ANTERIOR ===
+def _series_degeneradas():
+    # (fechas, importes) que la implementación anterior deja sin TIR: mismo día, todo ceros, un solo flujo,
+    # solo aportaciones
+    dia = np.datetime64("2023-10-25T00:00:00")
+    horas = np.timedelta64(1, "h")
+    return [
+        ([dia, dia + 8 * horas], [-100.0, 100.0]),
+        ([dia, dia + 2 * horas, dia + 9 * horas], [-250.0, -50.0, 300.0]),
+        ([dia, dia + 3 * horas], [-100.0, 40.0]),
+        ([dia, dia + np.timedelta64(400, "D")], [0.0, 0.0]),
+        ([dia], [-100.0]),
+        ([dia, dia + np.timedelta64(30, "D")], [-100.0, -50.0])
+    ]
+
+
+def _series_normales():
+    rng = np.random.default_rng(0)
+    series = []
+    for _ in range(20):
+        n = int(rng.integers(2, 12))
+        fechas = np.datetime64("2020-01-01T00:00:00") + np.sort(rng.integers(0, 2000, n)).astype("timedelta64[D]")
+        importes = -rng.uniform(100, 1000, n)
+        importes[-1] = -importes[:-1].sum() * rng.uniform(0.8, 1.6)
+        series.append((fechas, importes))
+    return series
+
+
+def _lote(series):
+    claves = np.concatenate([np.full(len(f), i) for i, (f, _) in enumerate(series)])
+    fechas = np.concatenate([np.asarray(f, dtype="datetime64[s]") for f, _ in series])
+    importes = np.concatenate([np.asarray(v, dtype=np.float64) for _, v in series])
+    return xirr_lote(claves, fechas, importes)
+
+
+def _legado(fechas, importes):
+    flujos = list(zip(pd.to_datetime(np.asarray(fechas, dtype="datetime64[s]")).to_pydatetime(), importes))
+    return xirr_legado(flujos)
+
+
+def test_lote_igual_que_legado_en_series_degeneradas():
+    series = _series_degeneradas()
+    tasas = _lote(series)
+    for i, (fechas, importes) in enumerate(series):
+        assert _legado(fechas, importes) is None
+        assert np.isnan(tasas[i]), f"serie {i}: {tasas[i]}"
+
+
+def test_lote_igual_que_legado_en_series_normales():
+    series = _series_normales()
+    tasas = _lote(series)
+    for i, (fechas, importes) in enumerate(series):
+        esperada = _legado(fechas, importes)
+        if esperada is not None:
+            assert tasas[i] == pytest.approx(esperada, abs=1e-5)
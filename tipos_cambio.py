@@ -0,0 +1,227 @@
+import logging
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+import pandas as pd
+import requests
+from esquema import DDL_FX_RATES, conectar
+
+# Convención de transacciones.tipo_cambio: unidades de la moneda por 1 EUR (importe_euros = importe_original / tipo_cambio)
+MONEDA_BASE = "EUR"
+TTL = timedelta(hours=12)
+TIMEOUT = 5
+
+_log = logging.getLogger(__name__)
+
+
+def _fecha(valor):
+    return pd.Timestamp(valor).strftime("%Y-%m-%d")
+
+
+# === PROVEEDORES ===
+# Un proveedor es cualquier objeto con "nombre" y obtener(moneda, fechas) -> {fecha "YYYY-MM-DD": tipo}.
+# Puede devolver solo parte de las fechas; las que falten se piden al siguiente proveedor de la lista
+class ProveedorExchangeRateApi:
+    # Solo el tipo del día (el histórico no está en el plan gratuito)
+    nombre = "exchangerate-api"
+
+    def __init__(self, clave="013d1a2c2928ad7aaa14e76c", timeout=TIMEOUT):
+        self.url = f"https://v6.exchangerate-api.com/v6/{clave}/latest/{MONEDA_BASE}"
+        self.timeout = timeout
+
+    def obtener(self, moneda, fechas):
+        hoy = date.today().isoformat()
+        if hoy not in fechas:
+            return {}
+        data = requests.get(self.url, timeout=self.timeout).json()
+        if data.get("result") != "success" or moneda not in data["conversion_rates"]:
+            return {}
+        return {hoy: float(data["conversion_rates"][moneda])}
+
+
+class ProveedorFrankfurter:
+    # Tipos de referencia del BCE: una sola petición para todo el rango de fechas pedido.
+    # Los días sin publicación (fines de semana, festivos) toman el último tipo anterior
+    nombre = "frankfurter"
+
+    def __init__(self, url="https://api.frankfurter.app", timeout=TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def obtener(self, moneda, fechas):
+        fechas = sorted(fechas)
+        desde = (date.fromisoformat(fechas[0]) - timedelta(days=7)).isoformat()
+        respuesta = requests.get(f"{self.url}/{desde}..{fechas[-1]}", params={"from": MONEDA_BASE, "to": moneda}, timeout=self.timeout)
+        publicados = pd.Series({dia: tipos[moneda] for dia, tipos in respuesta.json().get("rates", {}).items() if moneda in tipos})
+        if publicados.empty:
+            return {}
+        publicados = publicados.sort_index()
+        posiciones = publicados.index.searchsorted(fechas, side="right") - 1
+        return {fecha: float(publicados.iloc[p]) for fecha, p in zip(fechas, posiciones) if p >= 0}
+
+
+class ProveedorFijo:
+    # Proveedor local sin red, para pruebas o para trabajar sin conexión: {moneda: tipo} o {moneda: {fecha: tipo}}
+    nombre = "fijo"
+
+    def __init__(self, tipos):
+        self.tipos = tipos
+
+    def obtener(self, moneda, fechas):
+        tipos = self.tipos.get(moneda)
+        if isinstance(tipos, dict):
+            return {f: tipos[f] for f in fechas if f in tipos}
+        return {} if tipos is None else {f: float(tipos) for f in fechas}
+
+
+# === SERVICIO CON CACHÉ EN fx_rates ===
+class ServicioTiposCambio:
+    def __init__(self, db_path, proveedores=None, ttl=TTL, timeout=TIMEOUT):
+        self.db_path = db_path
+        self.proveedores = proveedores if proveedores is not None else [ProveedorExchangeRateApi(timeout=timeout), ProveedorFrankfurter(timeout=timeout)]
+        self.ttl = ttl
+        self.timeout = timeout
+        self.ultimo_error = None
+        self._refrescos = {}
+        self._lock = threading.Lock()
+        # Tipos descargados que no se pudieron guardar en fx_rates (base de datos bloqueada...): se sirven desde memoria
+        self._sin_guardar = {}
+
+    def _leer(self, moneda, fechas):
+        # La caché es una optimización: si no se puede leer, se trata como vacía y se descarga
+        filas = []
+        try:
+            conn = conectar(self.db_path)
+            try:
+                conn.execute(DDL_FX_RATES)
+                filas = conn.execute(
+                    f"SELECT fecha, tipo_cambio, proveedor, actualizado FROM fx_rates WHERE moneda = ? AND fecha IN ({', '.join('?' * len(fechas))})",
+                    [moneda, *fechas]
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            _log.warning("No se ha podido leer la caché fx_rates: %s", e)
+        leidos = {f: {"tipo_cambio": t, "proveedor": p, "actualizado": datetime.fromisoformat(a)} for f, t, p, a in filas}
+        with self._lock:
+            # Lo que está en memoria es más reciente que lo guardado (solo existe si falló la escritura)
+            leidos.update({f: self._sin_guardar[(moneda, f)] for f in fechas if (moneda, f) in self._sin_guardar})
+        return leidos
+
+    def _descargar(self, moneda, fechas):
+        # Recorre los proveedores hasta cubrir todas las fechas y guarda lo obtenido
+        pendientes, obtenidos = set(fechas), []
+        for proveedor in self.proveedores:
+            if not pendientes:
+                break
+            try:
+                tipos = proveedor.obtener(moneda, sorted(pendientes))
+            except Exception as e:
+                self.ultimo_error = f"{proveedor.nombre}: {e}"
+                continue
+            obtenidos += [(moneda, f, t, proveedor.nombre) for f, t in tipos.items() if f in pendientes]
+            pendientes -= tipos.keys()
+
+        if obtenidos:
+            ahora = datetime.now().isoformat(timespec="seconds")
+            try:
+                conn = conectar(self.db_path)
+                try:
+                    with conn:
+                        conn.execute(DDL_FX_RATES)
+                        conn.executemany("""
+                            INSERT INTO fx_rates (moneda, fecha, tipo_cambio, proveedor, actualizado) VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (moneda, fecha) DO UPDATE SET
+                                tipo_cambio = excluded.tipo_cambio, proveedor = excluded.proveedor, actualizado = excluded.actualizado
+                        """, [fila + (ahora,) for fila in obtenidos])
+                finally:
+                    conn.close()
+                guardados = True
+            except sqlite3.Error as e:
+                # No poder guardar no invalida lo descargado: se sirve desde memoria y se reintenta en la próxima descarga
+                self.ultimo_error = f"caché fx_rates: {e}"
+                _log.warning("No se han podido guardar los tipos de cambio en fx_rates: %s", e)
+                guardados = False
+            with self._lock:
+                for moneda_, fecha, tipo, proveedor in obtenidos:
+                    if guardados:
+                        self._sin_guardar.pop((moneda_, fecha), None)
+                    else:
+                        self._sin_guardar[(moneda_, fecha)] = {"tipo_cambio": tipo, "proveedor": proveedor, "actualizado": datetime.fromisoformat(ahora)}
+        return pendientes
+
+    def refrescar_en_segundo_plano(self, moneda, fecha):
+        # Un solo refresco en curso por (moneda, fecha); si falla se sigue sirviendo el valor de la caché
+        clave = (moneda, fecha)
+        with self._lock:
+            hilo = self._refrescos.get(clave)
+            if hilo is None or not hilo.is_alive():
+                hilo = threading.Thread(target=self._descargar, args=(moneda, [fecha]), daemon=True)
+                self._refrescos[clave] = hilo
+                hilo.start()
+        return hilo
+
+    def obtener(self, moneda, fecha=None):
+        # Devuelve {"tipo_cambio", "proveedor", "actualizado", "obsoleto"} o None si no hay ningún tipo disponible.
+        # Solo el tipo del día caduca (TTL); los históricos no cambian
+        if moneda == MONEDA_BASE:
+            return {"tipo_cambio": 1.0, "proveedor": None, "actualizado": None, "obsoleto": False}
+        fecha = _fecha(fecha or date.today())
+        es_hoy = fecha == date.today().isoformat()
+
+        cacheado = self._leer(moneda, [fecha]).get(fecha)
+        if cacheado and (not es_hoy or datetime.now() - cacheado["actualizado"] < self.ttl):
+            return {**cacheado, "obsoleto": False}
+
+        hilo = self.refrescar_en_segundo_plano(moneda, fecha)
+        if cacheado:
+            return {**cacheado, "obsoleto": True}
+
+        # Sin nada en caché: se espera al refresco como mucho "timeout" segundos
+        hilo.join(self.timeout)
+        cacheado = self._leer(moneda, [fecha]).get(fecha)
+        if cacheado:
+            return {**cacheado, "obsoleto": False}
+        if es_hoy:
+            # Último tipo conocido como respaldo
+            conn = conectar(self.db_path)
+            try:
+                fila = conn.execute(
+                    "SELECT fecha, tipo_cambio, proveedor, actualizado FROM fx_rates WHERE moneda = ? ORDER BY fecha DESC LIMIT 1", (moneda,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if fila:
+                return {"tipo_cambio": fila[1], "proveedor": fila[2], "actualizado": datetime.fromisoformat(fila[3]), "obsoleto": True}
+        return None
+
+    def obtener_lote(self, monedas, fechas):
+        # Tipos para muchas operaciones a la vez: una lectura de caché y una descarga por moneda.
+        # Devuelve una Serie alineada con la entrada (NaN donde no hay tipo)
+        pares = pd.DataFrame({"moneda": list(monedas), "fecha": [_fecha(f) for f in fechas]})
+        resultado = pd.Series(float("nan"), index=pares.index)
+        resultado[pares["moneda"] == MONEDA_BASE] = 1.0
+
+        for moneda, grupo in pares[pares["moneda"] != MONEDA_BASE].groupby("moneda"):
+            unicas = list(grupo["fecha"].unique())
+            tipos = {f: v["tipo_cambio"] for f, v in self._leer(moneda, unicas).items()}
+            faltan = [f for f in unicas if f not in tipos]
+            if faltan:
+                self._descargar(moneda, faltan)
+                tipos.update({f: v["tipo_cambio"] for f, v in self._leer(moneda, faltan).items()})
+            resultado[grupo.index] = grupo["fecha"].map(tipos).to_numpy(dtype=float)
+        return resultado
+
+
+def rellenar_tipos_cambio(conn, servicio):
+    # Completa tipo_cambio en las operaciones en divisa que no lo tienen, con una sola consulta al servicio
+    pendientes = conn.execute(
+        "SELECT id, moneda, fecha_hora FROM transacciones WHERE tipo_cambio IS NULL AND moneda IS NOT NULL AND moneda != ?", (MONEDA_BASE,)
+    ).fetchall()
+    if not pendientes:
+        return 0
+    ids, monedas, fechas = zip(*pendientes)
+    tipos = servicio.obtener_lote(monedas, fechas)
+    filas = [(float(t), i) for i, t in zip(ids, tipos) if pd.notna(t)]
+    conn.executemany("UPDATE transacciones SET tipo_cambio = ? WHERE id = ?", filas)
+    return len(filas)